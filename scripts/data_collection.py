@@ -1,65 +1,45 @@
 import itertools
 import pathlib
-import time
-import tqdm
-from udacity_gym import UdacitySimulator, UdacityGym, UdacityAction
-from udacity_gym.agent import PIDUdacityAgent
-from udacity_gym.agent_callback import LogObservationCallback
+
+from udacity_gym.collection import CollectionJob, CollectionOrchestrator
+from udacity_gym.simulator_pool import SimulatorPool
 
 if __name__ == '__main__':
 
     # Configuration settings
     host = "127.0.0.1"
-    port = 4567
+    base_port = 4567
+    num_simulators = 2
+    num_steps = 30000
     simulator_exe_path = "/home/banana/projects/self-driving-car-sim/Builds/udacity_linux.x86_64"
+    dataset_path = pathlib.Path("../udacity_dataset_4")
+
+    # Track settings, one job per scenario
+    jobs = [
+        CollectionJob(dataset_path.joinpath(f"{track}_{weather}_{daytime}"), track=track, weather=weather,
+                      daytime=daytime, num_steps=num_steps)
+        for track, daytime, weather in itertools.product(
+            ["lake", "jungle", "mountain"],
+            ["day", "daynight"],
+            ["sunny"],  # "rainy", "snowy", "foggy"],
+        )
+    ]
 
-    # Creating the simulator wrapper
-    simulator = UdacitySimulator(
+    # One simulator per port, each one records a job at a time
+    simulator_pool = SimulatorPool(
         sim_exe_path=simulator_exe_path,
+        num_simulators=num_simulators,
         host=host,
-        port=port,
+        base_port=base_port,
     )
-
-    # Creating the gym environment
-    env = UdacityGym(
-        simulator=simulator,
+    orchestrator = CollectionOrchestrator(
+        pool=simulator_pool,
+        jobs=jobs,
+        kp=0.07,
+        kd=0.95,
+        ki=0.000001,
     )
-    simulator.start()
-
-    # Track settings
-    for track, daytime, weather in itertools.product(
-            ["lake", "jungle", "mountain"],
-            ["day", "daynight"],
-            ["sunny"], # "rainy", "snowy", "foggy"],
-    ):
-
-        observation, _ = env.reset(track=f"{track}", weather=f"{weather}", daytime=f"{daytime}")
-
-        # Wait for environment to set up
-        while not observation or not observation.is_ready():
-            observation = env.observe()
-            print("Waiting for environment to set up...")
-            time.sleep(1)
-
-        if pathlib.Path(f"../udacity_dataset_4/{track}_{weather}_{daytime}").exists():
-            continue
-        log_observation_callback = LogObservationCallback(pathlib.Path(f"../udacity_dataset_4/{track}_{weather}_{daytime}"))
-        agent = PIDUdacityAgent(kp=0.07, kd=0.95, ki=0.000001,
-                                before_action_callbacks=[],
-                                after_action_callbacks=[log_observation_callback])
-
-        # Interacting with the gym environment
-        for _ in tqdm.tqdm(range(30000)):
-            action = agent(observation)
-            last_observation = observation
-            observation, reward, terminated, truncated, info = env.step(action)
-
-            while observation.time == last_observation.time:
-                observation = env.observe()
-                time.sleep(0.005)
-
-        log_observation_callback.save()
-
-    simulator.close()
-    env.close()
+    status = orchestrator.run()
+    simulator_pool.close()
+    print(status)
     print("Experiment concluded.")
@@ -0,0 +1,43 @@
+import pathlib
+
+from udacity_gym.gain_sweep import GainSweepRunner, gain_grid
+from udacity_gym.simulator_pool import SimulatorPool
+
+if __name__ == '__main__':
+
+    # Configuration settings
+    host = "127.0.0.1"
+    base_port = 4567
+    num_simulators = 4
+    simulator_exe_path = "/home/banana/projects/self-driving-car-sim/Builds/udacity_linux.x86_64"
+    result_file = pathlib.Path("../gain_sweep/lake_sunny_day.csv")
+
+    # Gains around the hand-picked values of data_collection.py
+    gains = gain_grid(
+        kp_values=[0.03, 0.05, 0.07, 0.09, 0.12],
+        kd_values=[0.6, 0.8, 0.95, 1.2],
+        ki_values=[0.0, 0.000001],
+    )
+
+    simulator_pool = SimulatorPool(
+        sim_exe_path=simulator_exe_path,
+        num_simulators=num_simulators,
+        host=host,
+        base_port=base_port,
+    )
+    runner = GainSweepRunner(
+        pool=simulator_pool,
+        gains=gains,
+        max_steps=2000,
+        max_abs_cte=3.0,
+        patience=10,
+        track="lake",
+        weather="sunny",
+        daytime="day",
+    )
+    ranking = runner.run()
+    simulator_pool.close()
+
+    result_file.parent.mkdir(parents=True, exist_ok=True)
+    ranking.to_csv(result_file, index=False)
+    print(ranking.head(10))
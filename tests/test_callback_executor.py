@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from udacity_gym.callback_executor import CallbackExecutor
+
+
+class RecordingCallback:
+    """
+    Deferred callback recording the observations it receives, the first call waits for release.
+    """
+
+    name = 'recording'
+    deferred = True
+
+    def __init__(self):
+        self.observations = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, observation, *args, **kwargs):
+        if not self.started.is_set():
+            self.started.set()
+            self.release.wait(10)
+        self.observations.append(observation)
+
+
+def fill_queue(overflow_policy: str, num_calls: int, **kwargs) -> tuple[CallbackExecutor, RecordingCallback]:
+    """
+    Submit num_calls observations 1, 2, ... while the only worker is busy with observation 0.
+    """
+    executor = CallbackExecutor(num_workers=1, max_queue_size=2, overflow_policy=overflow_policy, **kwargs)
+    callback = RecordingCallback()
+    executor.submit(callback, 0)
+    assert callback.started.wait(10)
+    for observation in range(1, num_calls + 1):
+        executor.submit(callback, observation)
+    return executor, callback
+
+
+def test_drop_oldest_keeps_the_latest_calls():
+    executor, callback = fill_queue('drop_oldest', 5)
+    assert executor.stats()['dropped'] == 3
+    callback.release.set()
+    executor.close()
+    assert callback.observations == [0, 4, 5]
+
+
+def test_sample_keeps_one_overflowing_call_every_sample_every():
+    executor, callback = fill_queue('sample', 6, sample_every=2)
+    # 3 and 5 are discarded, 4 and 6 replace the oldest queued calls, 1 and 2
+    assert executor.stats()['dropped'] == 4
+    callback.release.set()
+    executor.close()
+    assert callback.observations == [0, 4, 6]
+
+
+def test_block_waits_for_a_free_slot():
+    executor, callback = fill_queue('block', 2)
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (executor.submit(callback, 3), submitted.set()))
+    thread.start()
+    time.sleep(0.1)
+    assert not submitted.is_set()
+    callback.release.set()
+    thread.join(10)
+    assert submitted.is_set()
+    executor.close()
+    assert callback.observations == [0, 1, 2, 3]
+    assert executor.stats()['dropped'] == 0
+
+
+def test_failing_callbacks():
+    executor = CallbackExecutor()
+
+    def inline(observation):
+        raise ValueError(observation)
+
+    def deferred(observation):
+        raise ValueError(observation)
+
+    deferred.deferred = True
+    # Inline errors reach the control loop, deferred ones are logged and counted
+    with pytest.raises(ValueError):
+        executor.submit(inline, 1)
+    executor.submit(deferred, 2)
+    executor.close()
+    callbacks = executor.stats()['callbacks']
+    assert (callbacks['inline']['calls'], callbacks['inline']['errors']) == (1, 0)
+    assert (callbacks['deferred']['calls'], callbacks['deferred']['errors']) == (1, 1)
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError, match='overflow policy'):
+        CallbackExecutor(overflow_policy='drop_newest')
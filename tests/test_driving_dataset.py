@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip('torchvision')
+
+from torch.utils.data import DataLoader
+
+from udacity_gym.extras.data.driving_dataset import BatchedConcatDataset
+from udacity_gym.extras.data.sharding import shard_dataset
+
+
+class BatchedDataset:
+    """
+    Samples (name, index), fetched in batches, recording the batches it receives.
+    """
+
+    def __init__(self, name: str, length: int):
+        self.name = name
+        self.length = length
+        self.batches = []
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        raise AssertionError("Samples must be fetched in batches")
+
+    def __getitems__(self, indexes: list) -> list:
+        self.batches.append(list(indexes))
+        return [(self.name, idx) for idx in indexes]
+
+    def shard(self, rank: int, world_size: int):
+        return BatchedDataset(self.name, len(range(rank, self.length, world_size)))
+
+
+def test_mixed_batch_keeps_the_sample_order():
+    first, second = BatchedDataset('first', 3), BatchedDataset('second', 4)
+    plain = [('plain', idx) for idx in range(2)]
+    dataset = BatchedConcatDataset([first, plain, second])
+    samples = dataset.__getitems__([5, 0, 3, 8, 2, 4, -1])
+    assert samples == [('second', 0), ('first', 0), ('plain', 0), ('second', 3), ('first', 2), ('plain', 1),
+                       ('second', 3)]
+    # One batched call per dataset, with the positions in the dataset
+    assert first.batches == [[0, 2]]
+    assert second.batches == [[0, 3, 3]]
+
+
+def test_sharding_keeps_the_batched_fetch():
+    dataset = BatchedConcatDataset([BatchedDataset('first', 4), BatchedDataset('second', 3)])
+    shard = shard_dataset(dataset, rank=1, world_size=2)
+    assert isinstance(shard, BatchedConcatDataset)
+    assert len(shard) == 3
+    assert shard.__getitems__([2, 0]) == [('second', 0), ('first', 0)]
+
+
+def test_data_loader_fetches_batches():
+    first, second = BatchedDataset('first', 3), BatchedDataset('second', 3)
+    loader = DataLoader(BatchedConcatDataset([first, second]), batch_size=4, collate_fn=list)
+    assert [sample for batch in loader for sample in batch] == [('first', 0), ('first', 1), ('first', 2),
+                                                                 ('second', 0), ('second', 1), ('second', 2)]
+    assert first.batches == [[0, 1, 2]]
+    assert second.batches == [[0], [1, 2]]
@@ -0,0 +1,53 @@
+import pytest
+
+pyarrow = pytest.importorskip('pyarrow')
+
+from udacity_gym.metrics_writer import create_metrics_writer
+
+
+def read_rows(path, format: str) -> list[dict]:
+    if format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(path).to_pylist()
+    import pyarrow.ipc
+    return pyarrow.ipc.open_file(str(path)).read_all().to_pylist()
+
+
+def write_rows(path, format: str, rows: list[dict], **kwargs):
+    writer = create_metrics_writer(path, format=format, flush_every=2, flush_interval=3600, **kwargs)
+    for row in rows:
+        writer.append(row)
+    writer.close()
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_column_empty_in_first_chunk(tmp_path, format):
+    rows = [
+        {'time': 1, 'cte': 0.1, 'shadow_predicted_steering_angle': None, 'segmentation_filename': None},
+        {'time': 2, 'cte': 0.2, 'shadow_predicted_steering_angle': None, 'segmentation_filename': None},
+        {'time': 3, 'cte': 0.3, 'shadow_predicted_steering_angle': 0.25, 'segmentation_filename': 'segmentation_3.png'},
+    ]
+    path = tmp_path.joinpath(f"log.{format}")
+    write_rows(path, format, rows)
+    assert read_rows(path, format) == rows
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_integer_values_followed_by_float(tmp_path, format):
+    rows = [
+        {'time': 1, 'steering_angle': 0, 'lap': 1},
+        {'time': 2, 'steering_angle': 1, 'lap': 1},
+        {'time': 3, 'steering_angle': 0.5, 'lap': 2},
+    ]
+    path = tmp_path.joinpath(f"log.{format}")
+    write_rows(path, format, rows)
+    written = read_rows(path, format)
+    assert [row['steering_angle'] for row in written] == [0.0, 1.0, 0.5]
+    assert [row['lap'] for row in written] == [1, 1, 2]
+
+
+def test_integer_column_rejects_fractions(tmp_path):
+    writer = create_metrics_writer(tmp_path.joinpath('log.parquet'), format='parquet', flush_every=1)
+    writer.append({'time': 1, 'lap': 1})
+    with pytest.raises(ValueError, match='lap'):
+        writer.append({'time': 2, 'lap': 1.5})
@@ -0,0 +1,73 @@
+import io
+import tarfile
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from PIL import Image
+
+from udacity_gym.shards import ShardReader, ShardWriter
+
+
+def image_bytes(value: int, format: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 4), (value, value, value)).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def write_frames(path, num_frames: int, max_shard_size: int) -> list[tuple]:
+    frames = [(1000 + i, image_bytes(i, 'JPEG'), image_bytes(i, 'PNG') if i % 2 == 0 else None)
+              for i in range(num_frames)]
+    writer = ShardWriter(path, max_shard_size=max_shard_size, fsync=False)
+    for time, image, segmentation in frames:
+        writer.write(time, image, segmentation)
+    writer.close()
+    return frames
+
+
+def test_round_trip_across_shard_rollover(tmp_path):
+    # A shard exceeds max_shard_size after one or two frames
+    frames = write_frames(tmp_path, 7, max_shard_size=4 * tarfile.BLOCKSIZE)
+    reader = ShardReader(tmp_path)
+    assert len(reader) == len(frames)
+    assert len(set(reader.index['shard'].tolist())) > 1
+    for index, (time, image, segmentation) in enumerate(frames):
+        assert reader.read_image_bytes(index) == image
+        assert reader.read_segmentation_bytes(index) == segmentation
+    assert list(reader.stream(2, 5)) == frames[2:5]
+    reader.close()
+
+
+def test_shards_are_valid_tar_files(tmp_path):
+    frames = write_frames(tmp_path, 5, max_shard_size=4 * tarfile.BLOCKSIZE)
+    members = {}
+    for shard_path in sorted(tmp_path.glob('shard_*.tar')):
+        with tarfile.open(shard_path) as tar:
+            for member in tar.getmembers():
+                members[member.name] = tar.extractfile(member).read()
+    for time, image, segmentation in frames:
+        assert members[f"image_{time:020d}.jpg"] == image
+        if segmentation is not None:
+            assert members[f"segmentation_{time:020d}.png"] == segmentation
+
+
+def test_index_only_covers_flushed_frames(tmp_path):
+    writer = ShardWriter(tmp_path, fsync=False)
+    writer.write(0, image_bytes(0, 'JPEG'))
+    writer.flush()
+    writer.write(1, image_bytes(1, 'JPEG'))
+    assert len(ShardReader(tmp_path)) == 1
+    writer.close()
+    assert len(ShardReader(tmp_path)) == 2
+
+
+def test_encoded_images(tmp_path):
+    writer = ShardWriter(tmp_path, fsync=False)
+    writer.write(0, Image.new('RGB', (8, 4), (255, 0, 0)), Image.new('RGB', (8, 4), (0, 0, 255)))
+    writer.close()
+    reader = ShardReader(tmp_path)
+    image, segmentation = reader[0]
+    assert (image.format, image.size) == ('JPEG', (8, 4))
+    assert segmentation.format == 'PNG' and segmentation.getpixel((0, 0)) == (0, 0, 255)
+    reader.close()
@@ -0,0 +1,82 @@
+import multiprocessing
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+
+from udacity_gym.extras.data.shared_cache import SharedFrameCache
+
+FRAME_SHAPE = (2, 2, 3)
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full(FRAME_SHAPE, value, dtype=np.uint8)
+
+
+def put_frame(cache: SharedFrameCache, key: int, value: int):
+    cache.put(key, frame(value))
+
+
+@pytest.fixture
+def cache():
+    # Room for two frames
+    cache = SharedFrameCache(num_keys=4, max_bytes=2 * frame(0).nbytes, frame_shape=FRAME_SHAPE,
+                             multiprocessing_context='spawn')
+    yield cache
+    cache.close()
+
+
+def test_hit_and_miss(cache):
+    assert cache.put(0, frame(10))
+    assert np.array_equal(cache.get(0), frame(10))
+    assert cache.get(1) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['frames']) == (1, 1, 1)
+
+
+def test_least_recently_used_frame_is_evicted(cache):
+    cache.put(0, frame(10))
+    cache.put(1, frame(11))
+    # Reading 0 makes 1 the least recently used frame
+    cache.get(0)
+    cache.put(2, frame(12))
+    assert cache.get(1) is None
+    assert np.array_equal(cache.get(0), frame(10))
+    assert np.array_equal(cache.get(2), frame(12))
+    assert cache.stats()['evictions'] == 1
+
+
+def test_put_after_evict(cache):
+    cache.put(0, frame(10))
+    cache.put(1, frame(11))
+    cache.put(2, frame(12))
+    # 0 was evicted, putting it back evicts 1 and leaves the other slots consistent
+    cache.put(0, frame(20))
+    assert cache.get(1) is None
+    assert np.array_equal(cache.get(0), frame(20))
+    assert np.array_equal(cache.get(2), frame(12))
+    stats = cache.stats()
+    assert (stats['inserts'], stats['evictions'], stats['frames']) == (4, 2, 2)
+
+
+def test_put_existing_key_replaces_its_frame(cache):
+    cache.put(0, frame(10))
+    cache.put(0, frame(20))
+    assert np.array_equal(cache.get(0), frame(20))
+    assert cache.stats()['inserts'] == 1
+
+
+def test_other_shapes_are_not_cached(cache):
+    assert not cache.put(0, np.zeros((1, 2, 3), dtype=np.uint8))
+    assert not cache.put(0, frame(10).astype(np.float32))
+    assert cache.get(0) is None
+
+
+def test_frames_are_shared_with_spawned_processes(cache):
+    process = multiprocessing.get_context('spawn').Process(target=put_frame, args=(cache, 3, 13))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+    assert np.array_equal(cache.get(3), frame(13))
+    assert cache.stats()['inserts'] == 1
@@ -1,6 +1,18 @@
 from .action import UdacityAction
 from .observation import UdacityObservation
-from .executor import UdacityExecutor
-from .gym import UdacityGym
-from .simulator import UdacitySimulator
-from .unity_process import UnityProcess
+
+# The executor monkey patches the standard library with eventlet, which stalls DataLoader workers and
+# process pools. The simulator classes are imported on first use, training code never triggers the patch.
+_LAZY_IMPORTS = {
+    'UdacityExecutor': '.executor',
+    'UdacityGym': '.gym',
+    'UdacitySimulator': '.simulator',
+    'UnityProcess': '.unity_process',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,32 +1,39 @@
 import pathlib
+import numpy as np
 import torchvision
 
-from .extras.model.lane_keeping.chauffeur.chauffeur_model import Chauffeur
-from .extras.model.lane_keeping.dave.dave_model import Dave2
 # import pygame
 # import torch
 # import torchvision
 
 from .action import UdacityAction
-from .extras.model.lane_keeping.epoch.epoch_model import Epoch
-from .extras.model.lane_keeping.vit.vit_model import ViT
+from .callback_executor import CallbackExecutor
+from .extras.model.lane_keeping.registry import load_model
 from .observation import UdacityObservation
 
 
 class UdacityAgent:
 
-    def __init__(self, before_action_callbacks=None, after_action_callbacks=None, transform_callbacks=None):
+    def __init__(self, before_action_callbacks=None, after_action_callbacks=None, transform_callbacks=None,
+                 callback_executor: CallbackExecutor = None):
         self.before_action_callbacks = before_action_callbacks if before_action_callbacks is not None else []
         self.after_action_callbacks = after_action_callbacks if after_action_callbacks is not None else []
         self.transform_callbacks = transform_callbacks if transform_callbacks is not None else []
+        # Without an executor every callback runs inline
+        self.callback_executor = callback_executor
+
+    def _run_callbacks(self, callbacks, observation: UdacityObservation, *args, **kwargs):
+        for callback in callbacks:
+            if self.callback_executor is not None:
+                self.callback_executor.submit(callback, observation, *args, **kwargs)
+            else:
+                callback(observation, *args, **kwargs)
 
     def on_before_action(self, observation: UdacityObservation, *args, **kwargs):
-        for callback in self.before_action_callbacks:
-            callback(observation, *args, **kwargs)
+        self._run_callbacks(self.before_action_callbacks, observation, *args, **kwargs)
 
     def on_after_action(self, observation: UdacityObservation, *args, **kwargs):
-        for callback in self.after_action_callbacks:
-            callback(observation, *args, **kwargs)
+        self._run_callbacks(self.after_action_callbacks, observation, *args, **kwargs)
 
     def on_transform_observation(self, observation: UdacityObservation, *args, **kwargs):
         for callback in self.transform_callbacks:
@@ -48,8 +55,8 @@ class UdacityAgent:
 
 class PIDUdacityAgent(UdacityAgent):
 
-    def __init__(self, kp, kd, ki, before_action_callbacks=None, after_action_callbacks=None):
-        super().__init__(before_action_callbacks, after_action_callbacks)
+    def __init__(self, kp, kd, ki, before_action_callbacks=None, after_action_callbacks=None, callback_executor=None):
+        super().__init__(before_action_callbacks, after_action_callbacks, callback_executor=callback_executor)
         self.kp = kp  # Proportional gain
         self.kd = kd  # Derivative gain
         self.ki = ki  # Integral gain
@@ -87,20 +94,78 @@ class PIDUdacityAgent(UdacityAgent):
 
         return UdacityAction(steering_angle=steering_angle, throttle=throttle)
 
+
+class BatchPIDController:
+    """
+    Vectorized version of the PIDUdacityAgent control law, stepping B controllers at once.
+    Gains can be scalars or arrays of shape (B,), the controller state is stored in arrays of shape (B,).
+    """
+
+    def __init__(self, kp, kd, ki, batch_size: int = None, skip_frame: int = 4):
+        if batch_size is None:
+            batch_size = np.broadcast(np.asarray(kp), np.asarray(kd), np.asarray(ki)).size
+        self.batch_size = batch_size
+        self.kp = np.broadcast_to(np.asarray(kp, dtype=np.float64), (batch_size,)).copy()
+        self.kd = np.broadcast_to(np.asarray(kd, dtype=np.float64), (batch_size,)).copy()
+        self.ki = np.broadcast_to(np.asarray(ki, dtype=np.float64), (batch_size,)).copy()
+        self.skip_frame = skip_frame
+
+        self.prev_error = np.zeros(batch_size)
+        self.total_error = np.zeros(batch_size)
+        self.curr_sector = np.zeros(batch_size, dtype=np.int64)
+        self.curr_skip_frame = np.zeros(batch_size, dtype=np.int64)
+
+    def reset(self, mask=None):
+        mask = slice(None) if mask is None else mask
+        self.prev_error[mask] = 0.0
+        self.total_error[mask] = 0.0
+        self.curr_sector[mask] = 0
+        self.curr_skip_frame[mask] = 0
+
+    def set_gains(self, index, kp, kd, ki):
+        self.kp[index] = kp
+        self.kd[index] = kd
+        self.ki[index] = ki
+        self.reset(index)
+
+    def step(self, cte, next_cte, sector, mask=None):
+        """
+        Return the steering angles, of shape (B,), for the given cte, next_cte and sector arrays.
+        Only controllers selected by the boolean mask update their state.
+        """
+        cte = np.asarray(cte, dtype=np.float64)
+        next_cte = np.asarray(next_cte, dtype=np.float64)
+        sector = np.asarray(sector, dtype=np.int64)
+        mask = np.ones(self.batch_size, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+        changed_sector = sector != self.curr_sector
+        skipping = changed_sector & (self.curr_skip_frame < self.skip_frame)
+        switching = changed_sector & ~skipping
+        error = np.where(changed_sector, cte, (next_cte + cte) / 2)
+        diff_err = error - self.prev_error
+
+        # Calculate steering angle
+        steering_angle = - (self.kp * error) - (self.kd * diff_err) - (self.ki * self.total_error)
+        steering_angle = np.clip(steering_angle, -1, 1)
+
+        # Save state for next prediction
+        curr_skip_frame = np.where(skipping, self.curr_skip_frame + 1, np.where(switching, 0, self.curr_skip_frame))
+        self.curr_skip_frame = np.where(mask, curr_skip_frame, self.curr_skip_frame)
+        self.curr_sector = np.where(mask & switching, sector, self.curr_sector)
+        self.total_error = np.where(mask, (self.total_error + error) * 0.99, self.total_error)
+        self.prev_error = np.where(mask, error, self.prev_error)
+
+        return steering_angle
+
+
 class EndToEndLaneKeepingAgent(UdacityAgent):
 
     def __init__(self, model_name, checkpoint_path, before_action_callbacks=None, after_action_callbacks=None,
-                 transform_callbacks=None):
-        super().__init__(before_action_callbacks, after_action_callbacks, transform_callbacks)
+                 transform_callbacks=None, map_location=None, callback_executor=None):
+        super().__init__(before_action_callbacks, after_action_callbacks, transform_callbacks, callback_executor)
         self.checkpoint_path = pathlib.Path(checkpoint_path)
-        if model_name == "dave2":
-            self.model = Dave2.load_from_checkpoint(self.checkpoint_path)
-        if model_name == "epoch":
-            self.model = Epoch.load_from_checkpoint(self.checkpoint_path)
-        if model_name == "chauffeur":
-            self.model = Chauffeur.load_from_checkpoint(self.checkpoint_path)
-        if model_name == "vit":
-            self.model = ViT.load_from_checkpoint(self.checkpoint_path)
+        # Models are cached by the registry, rebuilding the agent does not reload the checkpoint
+        self.model = load_model(model_name, self.checkpoint_path, map_location=map_location)
 
     def action(self, observation: UdacityObservation, *args, **kwargs):
 
@@ -118,10 +183,10 @@ class EndToEndLaneKeepingAgent(UdacityAgent):
 class DaveUdacityAgent(UdacityAgent):
 
     def __init__(self, checkpoint_path, before_action_callbacks=None, after_action_callbacks=None,
-                 transform_callbacks=None):
-        super().__init__(before_action_callbacks, after_action_callbacks, transform_callbacks)
+                 transform_callbacks=None, map_location=None, callback_executor=None):
+        super().__init__(before_action_callbacks, after_action_callbacks, transform_callbacks, callback_executor)
         self.checkpoint_path = pathlib.Path(checkpoint_path)
-        self.model = Dave2.load_from_checkpoint(self.checkpoint_path)
+        self.model = load_model("dave2", self.checkpoint_path, map_location=map_location)
 
     def action(self, observation: UdacityObservation, *args, **kwargs):
 
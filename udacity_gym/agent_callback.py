@@ -1,21 +1,26 @@
 import pathlib
+import time
 from typing import Callable
 
 import numpy as np
-import pandas as pd
-import pygame
 import torch
 import torchvision
 
 from udacity_gym import UdacityObservation, UdacitySimulator
+from udacity_gym.image_writer import AsyncImageWriter, WriteStatistics, write_image
+from udacity_gym.live_viewer import LiveViewer
 from udacity_gym.logger import CustomLogger
+from udacity_gym.metrics_writer import METRICS_FORMATS, create_metrics_writer
+from udacity_gym.shards import ShardWriter
 
 
 class AgentCallback:
 
-    def __init__(self, name: str, verbose: bool = False):
+    def __init__(self, name: str, verbose: bool = False, deferred: bool = False):
         self.name = name
         self.verbose = verbose
+        # Deferred callbacks are run outside the control loop by a CallbackExecutor
+        self.deferred = deferred
         self.logger = CustomLogger(str(self.__class__))
 
     def __call__(self, observation: UdacityObservation, *args, **kwargs):
@@ -47,35 +52,67 @@ class ResumeSimulationCallback(AgentCallback):
 
 class LogObservationCallback(AgentCallback):
 
-    def __init__(self, path, enable_pygame_logging=False):
-        super().__init__('log_observation')
+    def __init__(self, path, enable_pygame_logging=False, deferred=False, image_writer: AsyncImageWriter = None,
+                 log_format: str = 'csv', flush_every: int = 100, flush_interval: float = 5.0,
+                 recording_format: str = 'files', max_shard_size: int = 1 << 30, append: bool = False):
+        super().__init__('log_observation', deferred=deferred)
+        if recording_format not in ['files', 'shards']:
+            raise ValueError(f"Unknown recording format '{recording_format}', choose between 'files' and 'shards'")
+        if recording_format == 'shards' and image_writer is not None:
+            raise ValueError("An image writer cannot be used with the 'shards' recording format")
+        if append and (recording_format != 'files' or log_format != 'csv'):
+            raise ValueError("Only 'files' recordings with 'csv' metrics can be appended to")
+        # Images are encoded in background processes when an image writer is provided
+        self.image_writer = image_writer
+        self.write_statistics = WriteStatistics()
         # Path initialization
         self.path = pathlib.Path(path)
         self.image_path = self.path.joinpath("image")
         self.segmentation_path = self.path.joinpath("segmentation")
-        self.image_path.mkdir(parents=True, exist_ok=True)
-        self.segmentation_path.mkdir(parents=True, exist_ok=True)
-        self.logs = []
-        self.logging_file = self.path.joinpath('log.csv')
+        # Frames are either written one file each, or appended to tar shards in path
+        self.recording_format = recording_format
+        if self.recording_format == 'shards':
+            self.shard_writer = ShardWriter(self.path, max_shard_size=max_shard_size)
+        else:
+            self.shard_writer = None
+            self.image_path.mkdir(parents=True, exist_ok=True)
+            self.segmentation_path.mkdir(parents=True, exist_ok=True)
+        # Metrics are streamed to disk every flush_every frames or flush_interval seconds
+        self.logging_file = self.path.joinpath(f'log{METRICS_FORMATS[log_format]}')
+        # With append=True an interrupted recording is continued, keeping the rows already on disk
+        self.metrics_writer = create_metrics_writer(
+            self.logging_file, format=log_format, flush_every=flush_every, flush_interval=flush_interval,
+            before_flush=self.flush_images, **({'append': True} if append else {}),
+        )
+        # Frames are displayed by a separate viewer process, the callback only publishes them
         self.enable_pygame_logging = enable_pygame_logging
-        if self.enable_pygame_logging:
-            pygame.init()
-            self.screen = pygame.display.set_mode((320, 160))
-            camera_surface = pygame.surface.Surface((320, 160), 0, 24).convert()
-            self.screen.blit(camera_surface, (0, 0))
+        self.live_viewer = LiveViewer() if self.enable_pygame_logging else None
 
     def __call__(self, observation: UdacityObservation, *args, **kwargs):
         super().__call__(observation, *args, **kwargs)
         metrics = observation.get_metrics()
 
-        image_name = f"image_{observation.time:020d}.jpg"
-        observation.input_image.save(self.image_path.joinpath(image_name))
-        metrics['image_filename'] = image_name
+        # Untransformed frames are stored with the JPEG bytes sent by the simulator, without re-encoding
+        if observation.input_image_bytes is not None:
+            image = observation.input_image_bytes
+        else:
+            image = observation.input_image
 
-        if observation.semantic_segmentation is not None:
-            segmentation_name = f"segmentation_{observation.time:020d}.png"
-            observation.semantic_segmentation.save(self.segmentation_path.joinpath(segmentation_name))
-            metrics['segmentation_filename'] = segmentation_name
+        image_name = f"image_{observation.time:020d}.jpg"
+        segmentation_name = f"segmentation_{observation.time:020d}.png"
+        if self.shard_writer is not None:
+            start_time = time.thread_time()
+            metrics['frame'] = self.shard_writer.write(observation.time, image, observation.semantic_segmentation)
+            self.write_statistics.update(image, time.thread_time() - start_time)
+            metrics['image_filename'] = image_name
+            if observation.semantic_segmentation is not None:
+                metrics['segmentation_filename'] = segmentation_name
+        else:
+            self.save_image(image, self.image_path.joinpath(image_name))
+            metrics['image_filename'] = image_name
+            if observation.semantic_segmentation is not None:
+                self.save_image(observation.semantic_segmentation, self.segmentation_path.joinpath(segmentation_name))
+                metrics['segmentation_filename'] = segmentation_name
 
         if 'action' in kwargs.keys():
             metrics['predicted_steering_angle'] = kwargs['action'].steering_angle
@@ -83,20 +120,47 @@ class LogObservationCallback(AgentCallback):
         if 'shadow_action' in kwargs.keys():
             metrics['shadow_predicted_steering_angle'] = kwargs['shadow_action'].steering_angle
             metrics['shadow_predicted_throttle'] = kwargs['shadow_action'].throttle
-        self.logs.append(metrics)
-
-        if self.enable_pygame_logging:
-            pixel_array = np.swapaxes(np.array(observation.input_image), 0, 1)
-            new_surface = pygame.pixelcopy.make_surface(pixel_array)
-            self.screen.blit(new_surface, (0, 0))
-            pygame.display.flip()
+        self.metrics_writer.append(metrics)
+
+        if self.live_viewer is not None:
+            action = kwargs.get('action', None)
+            self.live_viewer.publish(
+                image if isinstance(image, bytes) else np.asarray(image),
+                steering=action.steering_angle if action is not None else observation.steering_angle,
+                throttle=action.throttle if action is not None else observation.throttle,
+                speed=observation.speed,
+                cte=observation.cte,
+            )
+
+    def save_image(self, image, path):
+        if self.image_writer is not None:
+            self.image_writer.submit(image, path)
+        else:
+            self.write_statistics.update(image, write_image(image, path))
+
+    def flush_images(self):
+        # Rows only reach the disk after the images they reference
+        if self.image_writer is not None:
+            self.image_writer.flush()
+        if self.shard_writer is not None:
+            self.shard_writer.flush()
 
     def save(self):
-        logging_dataframe = pd.DataFrame(self.logs)
-        logging_dataframe = logging_dataframe.set_index('time', drop=True)
-        logging_dataframe.to_csv(self.logging_file)
-        if self.enable_pygame_logging:
-            pygame.quit()
+        self.metrics_writer.close()
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+        if self.image_writer is not None:
+            stats = self.image_writer.stats()
+            self.logger.info(f"Images written: {stats['written']}, dropped: {stats['dropped']}, "
+                             f"failed: {stats['failed']}")
+        else:
+            stats = self.write_statistics.to_dict()
+        self.logger.info(f"Passthrough frames: {stats['passthrough_frames']} "
+                         f"({stats['passthrough_cpu_ms_per_frame']:.3f} CPU ms/frame), "
+                         f"re-encoded frames: {stats['encoded_frames']} "
+                         f"({stats['encoded_cpu_ms_per_frame']:.3f} CPU ms/frame)")
+        if self.live_viewer is not None:
+            self.live_viewer.close()
 
 
 class TransformObservationCallback(AgentCallback):
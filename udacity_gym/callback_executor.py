@@ -0,0 +1,166 @@
+import collections
+import copy
+import time
+
+from .logger import CustomLogger
+from .native_threading import threading
+from .workers import ProcessWorker
+
+OVERFLOW_POLICIES = ['block', 'drop_oldest', 'sample']
+
+
+class CallbackTiming:
+
+    def __init__(self, deferred: bool):
+        self.deferred = deferred
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def update(self, elapsed: float, failed: bool = False):
+        self.calls += 1
+        self.errors += int(failed)
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def to_dict(self):
+        return {
+            'deferred': self.deferred,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_s': self.total_time,
+            'mean_ms': 1000 * self.total_time / self.calls if self.calls > 0 else 0.0,
+            'max_ms': 1000 * self.max_time,
+        }
+
+
+class CallbackExecutor:
+    """
+    Schedule agent callbacks. Callbacks with deferred=False run inline, in the control loop,
+    the others are queued and executed by a pool of worker threads (or processes when
+    use_processes is True). When the queue is full the overflow policy decides what happens:
+    - block: the control loop waits for a free slot
+    - drop_oldest: the oldest queued call is discarded
+    - sample: one overflowing call every sample_every replaces the oldest queued call, the others are discarded
+    Process workers receive a pickled copy of the callback, so they only suit callbacks
+    that do not rely on their own state.
+    """
+
+    def __init__(self, num_workers: int = 1, max_queue_size: int = 64, overflow_policy: str = 'block',
+                 sample_every: int = 4, use_processes: bool = False):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', choose among {OVERFLOW_POLICIES}")
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.sample_every = sample_every
+        self.logger = CustomLogger(str(self.__class__))
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.closed = False
+
+        self.timings: dict[str, CallbackTiming] = {}
+        self.timings_lock = threading.Lock()
+
+        # Each worker thread drives its own process when use_processes is True
+        self.process_workers = [ProcessWorker() for _ in range(num_workers)] if use_processes else [None] * num_workers
+        self.workers = [threading.Thread(target=self._worker, args=(process_worker,), daemon=True)
+                        for process_worker in self.process_workers]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, callback, observation, *args, **kwargs):
+        if not getattr(callback, 'deferred', False):
+            self._run(callback, observation, args, kwargs, deferred=False)
+            return
+        if self.closed:
+            raise RuntimeError("CallbackExecutor is closed")
+        # Later transformations of the observation in the control loop must not reach queued calls
+        job = (callback, copy.copy(observation), args, kwargs)
+        with self.condition:
+            if len(self.queue) >= self.max_queue_size:
+                if self.overflow_policy == 'block':
+                    self.condition.wait_for(lambda: len(self.queue) < self.max_queue_size)
+                elif self.overflow_policy == 'drop_oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.overflows += 1
+                    self.dropped += 1
+                    if self.overflows % self.sample_every != 0:
+                        return
+                    self.queue.popleft()
+            self.queue.append(job)
+            self.condition.notify_all()
+
+    def _worker(self, process_worker: ProcessWorker = None):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) > 0 or self.closed)
+                if len(self.queue) == 0:
+                    return
+                callback, observation, args, kwargs = self.queue.popleft()
+                self.running += 1
+                self.condition.notify_all()
+            self._run(callback, observation, args, kwargs, deferred=True, process_worker=process_worker)
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    def _run(self, callback, observation, args, kwargs, deferred: bool, process_worker: ProcessWorker = None):
+        failed = False
+        start_time = time.perf_counter()
+        try:
+            if process_worker is not None:
+                process_worker.call(callback, observation, *args, **kwargs)
+            else:
+                callback(observation, *args, **kwargs)
+        except Exception as e:
+            if not deferred:
+                raise
+            failed = True
+            self.logger.error(f"Deferred callback {self._callback_name(callback)} failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self.timings_lock:
+                name = self._callback_name(callback)
+                if name not in self.timings:
+                    self.timings[name] = CallbackTiming(deferred)
+                self.timings[name].update(elapsed, failed)
+
+    @staticmethod
+    def _callback_name(callback):
+        return getattr(callback, 'name', None) or getattr(callback, '__name__', None) or repr(callback)
+
+    def stats(self):
+        with self.timings_lock:
+            callbacks = {name: timing.to_dict() for name, timing in self.timings.items()}
+        with self.condition:
+            return {
+                'callbacks': callbacks,
+                'queued': len(self.queue),
+                'running': self.running,
+                'dropped': self.dropped,
+            }
+
+    def flush(self):
+        """
+        Wait until every queued callback has been executed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.queue) == 0 and self.running == 0)
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        for process_worker in self.process_workers:
+            if process_worker is not None:
+                process_worker.close()
@@ -0,0 +1,219 @@
+import json
+import os
+import pathlib
+import time
+import traceback
+
+import pandas as pd
+import tqdm
+
+from .logger import CustomLogger
+from .simulator_pool import SimulatorPool, wait_for_next_observation
+
+
+class CollectionJob:
+    """
+    Recording of num_steps frames of one scenario in path. The state of the job is kept in path/job.json,
+    so that an interrupted collection can be resumed from the frames already on disk.
+    """
+
+    def __init__(self, path, track: str, weather: str, daytime: str, num_steps: int):
+        self.path = pathlib.Path(path)
+        self.state_path = self.path.joinpath('job.json')
+        self.track = track
+        self.weather = weather
+        self.daytime = daytime
+        self.num_steps = num_steps
+
+    @property
+    def name(self) -> str:
+        return f"{self.track}_{self.weather}_{self.daytime}"
+
+    def read_state(self) -> dict:
+        if not self.state_path.exists():
+            return {'status': 'pending', 'steps': 0, 'attempts': 0, 'error': None}
+        return json.loads(self.state_path.read_text())
+
+    def write_state(self, **updates) -> dict:
+        state = {**self.read_state(), **updates}
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Replace the file in one step, a reader never sees a partial state
+        temporary_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        temporary_path.write_text(json.dumps(state))
+        os.replace(temporary_path, self.state_path)
+        return state
+
+
+def remove_unlogged_frames(path) -> int:
+    """
+    Remove the images of a recording whose metrics row never reached log.csv, e.g. after a crash.
+    Without rows in log.csv, after a crash before the first flush, none of the images is referenced.
+    """
+    path = pathlib.Path(path)
+    if path.joinpath('log.csv').exists() and path.joinpath('log.csv').stat().st_size > 0:
+        metadata = pd.read_csv(path.joinpath('log.csv'))
+        logged = set(metadata['image_filename']) | set(metadata.get('segmentation_filename', pd.Series()).dropna())
+    else:
+        logged = set()
+    removed = 0
+    for directory in [path.joinpath('image'), path.joinpath('segmentation')]:
+        if not directory.exists():
+            continue
+        for frame_path in directory.iterdir():
+            if frame_path.name not in logged:
+                frame_path.unlink()
+                removed += 1
+    return removed
+
+
+def collect_scenario(environment, job: CollectionJob, kp: float, kd: float, ki: float,
+                     progress_every: int = 100, step_timeout: float = 10.0) -> dict:
+    """
+    Drive the PID agent through the scenario of job and record it, continuing the frames already recorded.
+    Runs in a SimulatorPool worker, the number of recorded steps is published in the job state.
+    Frames are logged by a deferred callback and encoded by background processes, as in a single
+    simulator collection.
+    """
+    from .agent import PIDUdacityAgent
+    from .agent_callback import LogObservationCallback
+    from .callback_executor import CallbackExecutor
+    from .image_writer import AsyncImageWriter
+
+    state = job.read_state()
+    job.write_state(status='running', attempts=state['attempts'] + 1, error=None)
+    callback_executor = CallbackExecutor(num_workers=1, max_queue_size=128, overflow_policy='block')
+    image_writer = AsyncImageWriter(num_workers=2, max_queue_size=256, overflow_policy='block')
+    log_observation_callback = None
+    steps = state['steps']
+    error = None
+    try:
+        observation, _ = environment.reset(track=job.track, weather=job.weather, daytime=job.daytime)
+        while not observation or not observation.is_ready():
+            time.sleep(0.1)
+            observation = environment.observe()
+
+        remove_unlogged_frames(job.path)
+        log_observation_callback = LogObservationCallback(job.path, append=True, deferred=True,
+                                                          image_writer=image_writer)
+        agent = PIDUdacityAgent(kp=kp, kd=kd, ki=ki, after_action_callbacks=[log_observation_callback],
+                                callback_executor=callback_executor)
+
+        steps = log_observation_callback.metrics_writer.rows
+        while steps < job.num_steps:
+            action = agent(observation)
+            last_observation = observation
+            observation, reward, terminated, truncated, info = environment.step(action)
+            observation = wait_for_next_observation(environment, observation, last_observation, timeout=step_timeout)
+            steps += 1
+            if steps % progress_every == 0:
+                job.write_state(steps=steps)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        # Queued callbacks run before the log is closed, and the log is closed before the image writer,
+        # the frames recorded so far are kept and the next attempt continues from them
+        callback_executor.close()
+        if log_observation_callback is not None:
+            log_observation_callback.save()
+            steps = log_observation_callback.metrics_writer.rows
+        image_writer.close()
+    if error is not None:
+        return job.write_state(status='failed', steps=steps, error=error)
+    return job.write_state(status='done', steps=steps)
+
+
+class CollectionOrchestrator:
+    """
+    Record scenario jobs on a SimulatorPool, each simulator runs one job at a time.
+    Jobs already done are skipped, interrupted or failed jobs are resumed where their recording stopped,
+    up to max_attempts attempts.
+    """
+
+    def __init__(self, pool: SimulatorPool, jobs: list[CollectionJob], kp: float = 0.07, kd: float = 0.95,
+                 ki: float = 0.000001, max_attempts: int = 3, poll_interval: float = 1.0):
+        self.pool = pool
+        self.jobs = jobs
+        self.kp = kp
+        self.kd = kd
+        self.ki = ki
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.logger = CustomLogger(str(self.__class__))
+
+    def status(self) -> pd.DataFrame:
+        return pd.DataFrame([
+            {'job': job.name, 'num_steps': job.num_steps, **job.read_state()}
+            for job in self.jobs
+        ])
+
+    def run(self) -> pd.DataFrame:
+        pending = []
+        for job in self.jobs:
+            state = job.read_state()
+            if state['status'] == 'done':
+                continue
+            if state['status'] == 'running':
+                # Left running by an interrupted collection
+                self.logger.info(f"Resuming job {job.name} from step {state['steps']}")
+            pending.append(job)
+        running = {}
+
+        def start_next_job(slot: int):
+            while len(pending) > 0:
+                job = pending.pop(0)
+                if job.read_state()['attempts'] >= self.max_attempts:
+                    self.logger.error(f"Job {job.name} failed {self.max_attempts} times, giving up")
+                    continue
+                job.write_state(status='running')
+                self.pool.submit_call(slot, collect_scenario, job, self.kp, self.kd, self.ki)
+                running[slot] = job
+                return
+
+        for slot in range(len(self.pool)):
+            start_next_job(slot)
+
+        total_steps = sum(job.num_steps for job in self.jobs)
+        recorded_steps = {job.name: job.read_state()['steps'] for job in self.jobs}
+        start_steps = sum(recorded_steps.values())
+        start_time = time.perf_counter()
+        with tqdm.tqdm(total=total_steps, initial=start_steps, unit='frame') as progress:
+            while len(running) > 0:
+                for slot, job in list(running.items()):
+                    if self.pool.ready(slot):
+                        slot_available = True
+                        try:
+                            state = self.pool.result(slot)
+                        except (EOFError, OSError) as e:
+                            # The worker process died, with its simulator: the job is resumed on a new one
+                            state = job.write_state(status='failed', error=f"Worker process died: {e!r}")
+                            self.logger.error(f"Worker on port {self.pool.ports[slot]} died, restarting it")
+                            try:
+                                self.pool.restart(slot)
+                            except Exception:
+                                self.logger.error(f"Simulator on port {self.pool.ports[slot]} could not be "
+                                                  f"restarted, its slot is left idle:\n{traceback.format_exc()}")
+                                slot_available = False
+                        del running[slot]
+                        if state['status'] == 'failed':
+                            self.logger.error(f"Job {job.name} failed on port {self.pool.ports[slot]}:\n"
+                                              f"{state['error']}")
+                            pending.append(job)
+                        if slot_available:
+                            start_next_job(slot)
+                    else:
+                        state = job.read_state()
+                    recorded_steps[job.name] = state['steps']
+
+                steps = sum(recorded_steps.values())
+                progress.update(steps - progress.n)
+                progress.set_postfix(
+                    running=len(running),
+                    pending=len(pending),
+                    fps=f"{(steps - start_steps) / (time.perf_counter() - start_time):.1f}",
+                )
+                time.sleep(self.poll_interval)
+
+        status = self.status()
+        self.logger.info(f"Collection ended: {(status['status'] == 'done').sum()} done, "
+                         f"{(status['status'] == 'failed').sum()} failed")
+        return status
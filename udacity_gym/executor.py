@@ -56,11 +56,15 @@ class UdacityExecutor:
 
         # self.logger.info(f"Received data from udacity client: {data}")
         # TODO: check data image, verify from sender that is not empty
+        input_image_bytes = base64.b64decode(data["image"])
         try:
-            input_image = Image.open(BytesIO(base64.b64decode(data["image"])))
+            input_image = Image.open(BytesIO(input_image_bytes))
         except PIL.UnidentifiedImageError:
             print("Front facing camera image UnidentifiedImageError.")
             input_image = None
+        # Keep the received bytes so that recordings can store them without re-encoding
+        if input_image is None or input_image.format != 'JPEG':
+            input_image_bytes = None
 
         """try:
             semantic_segmentation = Image.open(BytesIO(base64.b64decode(data["semantic_segmentation"])))
@@ -80,7 +84,8 @@ class UdacityExecutor:
             speed=float(data["speed"]) * 3.6,  # conversion m/s to km/h
             cte=float(data["cte"]),
             next_cte=float(data["next_cte"]),
-            time=int(time.time() * 1000)
+            time=int(time.time() * 1000),
+            input_image_bytes=input_image_bytes,
         )
         self.sim_state['observation'] = observation
 
@@ -0,0 +1,62 @@
+import random
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms
+from PIL import Image
+
+from udacity_gym.extras.data.augmentation import BatchAugmentation
+
+
+def measure_per_sample_throughput(images: list[Image.Image], labels: torch.Tensor, steps: int = 5):
+    """
+    Return the number of samples per second augmented as in the training scripts: PIL AugMix and flip,
+    one sample at a time.
+    """
+    transform = torchvision.transforms.Compose([
+        torchvision.transforms.AugMix(),
+        torchvision.transforms.ToTensor(),
+    ])
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        for image, label in zip(images, labels):
+            if random.random() > 0.5:
+                image, label = torchvision.transforms.functional.hflip(image), -label
+            transform(image)
+    return steps * len(images) / (time.perf_counter() - start_time)
+
+
+def measure_batch_throughput(images: torch.Tensor, labels: torch.Tensor, device: str, steps: int = 5,
+                             warmup: int = 1):
+    """
+    Return the number of samples per second augmented by BatchAugmentation on a uint8 batch on device.
+    """
+    augmentation = BatchAugmentation()
+    images, labels = images.to(device), labels.to(device)
+    for i in range(warmup + steps):
+        if i == warmup:
+            if device.startswith('cuda'):
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+        augmentation(images, labels)
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    return steps * len(images) / (time.perf_counter() - start_time)
+
+
+if __name__ == '__main__':
+
+    torch.manual_seed(42)
+    random.seed(42)
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for batch_size in [64, 256]:
+        pixels = np.random.default_rng(0).integers(0, 256, (batch_size, 160, 320, 3), dtype=np.uint8)
+        labels = torch.rand(batch_size, 1) * 2 - 1
+        per_sample = measure_per_sample_throughput([Image.fromarray(image) for image in pixels], labels)
+        print(f"{'per-sample PIL AugMix':>24} batch_size={batch_size:<3} {per_sample:9.1f} samples/s")
+        for device in devices:
+            batched = measure_batch_throughput(torch.from_numpy(pixels).permute(0, 3, 1, 2).contiguous(),
+                                               labels, device)
+            print(f"{'BatchAugmentation ' + device:>24} batch_size={batch_size:<3} {batched:9.1f} samples/s")
@@ -0,0 +1,95 @@
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torchvision.transforms
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from udacity_gym.extras.data.driving_dataset import BatchedConcatDataset, DrivingDataset
+
+
+class LegacyDrivingDataset(Dataset):
+    """
+    DrivingDataset as it was copied in the training scripts, kept as the benchmark baseline.
+    """
+
+    def __init__(self, dataset_dir: str, split: str = "train", transform=None):
+        self.dataset_dir = pathlib.Path(dataset_dir)
+        self.metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
+        self.split = split
+        if self.split == "train":
+            self.metadata = self.metadata[10: int(len(self.metadata) * 0.9)]
+        else:
+            self.metadata = self.metadata[int(len(self.metadata) * 0.9):]
+        self.transform = transform if transform is not None else torchvision.transforms.ToTensor()
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def __getitem__(self, idx):
+        image = Image.open(self.dataset_dir.joinpath("image", self.metadata['image_filename'].values[idx]))
+        steering = self.metadata['predicted_steering_angle'].values[idx]
+        steering = torch.tensor([steering], dtype=torch.float32)
+        if self.split == "train" and random.random() > 0.5:
+            image, steering = torchvision.transforms.functional.hflip(image), -steering
+        return self.transform(image), steering
+
+
+def make_synthetic_dataset(path, num_frames: int = 2000) -> pathlib.Path:
+    """
+    Write num_frames random 320x160 JPEG frames and their log.csv in path.
+    """
+    path = pathlib.Path(path)
+    path.joinpath("image").mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for i in range(num_frames):
+        Image.fromarray(rng.integers(0, 256, (160, 320, 3), dtype=np.uint8)).save(
+            path.joinpath("image", f"image_{i:020d}.jpg"))
+    pd.DataFrame({
+        'image_filename': [f"image_{i:020d}.jpg" for i in range(num_frames)],
+        'predicted_steering_angle': rng.uniform(-1, 1, num_frames),
+    }).to_csv(path.joinpath('log.csv'), index=False)
+    return path
+
+
+def measure_throughput(dataset: Dataset, batch_size: int, num_workers: int, epochs: int = 2):
+    """
+    Return the number of samples per second loaded from dataset, averaged over epochs full passes.
+    """
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    samples = 0
+    start_time = time.perf_counter()
+    for _ in range(epochs):
+        for images, labels in loader:
+            samples += len(images)
+    return samples / (time.perf_counter() - start_time)
+
+
+if __name__ == '__main__':
+
+    torch.manual_seed(42)
+
+    # Benchmark on a recording given as argument, or on synthetic frames
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        dataset_dir = sys.argv[1] if len(sys.argv) > 1 else make_synthetic_dataset(temporary_dir)
+        for batch_size in [64, 256]:
+            for num_workers in [0, 4]:
+                for name, dataset in [
+                    ('legacy', LegacyDrivingDataset(dataset_dir, split="train")),
+                    ('shared', DrivingDataset(dataset_dir, split="train")),
+                    # As the training scripts load it, through a concatenation of recordings
+                    ('concat', BatchedConcatDataset([DrivingDataset(dataset_dir, split="train")])),
+                    ('cached', DrivingDataset(dataset_dir, split="train", cache_images=True)),
+                ]:
+                    throughput = measure_throughput(dataset, batch_size, num_workers)
+                    print(f"{name:>8} batch_size={batch_size:<3} num_workers={num_workers} "
+                          f"{throughput:9.1f} samples/s")
+                    if getattr(dataset, 'image_cache', None) is not None:
+                        print(f"{'':>8} hit rate {dataset.image_cache.stats()['hit_rate']:.1%}")
+                        dataset.image_cache.close()
@@ -0,0 +1,251 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+import torchvision.transforms
+from torch.utils.data import DataLoader
+
+from udacity_gym.extras.benchmark.loader_throughput import make_synthetic_dataset
+from udacity_gym.extras.data.driving_dataset import DrivingDataset
+from udacity_gym.extras.data.frame_cache import CachedDrivingDataset
+from udacity_gym.extras.model.lane_keeping.registry import MODEL_REGISTRY, get_model_class
+
+INPUT_SHAPE = (3, 160, 320)
+# The segmentation model is benchmarked with the parameters of segmentation/unet/training.py
+SEGMENTATION_MODEL = 'segmentation_unet'
+SEGMENTATION_MODEL_ARGS = {'hidden_dims': [64, 128, 256], 'num_groups': 32, 'in_channels': 3, 'out_channels': 1}
+
+
+def model_names() -> list[str]:
+    """
+    Every registered lane-keeping model and the segmentation model.
+    """
+    return sorted(MODEL_REGISTRY.keys()) + [SEGMENTATION_MODEL]
+
+
+def _synchronize(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def _autocast(device: torch.device, bf16: bool):
+    if not bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def _timed(step, device: torch.device, steps: int, warmup: int) -> float:
+    """
+    Run step warmup + steps times and return the seconds taken by the last steps.
+    """
+    for _ in range(warmup):
+        step()
+    _synchronize(device)
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        step()
+    _synchronize(device)
+    return time.perf_counter() - start_time
+
+
+def _loss(model, predictions: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+    if hasattr(model, 'loss'):
+        return model.loss(predictions, labels)
+    # SegmentationUnet computes its binary cross-entropy in its steps, in float32 outside autocast
+    return torch.nn.functional.binary_cross_entropy(predictions.float(), labels)
+
+
+def _optimizer(model) -> torch.optim.Optimizer:
+    optimizers = model.configure_optimizers()
+    if isinstance(optimizers, dict):
+        return optimizers['optimizer']
+    return optimizers[0]
+
+
+def _train_step(model, optimizer, images: torch.Tensor, labels: torch.Tensor, bf16: bool):
+    with _autocast(images.device, bf16):
+        predictions = model(images)
+    loss = _loss(model, predictions, labels)
+    optimizer.zero_grad(set_to_none=True)
+    loss.backward()
+    optimizer.step()
+
+
+def build_model(model_name: str, device: torch.device, channels_last: bool = False):
+    if model_name == SEGMENTATION_MODEL:
+        # Imported on demand, the segmentation model needs torchmetrics and torchinfo
+        from udacity_gym.extras.model.segmentation.unet.unet_model import SegmentationUnet
+        model = SegmentationUnet(input_shape=INPUT_SHAPE, **SEGMENTATION_MODEL_ARGS).to(device)
+    else:
+        model = get_model_class(model_name)(input_shape=INPUT_SHAPE).to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def synthetic_batch(batch_size: int, device: torch.device, channels_last: bool = False, model_name: str = None):
+    """
+    Random frames with steering labels, or with road masks for the segmentation model.
+    """
+    images = torch.rand(batch_size, *INPUT_SHAPE, device=device)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    if model_name == SEGMENTATION_MODEL:
+        return images, (torch.rand(batch_size, 1, *INPUT_SHAPE[1:], device=device) > 0.5).float()
+    return images, torch.rand(batch_size, 1, device=device) * 2 - 1
+
+
+def measure_forward(model_name: str, batch_size: int, device: torch.device, steps: int = 10, warmup: int = 2,
+                    channels_last: bool = False, bf16: bool = False) -> float:
+    """
+    Return the samples per second of inference on synthetic batches.
+    """
+    model = build_model(model_name, device, channels_last).eval()
+    images, _ = synthetic_batch(batch_size, device, channels_last)
+
+    def step():
+        with torch.no_grad(), _autocast(device, bf16):
+            model(images)
+
+    return steps * batch_size / _timed(step, device, steps, warmup)
+
+
+def measure_training(model_name: str, batch_size: int, device: torch.device, steps: int = 10, warmup: int = 2,
+                     channels_last: bool = False, bf16: bool = False) -> float:
+    """
+    Return the samples per second of forward, backward and optimizer steps on synthetic batches.
+    """
+    model = build_model(model_name, device, channels_last).train()
+    optimizer = _optimizer(model)
+    images, labels = synthetic_batch(batch_size, device, channels_last, model_name)
+    return steps * batch_size / _timed(lambda: _train_step(model, optimizer, images, labels, bf16),
+                                       device, steps, warmup)
+
+
+def measure_loader_training(model_name: str, dataset, batch_size: int, num_workers: int, device: torch.device,
+                            steps: int = 10, warmup: int = 2, channels_last: bool = False,
+                            bf16: bool = False) -> float:
+    """
+    Return the samples per second of training steps fed by a DataLoader over dataset, loading included.
+    Batches of uint8 images are converted to float on the device, as DrivingDataModule does.
+    """
+    model = build_model(model_name, device, channels_last).train()
+    optimizer = _optimizer(model)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers, drop_last=True,
+                        persistent_workers=num_workers > 0, pin_memory=device.type == 'cuda')
+    batches = itertools.cycle(loader) if len(loader) < warmup + steps else iter(loader)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    def step():
+        images, labels = next(batches)
+        images = images.to(device, non_blocking=True)
+        if images.dtype == torch.uint8:
+            images = images.float().div_(255)
+        images = images.contiguous(memory_format=memory_format)
+        _train_step(model, optimizer, images, labels.to(device, non_blocking=True), bf16)
+
+    return steps * batch_size / _timed(step, device, steps, warmup)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    Context stored with every result, results are only comparable on the same machine and versions.
+    """
+    return {
+        'commit': _commit(),
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def run_suite(models: list, batch_sizes: list, worker_counts: list, device: torch.device, dataset=None,
+              data: str = 'synthetic', steps: int = 10, warmup: int = 2, channels_last: bool = False,
+              bf16: bool = False, benchmarks: tuple = ('forward', 'train_step', 'loader')):
+    """
+    Yield one result per model, benchmark, batch size and, for the loader benchmark, worker count.
+    The loader benchmark reads steering datasets, it is skipped for the segmentation model.
+    """
+    context = {**environment(), 'device': str(device), 'channels_last': channels_last, 'bf16': bf16}
+    options = {'steps': steps, 'warmup': warmup, 'channels_last': channels_last, 'bf16': bf16}
+    for model_name, batch_size in itertools.product(models, batch_sizes):
+        runs = []
+        if 'forward' in benchmarks:
+            runs.append(('forward', None, lambda: measure_forward(model_name, batch_size, device, **options)))
+        if 'train_step' in benchmarks:
+            runs.append(('train_step', None, lambda: measure_training(model_name, batch_size, device, **options)))
+        if 'loader' in benchmarks and dataset is not None and model_name != SEGMENTATION_MODEL:
+            for num_workers in worker_counts:
+                runs.append(('loader', num_workers, lambda num_workers=num_workers: measure_loader_training(
+                    model_name, dataset, batch_size, num_workers, device, **options)))
+        for benchmark, num_workers, measure in runs:
+            torch.manual_seed(42)
+            yield {
+                'timestamp': time.time(),
+                'benchmark': benchmark,
+                'model': model_name,
+                'batch_size': batch_size,
+                'num_workers': num_workers,
+                'data': data if benchmark == 'loader' else 'synthetic',
+                'samples_per_sec': measure(),
+                **context,
+            }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Training throughput of the driving models, as JSON lines")
+    parser.add_argument('--models', nargs='+', default=model_names())
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[32, 128])
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, 4])
+    parser.add_argument('--benchmarks', nargs='+', default=['forward', 'train_step', 'loader'])
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--bf16', action='store_true', help="run under bf16 autocast")
+    data_group = parser.add_mutually_exclusive_group()
+    data_group.add_argument('--dataset', help="recorded dataset directory, synthetic frames are used otherwise")
+    data_group.add_argument('--frame-cache', help="frame cache directory built by build_frame_cache")
+    parser.add_argument('--output', help="append the results to this file instead of printing them")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        if args.frame_cache is not None:
+            dataset, data = CachedDrivingDataset(args.frame_cache, split="train"), 'cached'
+        elif args.dataset is not None:
+            dataset, data = DrivingDataset(args.dataset, split="train", flip=False,
+                                           transform=torchvision.transforms.PILToTensor()), 'recorded'
+        else:
+            dataset = DrivingDataset(make_synthetic_dataset(temporary_dir, 1000), split="train", flip=False,
+                                     transform=torchvision.transforms.PILToTensor())
+            data = 'synthetic'
+
+        output = open(args.output, 'a') if args.output is not None else sys.stdout
+        try:
+            for result in run_suite(args.models, args.batch_sizes, args.workers, torch.device(args.device), dataset,
+                                    data, args.steps, args.warmup, args.channels_last, args.bf16,
+                                    tuple(args.benchmarks)):
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+        finally:
+            if output is not sys.stdout:
+                output.close()
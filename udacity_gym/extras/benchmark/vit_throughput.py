@@ -0,0 +1,44 @@
+import time
+
+import torch
+
+from udacity_gym.extras.model.lane_keeping.vit.vit_model import ViT, RectangularViT
+
+
+def measure_throughput(model: torch.nn.Module, batch_size: int, train: bool, steps: int = 20, warmup: int = 3):
+    """
+    Return the number of samples per second processed by model on random 160x320 frames.
+    Training steps include backward pass and optimizer step.
+    """
+    x = torch.rand(batch_size, 3, 160, 320)
+    y = torch.rand(batch_size, 1)
+    optimizer = torch.optim.Adam(model.parameters(), lr=model.learning_rate)
+    model.train(train)
+    for i in range(warmup + steps):
+        if i == warmup:
+            start_time = time.perf_counter()
+        if train:
+            optimizer.zero_grad()
+            loss = model.loss(model(x), y)
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad():
+                model(x)
+    return steps * batch_size / (time.perf_counter() - start_time)
+
+
+if __name__ == '__main__':
+
+    torch.manual_seed(42)
+
+    for batch_size in [1, 16, 64]:
+        for name, model in [
+            ('vit', ViT()),
+            ('vit_rect_8x8', RectangularViT(patch_size=(8, 8))),
+            ('vit_rect_8x16', RectangularViT(patch_size=(8, 16))),
+        ]:
+            inference = measure_throughput(model, batch_size, train=False)
+            training = measure_throughput(model, batch_size, train=True)
+            print(f"{name:>14} batch_size={batch_size:<3} "
+                  f"inference={inference:9.1f} samples/s training={training:9.1f} samples/s")
@@ -0,0 +1,260 @@
+import lightning as pl
+import torch
+import torchvision.transforms
+from torch.utils.data import ConcatDataset, DataLoader
+
+from udacity_gym.extras.data.driving_dataset import BatchedConcatDataset, DrivingDataset
+from udacity_gym.extras.data.frame_cache import CachedDrivingDataset, build_frame_cache
+from udacity_gym.extras.data.sharding import shard_dataset
+from udacity_gym.extras.data.shared_cache import SharedFrameCache
+from udacity_gym.logger import CustomLogger
+
+GRAYSCALE_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def _per_sample(values: torch.Tensor) -> torch.Tensor:
+    return values.view(-1, 1, 1, 1)
+
+
+def _uniform(size: int, low: float, high: float, device) -> torch.Tensor:
+    return torch.empty(size, device=device).uniform_(low, high)
+
+
+def adjust_colors(images: torch.Tensor, brightness: torch.Tensor, contrast: torch.Tensor,
+                  saturation: torch.Tensor) -> torch.Tensor:
+    """
+    Brightness, contrast and saturation adjustment with per-sample factors. The three adjustments are
+    linear, they are folded into one 3x3 colour matrix per sample and applied in a single pass.
+    """
+    weights = torch.tensor(GRAYSCALE_WEIGHTS, device=images.device, dtype=images.dtype)
+    identity = torch.eye(3, device=images.device, dtype=images.dtype)
+    to_grayscale = weights.expand(3, 3)
+    saturation = saturation.view(-1, 1, 1)
+    matrices = (contrast * brightness).view(-1, 1, 1) * (saturation * identity + (1 - saturation) * to_grayscale)
+    mean_gray = images.mean(dim=(2, 3)) @ weights
+    bias = ((1 - contrast) * brightness * mean_gray).view(-1, 1, 1).expand(-1, 3, 1)
+    return torch.baddbmm(bias, matrices, images.flatten(2)).view_as(images).clamp_(0, 1)
+
+
+def adjust_brightness(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    return adjust_colors(images, factors, torch.ones_like(factors), torch.ones_like(factors))
+
+
+def adjust_contrast(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    return adjust_colors(images, torch.ones_like(factors), factors, torch.ones_like(factors))
+
+
+def adjust_saturation(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    return adjust_colors(images, torch.ones_like(factors), torch.ones_like(factors), factors)
+
+
+def posterize(images: torch.Tensor, magnitudes: torch.Tensor) -> torch.Tensor:
+    # Keep between 4 and 8 bits per channel
+    levels = _per_sample(2 ** (8 - (4 * magnitudes).round()))
+    return (images * (255 / levels)).floor_().mul_(levels / 255)
+
+
+def solarize(images: torch.Tensor, magnitudes: torch.Tensor) -> torch.Tensor:
+    # |1 - x| above the threshold, |0 - x| below it
+    return (images >= _per_sample(1 - magnitudes)).to(images.dtype).sub_(images).abs_()
+
+
+def autocontrast(images: torch.Tensor, magnitudes: torch.Tensor) -> torch.Tensor:
+    # Stretch every channel to [0, 1] and blend with the original image, as one affine transform
+    low, high = torch.aminmax(images.flatten(2), dim=2)
+    scale = 1 / (high - low).clamp_(min=1e-3)
+    magnitudes = magnitudes.view(-1, 1)
+    gain = 1 - magnitudes + magnitudes * scale
+    offset = -magnitudes * scale * low
+    return torch.addcmul(offset[..., None, None], images, gain[..., None, None])
+
+
+def translate_x(images: torch.Tensor, magnitudes: torch.Tensor) -> torch.Tensor:
+    # Shift every image by up to 10% of its width, the uncovered columns are black
+    width = images.shape[-1]
+    shifts = (magnitudes * 0.1 * width).long() * (torch.randint(0, 2, magnitudes.shape, device=images.device) * 2 - 1)
+    columns = torch.arange(width, device=images.device).view(1, -1) - shifts.view(-1, 1)
+    inside = ((columns >= 0) & (columns < width)).to(images.dtype).view(-1, 1, 1, width)
+    shifted = images.gather(3, columns.clamp(0, width - 1).view(-1, 1, 1, width).expand_as(images))
+    return shifted.mul_(inside)
+
+
+AUGMIX_OPERATIONS = [
+    lambda images, magnitudes: adjust_brightness(images, 1 + (magnitudes * 1.8 - 0.9) * 0.5),
+    lambda images, magnitudes: adjust_contrast(images, 1 + (magnitudes * 1.8 - 0.9) * 0.5),
+    lambda images, magnitudes: adjust_saturation(images, 1 + (magnitudes * 1.8 - 0.9)),
+    posterize,
+    solarize,
+    autocontrast,
+    translate_x,
+]
+
+
+class BatchAugmentation(torch.nn.Module):
+    """
+    Augment a whole batch at once, on the device holding it: random horizontal flip negating the label,
+    colour jitter, then AugMix-style mixing of augmentation chains. Every sample draws its own flip,
+    jitter factors, operation magnitudes and mixing weights. Images are uint8 or float in [0, 1],
+    float images in [0, 1] are returned.
+    """
+
+    def __init__(self, flip_probability: float = 0.5, brightness: float = 0.2, contrast: float = 0.2,
+                 saturation: float = 0.2, augmix_probability: float = 1.0, width: int = 3, depth: int = 3,
+                 severity: float = 0.3, alpha: float = 1.0):
+        super().__init__()
+        self.flip_probability = flip_probability
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.augmix_probability = augmix_probability
+        self.width = width
+        self.depth = depth
+        self.severity = severity
+        self.alpha = alpha
+
+    def flip(self, images: torch.Tensor, labels: torch.Tensor):
+        # Only the flipped samples are copied, images is owned by the augmentation
+        flips = torch.rand(len(images), device=images.device) < self.flip_probability
+        images[flips] = images[flips].flip(-1)
+        labels = torch.where(flips.view(-1, *[1] * (labels.dim() - 1)), -labels, labels)
+        return images, labels
+
+    def jitter(self, images: torch.Tensor) -> torch.Tensor:
+        size, device = len(images), images.device
+        return adjust_colors(
+            images,
+            _uniform(size, 1 - self.brightness, 1 + self.brightness, device),
+            _uniform(size, 1 - self.contrast, 1 + self.contrast, device),
+            _uniform(size, 1 - self.saturation, 1 + self.saturation, device),
+        )
+
+    def augmix(self, images: torch.Tensor) -> torch.Tensor:
+        size, device = len(images), images.device
+        concentration = torch.full((size, self.width), self.alpha, device=device)
+        weights = torch.distributions.Dirichlet(concentration).sample()
+        mix = torch.zeros_like(images)
+        for chain in range(self.width):
+            augmented = images
+            for _ in range(torch.randint(1, self.depth + 1, (1,)).item()):
+                operation = AUGMIX_OPERATIONS[torch.randint(len(AUGMIX_OPERATIONS), (1,)).item()]
+                augmented = operation(augmented, _uniform(size, 0, self.severity, device))
+            mix.addcmul_(augmented, _per_sample(weights[:, chain]))
+        alpha = torch.tensor(self.alpha, device=device)
+        skip = torch.distributions.Beta(alpha, alpha).sample((size,))
+        # Samples left out of AugMix keep the original image only
+        skip = torch.where(torch.rand(size, device=device) < self.augmix_probability, skip, torch.ones_like(skip))
+        return torch.lerp(mix, images, _per_sample(skip))
+
+    @torch.no_grad()
+    def forward(self, images: torch.Tensor, labels: torch.Tensor):
+        images = images.float().div_(255) if images.dtype == torch.uint8 else images.clone()
+        images, labels = self.flip(images, labels)
+        if self.brightness or self.contrast or self.saturation:
+            images = self.jitter(images)
+        if self.augmix_probability > 0:
+            images = self.augmix(images)
+        return images, labels
+
+
+class DrivingDataModule(pl.LightningDataModule):
+    """
+    Training and validation loaders over recordings. Workers only decode frames to uint8 tensors,
+    batches are converted to float and augmented after they reach the training device. With cache_images,
+    every dataset shares one SharedFrameCache of cache_size bytes. With frame_caches, frames are read from
+    the read-only caches of build_frame_cache instead, which concurrent trainings map from the same pages.
+    Batches are converted to memory_format, e.g. torch.channels_last for a model in that format.
+    Without augmentation, training batches are only flipped. Under distributed training every rank keeps
+    its shard of each dataset, the Trainer must be created with use_distributed_sampler=False.
+    """
+
+    def __init__(self, dataset_dirs: list, batch_size: int = 256, val_batch_size: int = 64, num_workers: int = 8,
+                 augmentation: BatchAugmentation = None, cache_images: bool = False, cache_size: int = 1 << 30,
+                 pin_memory: bool = True, persistent_workers: bool = True,
+                 memory_format: torch.memory_format = torch.contiguous_format, frame_caches: bool = False):
+        super().__init__()
+        self.dataset_dirs = dataset_dirs
+        self.batch_size = batch_size
+        self.val_batch_size = val_batch_size
+        self.num_workers = num_workers
+        if augmentation is None:
+            augmentation = BatchAugmentation(brightness=0, contrast=0, saturation=0, augmix_probability=0)
+        self.augmentation = augmentation
+        self.cache_images = cache_images
+        self.cache_size = cache_size
+        self.pin_memory = pin_memory
+        self.persistent_workers = persistent_workers
+        self.memory_format = memory_format
+        self.frame_caches = frame_caches
+        self.datasets = None
+        self.image_cache = None
+        self.logger = CustomLogger(str(self.__class__))
+
+    def setup(self, stage: str):
+        if self.datasets is not None:
+            return
+        if self.frame_caches:
+            cache_dirs = [build_frame_cache(dataset_dir) for dataset_dir in self.dataset_dirs]
+            self.datasets = {
+                split: ConcatDataset([
+                    CachedDrivingDataset(cache_dir, split=split, raw=True) for cache_dir in cache_dirs
+                ])
+                for split in ["train", "val"]
+            }
+        else:
+            self.datasets = {
+                split: BatchedConcatDataset([
+                    DrivingDataset(dataset_dir=dataset_dir, split=split,
+                                   transform=torchvision.transforms.PILToTensor(), flip=False)
+                    for dataset_dir in self.dataset_dirs
+                ])
+                for split in ["train", "val"]
+            }
+        if self.trainer is not None and self.trainer.world_size > 1:
+            self.datasets = {
+                split: shard_dataset(dataset, self.trainer.global_rank, self.trainer.world_size)
+                for split, dataset in self.datasets.items()
+            }
+        if self.cache_images and not self.frame_caches:
+            datasets = [dataset for split in self.datasets.values() for dataset in split.datasets]
+            self.image_cache = SharedFrameCache(sum(len(dataset) for dataset in datasets), self.cache_size)
+            offset = 0
+            for dataset in datasets:
+                dataset.use_cache(self.image_cache, offset)
+                offset += len(dataset)
+
+    def teardown(self, stage: str):
+        if self.image_cache is not None:
+            stats = self.image_cache.stats()
+            self.logger.info(f"Frame cache: {stats['hit_rate']:.1%} hit rate, {stats['frames']} frames cached, "
+                             f"{stats['evictions']} evictions")
+            self.image_cache.close()
+        self.datasets = None
+        self.image_cache = None
+
+    def _loader(self, split: str, batch_size: int) -> DataLoader:
+        return DataLoader(
+            self.datasets[split],
+            batch_size=batch_size,
+            shuffle=True,
+            num_workers=self.num_workers,
+            prefetch_factor=2 if self.num_workers > 0 else None,
+            persistent_workers=self.persistent_workers and self.num_workers > 0,
+            pin_memory=self.pin_memory,
+        )
+
+    def train_dataloader(self):
+        return self._loader("train", self.batch_size)
+
+    def val_dataloader(self):
+        return self._loader("val", self.val_batch_size)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if not isinstance(batch, (list, tuple)):
+            # Example input of the model summary
+            return batch
+        images, labels = batch
+        if self.trainer is not None and self.trainer.training:
+            images, labels = self.augmentation(images, labels)
+        else:
+            images = images.float().div_(255)
+        return images.contiguous(memory_format=self.memory_format), labels
@@ -0,0 +1,151 @@
+import json
+import pathlib
+import time
+from typing import Optional
+
+import pandas as pd
+
+from udacity_gym.logger import CustomLogger
+
+# Typed columns of log.csv, other columns are kept with the type inferred by pandas
+LOG_DTYPES = {
+    'pos_x': 'float32',
+    'pos_y': 'float32',
+    'pos_z': 'float32',
+    'steering_angle': 'float32',
+    'speed': 'float32',
+    'cte': 'float32',
+    'next_cte': 'float32',
+    'lap': 'int32',
+    'sector': 'int32',
+    'time': 'int64',
+    'predicted_steering_angle': 'float32',
+    'predicted_throttle': 'float32',
+}
+SCENARIO_COLUMNS = ['dataset', 'scenario', 'track', 'weather', 'daytime']
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow is required to build and read the dataset catalogue")
+
+
+def _parse_scenario(scenario: str) -> dict:
+    # Recordings are stored in <track>_<weather>_<daytime> directories
+    parts = scenario.split('_')
+    if len(parts) == 3:
+        return dict(zip(['track', 'weather', 'daytime'], parts))
+    return {'track': None, 'weather': None, 'daytime': None}
+
+
+def _source_info(log_path: pathlib.Path) -> dict:
+    stat = log_path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_log(log_path: pathlib.Path, root: pathlib.Path) -> pd.DataFrame:
+    metadata = pd.read_csv(log_path)
+    metadata = metadata.astype({column: dtype for column, dtype in LOG_DTYPES.items() if column in metadata})
+    scenario_dir = log_path.parent
+    metadata['row'] = pd.RangeIndex(len(metadata), dtype='int32')
+    metadata['dataset_dir'] = str(scenario_dir)
+    if scenario_dir == root:
+        metadata['dataset'] = root.name
+    else:
+        metadata['dataset'] = pathlib.Path(root.name, scenario_dir.parent.relative_to(root)).as_posix()
+    metadata['scenario'] = scenario_dir.name
+    for key, value in _parse_scenario(scenario_dir.name).items():
+        metadata[key] = value
+    return metadata
+
+
+def build_catalogue(roots: list, catalogue_path) -> pd.DataFrame:
+    """
+    Ingest every log.csv found under roots into a single Parquet catalogue, one row per frame, with the
+    dataset, scenario, track, weather and daytime of each frame. Recordings whose log.csv did not change
+    since the previous build are copied from the existing catalogue instead of being parsed again.
+    """
+    _require_pyarrow()
+    logger = CustomLogger('build_catalogue')
+    catalogue_path = pathlib.Path(catalogue_path)
+    sources_path = catalogue_path.with_name(catalogue_path.name + '.sources.json')
+    previous_sources = json.loads(sources_path.read_text()) if sources_path.exists() else {}
+    previous = pd.read_parquet(catalogue_path) if catalogue_path.exists() and previous_sources else None
+
+    start_time = time.perf_counter()
+    sources = {}
+    frames = []
+    for root in roots:
+        root = pathlib.Path(root)
+        for log_path in sorted(root.rglob('log.csv')):
+            key = str(log_path.parent)
+            sources[key] = _source_info(log_path)
+            if previous is not None and previous_sources.get(key) == sources[key]:
+                frames.append(previous[previous['dataset_dir'] == key])
+            else:
+                logger.info(f"Ingesting {log_path}")
+                frames.append(_read_log(log_path, root))
+
+    catalogue = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    for column in SCENARIO_COLUMNS + ['dataset_dir']:
+        if column in catalogue:
+            catalogue[column] = catalogue[column].astype('category')
+    catalogue_path.parent.mkdir(parents=True, exist_ok=True)
+    catalogue.to_parquet(catalogue_path, index=False, row_group_size=1 << 16)
+    sources_path.write_text(json.dumps(sources))
+    logger.info(f"Catalogued {len(catalogue)} frames of {len(sources)} recordings "
+                f"in {time.perf_counter() - start_time:.1f}s")
+    return catalogue
+
+
+class Catalogue:
+    """
+    Query the frames of a catalogue built by build_catalogue. Filters are pushed down to the Parquet
+    reader, only the matching row groups and the requested columns are read.
+    """
+
+    def __init__(self, catalogue_path):
+        _require_pyarrow()
+        self.catalogue_path = pathlib.Path(catalogue_path)
+
+    def query(self, track: Optional[str] = None, weather: Optional[str] = None, daytime: Optional[str] = None,
+              dataset: Optional[str] = None, lap: Optional[int] = None,
+              steering_range: Optional[tuple[float, float]] = None,
+              steering_column: str = 'predicted_steering_angle', columns: Optional[list[str]] = None) -> pd.DataFrame:
+        """
+        Return the frames matching every given filter, e.g. query(track='lake', steering_range=(-0.1, 0.1)).
+        """
+        filters = []
+        for column, value in [('track', track), ('weather', weather), ('daytime', daytime),
+                              ('dataset', dataset), ('lap', lap)]:
+            if value is not None:
+                filters.append((column, 'in' if isinstance(value, (list, tuple)) else '==', value))
+        if steering_range is not None:
+            filters.append((steering_column, '>=', steering_range[0]))
+            filters.append((steering_column, '<=', steering_range[1]))
+        return pd.read_parquet(self.catalogue_path, columns=columns, filters=filters if filters else None)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Number of frames per scenario.
+        """
+        catalogue = pd.read_parquet(self.catalogue_path, columns=['dataset', 'track', 'weather', 'daytime'])
+        return catalogue.groupby(['dataset', 'track', 'weather', 'daytime'], observed=True).size().rename('frames') \
+            .reset_index()
+
+
+if __name__ == '__main__':
+
+    from utils.conf import PROJECT_DIR
+
+    dataset_paths = [
+        'udacity_dataset_lake',
+        'udacity_dataset_lake_8_8_1',
+        'udacity_dataset_lake_12_8_1',
+        'udacity_dataset_lake_12_12_1',
+    ]
+    build_catalogue([PROJECT_DIR.joinpath(dataset) for dataset in dataset_paths],
+                    PROJECT_DIR.joinpath('catalogue.parquet'))
+    print(Catalogue(PROJECT_DIR.joinpath('catalogue.parquet')).summary())
@@ -0,0 +1,146 @@
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+import tqdm
+from PIL import Image
+
+from udacity_gym.logger import CustomLogger
+
+DUPLICATE_INDEX_FILE = 'duplicates.csv'
+
+
+def load_thumbnails(image_paths: list, hash_size: int = 8) -> np.ndarray:
+    """
+    Decode images as (hash_size + 1) x hash_size grayscale thumbnails, a N x hash_size x (hash_size + 1) array.
+    """
+    thumbnails = np.empty((len(image_paths), hash_size, hash_size + 1), dtype=np.float32)
+    for i, image_path in enumerate(image_paths):
+        with Image.open(image_path) as image:
+            # JPEG images are decoded at reduced scale, the thumbnail is tiny anyway
+            image.draft('L', (4 * (hash_size + 1), 4 * hash_size))
+            thumbnails[i] = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR))
+    return thumbnails
+
+
+def difference_hash(thumbnails: np.ndarray) -> np.ndarray:
+    """
+    Difference hash of a batch of thumbnails, one bit per horizontally adjacent pixel pair, packed in uint8.
+    """
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    return np.packbits(bits.reshape(len(bits), -1), axis=1)
+
+
+def hamming_distance(hashes: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    return np.unpackbits(np.bitwise_xor(hashes, other_hashes), axis=-1).sum(axis=-1)
+
+
+def compute_hashes(dataset_dir, hash_size: int = 8, batch_size: int = 256) -> np.ndarray:
+    dataset_dir = pathlib.Path(dataset_dir)
+    metadata = pd.read_csv(dataset_dir.joinpath('log.csv'))
+    image_paths = [dataset_dir.joinpath('image', filename) for filename in metadata['image_filename']]
+    hashes = np.empty((len(image_paths), hash_size * hash_size // 8), dtype=np.uint8)
+    for start in tqdm.tqdm(range(0, len(image_paths), batch_size), desc='hashing'):
+        thumbnails = load_thumbnails(image_paths[start:start + batch_size], hash_size)
+        hashes[start:start + batch_size] = difference_hash(thumbnails)
+    return hashes
+
+
+def cluster_consecutive(hashes: np.ndarray, max_distance: int = 4) -> np.ndarray:
+    """
+    Group consecutive frames whose hash is within max_distance bits of the first frame of the group.
+    Return the cluster of each frame.
+    """
+    clusters = np.zeros(len(hashes), dtype=np.int64)
+    if len(hashes) == 0:
+        return clusters
+    # Distances between neighbouring frames are computed at once, most frames only need this check
+    neighbour_distance = hamming_distance(hashes[1:], hashes[:-1])
+    cluster, representative = 0, 0
+    for i in range(1, len(hashes)):
+        if neighbour_distance[i - 1] > max_distance or \
+                hamming_distance(hashes[i], hashes[representative]) > max_distance:
+            cluster, representative = cluster + 1, i
+        clusters[i] = cluster
+    return clusters
+
+
+def build_duplicate_index(dataset_dir, hash_size: int = 8, max_distance: int = 4,
+                          batch_size: int = 256) -> pd.DataFrame:
+    """
+    Hash every frame of a recorded dataset and cluster near-duplicate consecutive frames.
+    The index is written to dataset_dir/duplicates.csv, one row per row of log.csv.
+    """
+    dataset_dir = pathlib.Path(dataset_dir)
+    metadata = pd.read_csv(dataset_dir.joinpath('log.csv'))
+    hashes = compute_hashes(dataset_dir, hash_size, batch_size)
+    index = pd.DataFrame({
+        'image_filename': metadata['image_filename'],
+        'hash': [frame_hash.tobytes().hex() for frame_hash in hashes],
+        'cluster': cluster_consecutive(hashes, max_distance),
+    })
+    index.to_csv(dataset_dir.joinpath(DUPLICATE_INDEX_FILE), index=False)
+    return index
+
+
+def select_frames(dataset_dir, frames_per_cluster: int = 1) -> np.ndarray:
+    """
+    Positions in log.csv of the first frames_per_cluster frames of every cluster of the duplicate index.
+    """
+    index = pd.read_csv(pathlib.Path(dataset_dir).joinpath(DUPLICATE_INDEX_FILE))
+    rank = index.groupby('cluster').cumcount().to_numpy()
+    return np.flatnonzero(rank < frames_per_cluster)
+
+
+def deduplication_report(dataset_dir, frames_per_cluster: int = 1, timing_samples: int = 200) -> dict:
+    """
+    Dataset size and estimated epoch time before and after subsampling. Epoch time is estimated
+    from the time needed to load and decode a sample of the frames.
+    """
+    dataset_dir = pathlib.Path(dataset_dir)
+    index = pd.read_csv(dataset_dir.joinpath(DUPLICATE_INDEX_FILE))
+    selected = select_frames(dataset_dir, frames_per_cluster)
+    image_sizes = np.array([
+        dataset_dir.joinpath('image', filename).stat().st_size for filename in index['image_filename']
+    ])
+
+    sample = np.random.default_rng(0).choice(len(index), size=min(timing_samples, len(index)), replace=False)
+    start_time = time.perf_counter()
+    for i in sample:
+        with Image.open(dataset_dir.joinpath('image', index['image_filename'].values[i])) as image:
+            np.asarray(image)
+    load_time = (time.perf_counter() - start_time) / max(len(sample), 1)
+
+    report = {
+        'frames': len(index),
+        'clusters': int(index['cluster'].nunique()),
+        'selected_frames': len(selected),
+        'frame_reduction': 1 - len(selected) / max(len(index), 1),
+        'bytes': int(image_sizes.sum()),
+        'selected_bytes': int(image_sizes[selected].sum()),
+        'epoch_load_time_s': load_time * len(index),
+        'selected_epoch_load_time_s': load_time * len(selected),
+    }
+    CustomLogger('deduplication_report').info(
+        f"{dataset_dir}: {report['selected_frames']}/{report['frames']} frames kept "
+        f"({100 * report['frame_reduction']:.1f}% fewer), "
+        f"{report['selected_bytes'] / 2 ** 20:.1f}/{report['bytes'] / 2 ** 20:.1f} MiB, "
+        f"epoch load time {report['selected_epoch_load_time_s']:.1f}s instead of {report['epoch_load_time_s']:.1f}s"
+    )
+    return report
+
+
+if __name__ == '__main__':
+
+    from utils.conf import PROJECT_DIR
+
+    dataset_paths = [
+        'udacity_dataset_lake',
+        'udacity_dataset_lake_8_8_1',
+        'udacity_dataset_lake_12_8_1',
+        'udacity_dataset_lake_12_12_1',
+    ]
+    for dataset in dataset_paths:
+        build_duplicate_index(PROJECT_DIR.joinpath(dataset, "lake_sunny_day"))
+        deduplication_report(PROJECT_DIR.joinpath(dataset, "lake_sunny_day"))
@@ -0,0 +1,144 @@
+import bisect
+import pathlib
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import torch
+import torchvision.transforms
+from PIL import Image
+from torch.utils.data import ConcatDataset, Dataset
+
+from udacity_gym.extras.data.sharding import shard_indexes
+from udacity_gym.extras.data.shared_cache import SharedFrameCache
+
+# Split boundaries as fractions of the recording, the first skip_first frames are never used
+DEFAULT_SPLITS = {
+    'train': (0.0, 0.9),
+    'val': (0.9, 1.0),
+}
+
+
+class DrivingDataset(Dataset):
+    """
+    Frames of a recording and their steering labels. Metadata is converted to numpy arrays once,
+    __getitem__ does not go through pandas. Training frames are flipped at random, negating the label.
+    With metadata, e.g. a Catalogue query, its rows are used as they are and split only selects the
+    default flip; frames are read from the dataset_dir column when it exists.
+    """
+
+    def __init__(self, dataset_dir: Optional[str] = None, split: str = "train", transform=None,
+                 label_column: str = 'predicted_steering_angle', splits: dict = None, skip_first: int = 10,
+                 flip: Optional[bool] = None, frames: Optional[np.ndarray] = None, cache_images: bool = False,
+                 cache_size: int = 1 << 30, metadata: Optional[pd.DataFrame] = None):
+        self.dataset_dir = pathlib.Path(dataset_dir) if dataset_dir is not None else None
+        self.split = split
+        if metadata is None:
+            metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
+            splits = splits if splits is not None else DEFAULT_SPLITS
+            start, end = splits[split]
+            indexes = np.arange(max(int(len(metadata) * start), skip_first), int(len(metadata) * end))
+            if frames is not None:
+                indexes = np.intersect1d(indexes, frames)
+            metadata = metadata.iloc[indexes]
+
+        if 'dataset_dir' in metadata:
+            directories = metadata['dataset_dir'].astype(str).to_numpy()
+        else:
+            directories = np.full(len(metadata), str(self.dataset_dir), dtype=object)
+        self.image_paths = np.array([
+            str(pathlib.Path(directory, "image", filename))
+            for directory, filename in zip(directories, metadata['image_filename'].to_numpy())
+        ])
+        self.labels = torch.from_numpy(metadata[label_column].to_numpy(dtype=np.float32)).unsqueeze(1)
+
+        self.transform = transform if transform is not None else torchvision.transforms.ToTensor()
+        self.flip = flip if flip is not None else split == "train"
+        # Decoded frames are kept in a cache of cache_size bytes shared by all DataLoader workers
+        self.image_cache = SharedFrameCache(len(self.labels), cache_size) if cache_images else None
+        self.cache_offset = 0
+
+    def __len__(self):
+        return len(self.labels)
+
+    def shard(self, rank: int, world_size: int) -> 'DrivingDataset':
+        """
+        Keep the frames of rank only, see sharding.shard_indexes. Must be called before use_cache.
+        """
+        indexes = shard_indexes(len(self), rank, world_size)
+        self.image_paths = self.image_paths[indexes]
+        self.labels = self.labels[torch.from_numpy(indexes)]
+        return self
+
+    def use_cache(self, image_cache: SharedFrameCache, offset: int = 0):
+        """
+        Keep decoded frames in image_cache, under keys offset to offset + len(self). Several datasets can
+        share one cache, and its memory bound, with disjoint key ranges.
+        """
+        self.image_cache = image_cache
+        self.cache_offset = offset
+
+    def get_image(self, idx) -> Image.Image:
+        if self.image_cache is not None:
+            frame = self.image_cache.get(self.cache_offset + idx)
+            if frame is not None:
+                return Image.fromarray(frame)
+        image = Image.open(self.image_paths[idx])
+        image.load()
+        if self.image_cache is not None:
+            self.image_cache.put(self.cache_offset + idx, np.asarray(image))
+        return image
+
+    def _get_items(self, indexes, flips) -> list:
+        samples = []
+        labels = torch.where(flips.unsqueeze(1), -self.labels[indexes], self.labels[indexes])
+        for idx, flip, steering in zip(indexes.tolist(), flips.tolist(), labels):
+            image = self.get_image(idx)
+            if flip:
+                image = torchvision.transforms.functional.hflip(image)
+            samples.append((self.transform(image), steering))
+        return samples
+
+    def _flips(self, size: int) -> torch.Tensor:
+        if not self.flip:
+            return torch.zeros(size, dtype=torch.bool)
+        return torch.rand(size) > 0.5
+
+    def __getitem__(self, idx):
+        return self._get_items(torch.tensor([idx]), self._flips(1))[0]
+
+    def __getitems__(self, indexes: list) -> list:
+        """
+        Fetch a whole batch at once, labels and flips are computed for the batch in one operation.
+        """
+        return self._get_items(torch.tensor(indexes), self._flips(len(indexes)))
+
+
+class BatchedConcatDataset(ConcatDataset):
+    """
+    ConcatDataset passing batches to the __getitems__ of its datasets. ConcatDataset has no __getitems__,
+    the DataLoader would fetch the samples one by one and skip the batched path of DrivingDataset.
+    """
+
+    def __getitems__(self, indexes: list) -> list:
+        # Positions in the batch and sample indexes, grouped by dataset
+        groups = {}
+        for position, idx in enumerate(indexes):
+            if idx < 0:
+                idx += len(self)
+            dataset_idx = bisect.bisect_right(self.cumulative_sizes, idx)
+            sample_idx = idx - self.cumulative_sizes[dataset_idx - 1] if dataset_idx > 0 else idx
+            positions, sample_indexes = groups.setdefault(dataset_idx, ([], []))
+            positions.append(position)
+            sample_indexes.append(sample_idx)
+
+        samples = [None] * len(indexes)
+        for dataset_idx, (positions, sample_indexes) in groups.items():
+            dataset = self.datasets[dataset_idx]
+            if hasattr(dataset, '__getitems__'):
+                fetched = dataset.__getitems__(sample_indexes)
+            else:
+                fetched = [dataset[idx] for idx in sample_indexes]
+            for position, sample in zip(positions, fetched):
+                samples[position] = sample
+        return samples
@@ -0,0 +1,148 @@
+import json
+import pathlib
+import random
+
+import numpy as np
+import pandas as pd
+import torch
+import torchvision.transforms
+from PIL import Image
+from torch.utils.data import Dataset
+
+from udacity_gym.extras.data.sharding import shard_indexes
+from udacity_gym.logger import CustomLogger
+from udacity_gym.workers import ProcessWorker, available_cpus
+
+FRAME_SHAPE = (160, 320, 3)
+
+
+def _decode_frames(image_paths: list[str], frames_path: str, start: int):
+    frames = np.load(frames_path, mmap_mode='r+')
+    for i, image_path in enumerate(image_paths):
+        with Image.open(image_path) as image:
+            frames[start + i] = np.asarray(image.convert('RGB'))
+    frames.flush()
+
+
+def _cache_info(dataset_dir: pathlib.Path, label_column: str) -> dict:
+    log_stat = dataset_dir.joinpath('log.csv').stat()
+    return {
+        'log_size': log_stat.st_size,
+        'log_mtime_ns': log_stat.st_mtime_ns,
+        'label_column': label_column,
+    }
+
+
+def build_frame_cache(dataset_dir, cache_dir=None, label_column: str = 'predicted_steering_angle',
+                      num_workers: int = None, chunk_size: int = 512, overwrite: bool = False) -> pathlib.Path:
+    """
+    Decode every image of a recorded dataset into cache_dir/frames.npy, a uint8 N x 160 x 320 x 3 array,
+    and its labels into cache_dir/labels.npy. The cache is rebuilt when log.csv changes. Images are decoded
+    by num_workers processes, by default one per CPU the process may run on.
+    """
+    logger = CustomLogger('build_frame_cache')
+    dataset_dir = pathlib.Path(dataset_dir)
+    cache_dir = dataset_dir.joinpath('cache') if cache_dir is None else pathlib.Path(cache_dir)
+    info_path = cache_dir.joinpath('cache.json')
+    info = _cache_info(dataset_dir, label_column)
+    if not overwrite and info_path.exists() and json.loads(info_path.read_text()) == info:
+        logger.info(f"Frame cache {cache_dir} is up to date")
+        return cache_dir
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    info_path.unlink(missing_ok=True)
+    metadata = pd.read_csv(dataset_dir.joinpath('log.csv'))
+    image_paths = [str(dataset_dir.joinpath('image', filename)) for filename in metadata['image_filename']]
+    np.save(cache_dir.joinpath('labels.npy'), metadata[label_column].to_numpy(dtype=np.float32))
+
+    # Workers decode chunks straight into the memory-mapped array, frames never go through a pipe
+    frames_path = cache_dir.joinpath('frames.npy')
+    frames = np.lib.format.open_memmap(frames_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(image_paths), *FRAME_SHAPE))
+    del frames
+    if num_workers is None:
+        num_workers = available_cpus()
+    workers = [ProcessWorker() for _ in range(num_workers)]
+    try:
+        starts = list(range(0, len(image_paths), chunk_size))
+        for i in range(0, len(starts), num_workers):
+            for worker, start in zip(workers, starts[i:i + num_workers]):
+                worker.submit(_decode_frames, image_paths[start:start + chunk_size], str(frames_path), start)
+            for worker, _ in zip(workers, starts[i:i + num_workers]):
+                worker.result()
+    finally:
+        for worker in workers:
+            worker.close()
+
+    # The info file is written last, an interrupted build is never mistaken for a complete cache
+    info_path.write_text(json.dumps(info))
+    logger.info(f"Cached {len(image_paths)} frames of {dataset_dir} in {cache_dir}")
+    return cache_dir
+
+
+class CachedDrivingDataset(Dataset):
+    """
+    DrivingDataset reading frames from a cache built by build_frame_cache. The cache is memory-mapped
+    by each DataLoader worker on first access, workers share its pages through the OS page cache.
+    When frames is given, e.g. by deduplication.select_frames, only those positions of log.csv are used.
+    With raw, uint8 C x H x W frames are returned as they are, to be converted and augmented by batch.
+    """
+
+    def __init__(self, cache_dir, split: str = "train", transform=None, frames: np.ndarray = None,
+                 raw: bool = False):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.labels = np.load(self.cache_dir.joinpath('labels.npy'))
+        self.split = split
+        if self.split == "train":
+            self.indexes = np.arange(10, int(len(self.labels) * 0.9))
+        else:
+            self.indexes = np.arange(int(len(self.labels) * 0.9), len(self.labels))
+        if frames is not None:
+            self.indexes = np.intersect1d(self.indexes, frames)
+        self.transform = transform
+        self.raw = raw
+        self.frames = None
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def shard(self, rank: int, world_size: int) -> 'CachedDrivingDataset':
+        self.indexes = self.indexes[shard_indexes(len(self.indexes), rank, world_size)]
+        return self
+
+    def __getstate__(self):
+        # Each worker maps the cache itself instead of receiving a copy of the mapping
+        state = self.__dict__.copy()
+        state['frames'] = None
+        return state
+
+    def get_frame(self, idx) -> torch.Tensor:
+        if self.frames is None:
+            # Copy-on-write mapping, pages are shared and tensors can be built without copying
+            self.frames = np.load(self.cache_dir.joinpath('frames.npy'), mmap_mode='c')
+        return torch.from_numpy(self.frames[self.indexes[idx]])
+
+    def __getitem__(self, idx):
+        steering = torch.tensor([self.labels[self.indexes[idx]]], dtype=torch.float32)
+        if self.raw:
+            return self.get_frame(idx).permute(2, 0, 1), steering
+        image = self.get_frame(idx).permute(2, 0, 1).float().div_(255)
+        if self.split == "train" and random.random() > 0.5:
+            image, steering = torchvision.transforms.functional.hflip(image), -steering
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, steering
+
+
+if __name__ == '__main__':
+
+    from utils.conf import PROJECT_DIR
+
+    dataset_paths = [
+        'udacity_dataset_lake',
+        'udacity_dataset_lake_8_8_1',
+        'udacity_dataset_lake_12_8_1',
+        'udacity_dataset_lake_12_12_1',
+    ]
+    for dataset in dataset_paths:
+        build_frame_cache(PROJECT_DIR.joinpath(dataset, "lake_sunny_day"))
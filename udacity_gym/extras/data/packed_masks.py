@@ -0,0 +1,204 @@
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+
+from udacity_gym.logger import CustomLogger
+from udacity_gym.workers import ProcessWorker, available_cpus
+
+MASK_SHAPE = (160, 320)
+
+# Number of set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int64)
+
+
+def pack_masks(masks: np.ndarray) -> np.ndarray:
+    """
+    Pack boolean N x H x W masks into uint8 N x H x ceil(W / 8) arrays, 8 pixels per byte.
+    """
+    return np.packbits(masks, axis=-1)
+
+
+def unpack_masks(packed: np.ndarray, width: int = MASK_SHAPE[1]) -> np.ndarray:
+    """
+    Boolean masks of width pixels of packed masks.
+    """
+    return np.unpackbits(packed, axis=-1, count=width).astype(bool)
+
+
+def mask_cache_path(dataset_dir, name: str = 'segmentation', cache_dir=None) -> pathlib.Path:
+    """
+    Path of the packed mask file name of a dataset, in dataset_dir/cache unless cache_dir is given.
+    """
+    cache_dir = pathlib.Path(dataset_dir).joinpath('cache') if cache_dir is None else pathlib.Path(cache_dir)
+    return cache_dir.joinpath(f"{name}.npy")
+
+
+def _decode_masks(image_paths: list[str], masks_path: str, start: int, channel: int, threshold: int):
+    masks = np.load(masks_path, mmap_mode='r+')
+    for i, image_path in enumerate(image_paths):
+        with Image.open(image_path) as image:
+            masks[start + i] = pack_masks(np.asarray(image.convert('RGB'))[:, :, channel] >= threshold)
+    masks.flush()
+
+
+def build_mask_cache(dataset_dir, cache_dir=None, name: str = 'segmentation', folder: str = 'segmentation',
+                     filename_column: str = 'segmentation_filename', channel: int = 2, threshold: int = 255,
+                     shape: tuple = MASK_SHAPE, num_workers: int = None, chunk_size: int = 512,
+                     overwrite: bool = False) -> pathlib.Path:
+    """
+    Convert the PNG masks of dataset_dir/folder, listed in log.csv, into cache_dir/name.npy, packed masks
+    in the order of log.csv. A pixel is set when its channel is at least threshold, by default the blue
+    channel of the ground truth is 255 on the road; use folder='computed_segmentation' and threshold=128
+    for predictions stored as images. The cache is rebuilt when log.csv changes. Images are decoded by
+    num_workers processes, by default one per CPU the process may run on.
+    """
+    logger = CustomLogger('build_mask_cache')
+    dataset_dir = pathlib.Path(dataset_dir)
+    masks_path = mask_cache_path(dataset_dir, name, cache_dir)
+    info_path = masks_path.with_suffix('.json')
+    log_stat = dataset_dir.joinpath('log.csv').stat()
+    info = {
+        'log_size': log_stat.st_size,
+        'log_mtime_ns': log_stat.st_mtime_ns,
+        'folder': folder,
+        'channel': channel,
+        'threshold': threshold,
+        'height': shape[0],
+        'width': shape[1],
+    }
+    if not overwrite and info_path.exists() and json.loads(info_path.read_text()) == info:
+        logger.info(f"Mask cache {masks_path} is up to date")
+        return masks_path
+
+    masks_path.parent.mkdir(parents=True, exist_ok=True)
+    info_path.unlink(missing_ok=True)
+    metadata = pd.read_csv(dataset_dir.joinpath('log.csv'))
+    image_paths = [str(dataset_dir.joinpath(folder, filename)) for filename in metadata[filename_column]]
+    masks = np.lib.format.open_memmap(masks_path, mode='w+', dtype=np.uint8,
+                                      shape=(len(image_paths), shape[0], (shape[1] + 7) // 8))
+    del masks
+    if num_workers is None:
+        num_workers = available_cpus()
+    workers = [ProcessWorker() for _ in range(num_workers)]
+    try:
+        starts = list(range(0, len(image_paths), chunk_size))
+        for i in range(0, len(starts), num_workers):
+            for worker, start in zip(workers, starts[i:i + num_workers]):
+                worker.submit(_decode_masks, image_paths[start:start + chunk_size], str(masks_path), start,
+                              channel, threshold)
+            for worker, _ in zip(workers, starts[i:i + num_workers]):
+                worker.result()
+    finally:
+        for worker in workers:
+            worker.close()
+
+    # The info file is written last, an interrupted build is never mistaken for a complete cache
+    info_path.write_text(json.dumps(info))
+    logger.info(f"Packed {len(image_paths)} masks of {dataset_dir.joinpath(folder)} in {masks_path}")
+    return masks_path
+
+
+class PackedMasks:
+    """
+    Reader of a packed mask file, memory-mapped on first access. Like CachedDrivingDataset, the mapping
+    is not pickled, each DataLoader worker maps the file itself.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        info = json.loads(self.path.with_suffix('.json').read_text())
+        self.shape = (info['height'], info['width'])
+        self.masks = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['masks'] = None
+        return state
+
+    @property
+    def packed(self) -> np.ndarray:
+        if self.masks is None:
+            self.masks = np.load(self.path, mmap_mode='r')
+        return self.masks
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, idx) -> np.ndarray:
+        return unpack_masks(self.packed[idx], self.shape[1])
+
+    def get_tensor(self, idx) -> torch.Tensor:
+        """
+        Mask of position idx as a float 1 x H x W tensor, as SegmentationDataset returns it.
+        """
+        return torch.from_numpy(self[idx]).unsqueeze(0).to(torch.float)
+
+
+def packed_confusion_counts(pred: PackedMasks, true: PackedMasks, positions: np.ndarray,
+                            chunk_size: int = 256) -> np.ndarray:
+    """
+    TP, FP, TN and FN pixel counts of pred against true over positions, counted on the packed bytes
+    without unpacking the masks.
+    """
+    if pred.shape != true.shape:
+        raise ValueError(f"Predicted masks of shape {pred.shape} do not match true masks of shape {true.shape}")
+    positions = np.asarray(positions)
+    tp, num_pred, num_true = 0, 0, 0
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        pred_bits, true_bits = pred.packed[chunk], true.packed[chunk]
+        tp += int(_POPCOUNT[pred_bits & true_bits].sum())
+        num_pred += int(_POPCOUNT[pred_bits].sum())
+        num_true += int(_POPCOUNT[true_bits].sum())
+    fp, fn = num_pred - tp, num_true - tp
+    tn = len(positions) * pred.shape[0] * pred.shape[1] - tp - fp - fn
+    return np.array([tp, fp, tn, fn], dtype=np.int64)
+
+
+class PackedMaskWriter:
+    """
+    Write masks in a packed mask file of num_masks positions, the file can be read with PackedMasks
+    once closed.
+    """
+
+    def __init__(self, path, num_masks: int, shape: tuple = MASK_SHAPE):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.shape = tuple(shape)
+        self.path.with_suffix('.json').unlink(missing_ok=True)
+        self.masks = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint8,
+                                               shape=(num_masks, shape[0], (shape[1] + 7) // 8))
+
+    def write(self, positions, masks: np.ndarray):
+        """
+        Store boolean N x H x W masks at positions.
+        """
+        self.masks[np.asarray(positions)] = pack_masks(masks)
+
+    def close(self):
+        if self.masks is None:
+            return
+        self.masks.flush()
+        self.masks = None
+        self.path.with_suffix('.json').write_text(json.dumps({'height': self.shape[0], 'width': self.shape[1]}))
+
+
+if __name__ == '__main__':
+
+    import itertools
+
+    from utils.conf import PROJECT_DIR
+
+    for track, daytime, weather in itertools.product(
+            ["lake", "jungle", "mountain"],
+            ["day", "daynight"],
+            ["sunny", "rainy", "snowy", "foggy"],
+    ):
+        for prefix in ["", "inpainting_"]:
+            dataset_dir = PROJECT_DIR.joinpath(f"udacity_dataset/{prefix}{track}_{weather}_{daytime}")
+            if dataset_dir.exists():
+                build_mask_cache(dataset_dir)
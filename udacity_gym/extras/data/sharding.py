@@ -0,0 +1,28 @@
+import numpy as np
+from torch.utils.data import ConcatDataset, Dataset
+
+
+def shard_indexes(num_items: int, rank: int, world_size: int) -> np.ndarray:
+    """
+    Positions of the items of rank, every world_size-th item starting at rank. Frames of a recording
+    are consecutive, striding gives every rank frames of the whole track. All the ranks receive the same
+    number of items, the last num_items % world_size items are dropped, otherwise ranks would run a
+    different number of steps and wait for each other forever.
+    """
+    if not 0 <= rank < world_size:
+        raise ValueError(f"Rank {rank} out of range for world size {world_size}")
+    return np.arange(rank, num_items - num_items % world_size, world_size)
+
+
+def shard_dataset(dataset: Dataset, rank: int, world_size: int) -> Dataset:
+    """
+    Keep the shard of rank of dataset, which must have a shard method. ConcatDatasets are sharded
+    dataset by dataset, so that every rank reads a part of every recording.
+    """
+    if world_size == 1:
+        return dataset
+    if isinstance(dataset, ConcatDataset):
+        return type(dataset)([shard_dataset(child, rank, world_size) for child in dataset.datasets])
+    if not hasattr(dataset, 'shard'):
+        raise TypeError(f"{type(dataset).__name__} cannot be sharded, it has no shard method")
+    return dataset.shard(rank, world_size)
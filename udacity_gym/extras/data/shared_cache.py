@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from udacity_gym.extras.data.frame_cache import FRAME_SHAPE
+
+# Counters stored in the shared header
+_CLOCK, _HITS, _MISSES, _INSERTS, _EVICTIONS = range(5)
+_HEADER_SIZE = 8
+
+
+def _unlink(memory: shared_memory.SharedMemory, owner_pid: int):
+    # Forked workers inherit the finalizer, they must not remove the segment of the main process
+    if os.getpid() == owner_pid:
+        memory.unlink()
+
+
+class SharedFrameCache:
+    """
+    Least-recently-used cache of decoded uint8 frames in shared memory, bounded by max_bytes. Keys are
+    integers in [0, num_keys). The cache is created in the main process and shared with the DataLoader
+    workers, forked or spawned, so a frame decoded by one worker is a hit for all the others. The lock is
+    created in multiprocessing_context, which must be the one of the DataLoader when it is not the default.
+    """
+
+    def __init__(self, num_keys: int, max_bytes: int = 1 << 30, frame_shape: tuple = FRAME_SHAPE,
+                 multiprocessing_context=None):
+        self.num_keys = num_keys
+        self.frame_shape = tuple(frame_shape)
+        frame_size = int(np.prod(self.frame_shape))
+        self.num_slots = max(1, min(num_keys, max_bytes // frame_size))
+        size = 8 * (_HEADER_SIZE + 2 * self.num_slots) + 4 * num_keys + frame_size * self.num_slots
+        if isinstance(multiprocessing_context, str):
+            multiprocessing_context = multiprocessing.get_context(multiprocessing_context)
+        self.lock = (multiprocessing_context or multiprocessing).Lock()
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        # Only the creating process removes the segment, when the cache is closed or collected
+        self._finalizer = weakref.finalize(self, _unlink, self.memory, os.getpid())
+        self._map()
+        self.header[:] = 0
+        self.slot_keys[:] = -1
+        self.slot_ticks[:] = 0
+        self.key_slots[:] = -1
+
+    def _map(self):
+        buffer = self.memory.buf
+        offset = 0
+
+        def array(dtype, shape):
+            nonlocal offset
+            result = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            offset += result.nbytes
+            return result
+
+        self.header = array(np.int64, (_HEADER_SIZE,))
+        self.slot_keys = array(np.int64, (self.num_slots,))
+        self.slot_ticks = array(np.int64, (self.num_slots,))
+        self.key_slots = array(np.int32, (self.num_keys,))
+        self.frames = array(np.uint8, (self.num_slots, *self.frame_shape))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ['memory', '_finalizer', 'header', 'slot_keys', 'slot_ticks', 'key_slots', 'frames']:
+            del state[name]
+        state['name'] = self.memory.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self.memory = shared_memory.SharedMemory(name=name)
+        self._finalizer = None
+        self._map()
+
+    def get(self, key: int) -> Optional[np.ndarray]:
+        """
+        Return a copy of the cached frame of key, or None when it is not cached.
+        """
+        with self.lock:
+            slot = self.key_slots[key]
+            if slot < 0:
+                self.header[_MISSES] += 1
+                return None
+            self.header[_HITS] += 1
+            self.header[_CLOCK] += 1
+            self.slot_ticks[slot] = self.header[_CLOCK]
+            # Copied under the lock, the slot could be evicted by another worker right after
+            return self.frames[slot].copy()
+
+    def put(self, key: int, frame: np.ndarray) -> bool:
+        """
+        Cache the frame of key, evicting the least recently used frame when the cache is full. Frames
+        with another shape are not cached, False is returned.
+        """
+        if frame.shape != self.frame_shape or frame.dtype != np.uint8:
+            return False
+        with self.lock:
+            self.header[_CLOCK] += 1
+            slot = self.key_slots[key]
+            if slot < 0:
+                # Empty slots have tick 0 and are used before any eviction
+                slot = int(np.argmin(self.slot_ticks))
+                evicted = self.slot_keys[slot]
+                if evicted >= 0:
+                    self.key_slots[evicted] = -1
+                    self.header[_EVICTIONS] += 1
+                self.slot_keys[slot] = key
+                self.key_slots[key] = slot
+                self.header[_INSERTS] += 1
+            self.frames[slot] = frame
+            self.slot_ticks[slot] = self.header[_CLOCK]
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits, misses = int(self.header[_HITS]), int(self.header[_MISSES])
+            frames = int((self.slot_keys >= 0).sum())
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.0,
+                'inserts': int(self.header[_INSERTS]),
+                'evictions': int(self.header[_EVICTIONS]),
+                'frames': frames,
+                'capacity': self.num_slots,
+                'bytes': frames * self.frames[0].nbytes,
+            }
+
+    def close(self):
+        # Views on the buffer must be released before the mapping is closed
+        for name in ['header', 'slot_keys', 'slot_ticks', 'key_slots', 'frames']:
+            self.__dict__.pop(name, None)
+        self.memory.close()
+        if self._finalizer is not None:
+            self._finalizer()
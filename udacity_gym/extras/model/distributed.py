@@ -0,0 +1,60 @@
+import lightning as pl
+from lightning.pytorch.strategies import DDPStrategy
+from torch.utils.data import DataLoader, Dataset
+
+from udacity_gym.extras.data.sharding import shard_dataset
+
+
+class RankSeed(pl.Callback):
+    """
+    Seed every rank with seed + rank once the ranks are known. Models are built before, with the common
+    seed, so all the ranks start from the same weights; afterwards each rank draws its own shuffles, flips
+    and augmentations instead of repeating those of the other ranks.
+    """
+
+    def __init__(self, seed: int):
+        super().__init__()
+        self.seed = seed
+
+    def setup(self, trainer: pl.Trainer, pl_module: pl.LightningModule, stage: str):
+        pl.seed_everything(self.seed + trainer.global_rank, workers=True)
+
+
+def ddp_strategy(process_group_backend: str = None) -> DDPStrategy:
+    """
+    DDP strategy, with the gloo backend on CPU unless process_group_backend is given. Nodes are set up
+    by the environment, e.g. MASTER_ADDR, MASTER_PORT and NODE_RANK, or by SLURM.
+    """
+    return DDPStrategy(process_group_backend=process_group_backend)
+
+
+class ShardedDataModule(pl.LightningDataModule):
+    """
+    Loaders over datasets built beforehand, each rank keeps its shard of them, see sharding.shard_dataset.
+    The Trainer must be created with use_distributed_sampler=False.
+    """
+
+    def __init__(self, train_dataset: Dataset, val_dataset: Dataset, batch_size: int = 32, val_batch_size: int = 16,
+                 num_workers: int = 8):
+        super().__init__()
+        self.train_dataset = train_dataset
+        self.val_dataset = val_dataset
+        self.batch_size = batch_size
+        self.val_batch_size = val_batch_size
+        self.num_workers = num_workers
+        self.sharded = False
+
+    def setup(self, stage: str):
+        if self.sharded or self.trainer is None:
+            return
+        self.train_dataset = shard_dataset(self.train_dataset, self.trainer.global_rank, self.trainer.world_size)
+        self.val_dataset = shard_dataset(self.val_dataset, self.trainer.global_rank, self.trainer.world_size)
+        self.sharded = True
+
+    def train_dataloader(self):
+        return DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers,
+                          prefetch_factor=2 if self.num_workers > 0 else None)
+
+    def val_dataloader(self):
+        return DataLoader(self.val_dataset, batch_size=self.val_batch_size, num_workers=self.num_workers,
+                          prefetch_factor=2 if self.num_workers > 0 else None)
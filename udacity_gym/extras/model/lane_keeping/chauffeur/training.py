@@ -1,57 +1,18 @@
-import pathlib
-import random
 import lightning as pl
-import pandas as pd
 import torch
 import torchvision.transforms
-from PIL import Image
 from lightning.pytorch.callbacks import ModelCheckpoint, EarlyStopping
 
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader
 
 from udacity_gym.extras.model.lane_keeping.chauffeur.chauffeur_model import Chauffeur
+from udacity_gym.extras.data.driving_dataset import BatchedConcatDataset, DrivingDataset
 from utils.conf import ACCELERATOR, DEVICE, DEFAULT_DEVICE, CHECKPOINT_DIR, PROJECT_DIR
 
 pl.seed_everything(42)
 torch.set_float32_matmul_precision('high')
 
 
-def random_flip(x, y):
-    if random.random() > 0.5:
-        return torchvision.transforms.functional.hflip(x), -y
-    return x, y
-
-
-class DrivingDataset(Dataset):
-
-    def __init__(self, dataset_dir: str, split: str = "train", transform=None):
-        self.dataset_dir = pathlib.Path(dataset_dir)
-        self.metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
-        self.split = split
-        if self.split == "train":
-            self.metadata = self.metadata[10: int(len(self.metadata) * 0.9)]
-        else:
-            self.metadata = self.metadata[int(len(self.metadata) * 0.9):]
-        if transform == None:
-            self.transform = torchvision.transforms.Compose([
-                torchvision.transforms.AugMix(),
-                torchvision.transforms.ToTensor(),
-            ])
-        else:
-            self.transform = transform
-
-    def __len__(self):
-        return len(self.metadata)
-
-    def __getitem__(self, idx):
-        image = Image.open(self.dataset_dir.joinpath("image", self.metadata['image_filename'].values[idx]))
-        steering = self.metadata['predicted_steering_angle'].values[idx]
-        steering = torch.tensor([steering], dtype=torch.float32)
-        if self.split == "train":
-            image, steering = random_flip(image, steering)
-        return self.transform(image), steering
-
-
 if __name__ == '__main__':
     # Run parameters
     input_shape = (3, 160, 320)
@@ -65,8 +26,12 @@ if __name__ == '__main__':
         'udacity_dataset_lake_12_12_1',
     ]
 
-    train_dataset = torch.utils.data.ConcatDataset([
-        DrivingDataset(dataset_dir=PROJECT_DIR.joinpath(dataset, "lake_sunny_day"), split="train")
+    train_dataset = BatchedConcatDataset([
+        DrivingDataset(dataset_dir=PROJECT_DIR.joinpath(dataset, "lake_sunny_day"), split="train",
+                       transform=torchvision.transforms.Compose([
+                           torchvision.transforms.AugMix(),
+                           torchvision.transforms.ToTensor(),
+                       ]))
         for dataset in dataset_paths
     ])
     train_loader = DataLoader(
@@ -77,7 +42,7 @@ if __name__ == '__main__':
         num_workers=16,
     )
 
-    val_dataset = torch.utils.data.ConcatDataset([
+    val_dataset = BatchedConcatDataset([
         DrivingDataset(dataset_dir=PROJECT_DIR.joinpath(dataset, "lake_sunny_day"), split="val", transform=torchvision.transforms.ToTensor())
         for dataset in dataset_paths
     ])
@@ -51,16 +51,16 @@ class Epoch(pl.LightningModule):
         img, true = batch
         pred = self(img)
         loss = self.loss(pred, true)
-        self.log("val/loss", loss, prog_bar=True, on_epoch=True)
-        self.log("val/rmse", math.sqrt(loss), prog_bar=True, on_epoch=True)
+        self.log("val/loss", loss, prog_bar=True, on_epoch=True, sync_dist=True)
+        self.log("val/rmse", math.sqrt(loss), prog_bar=True, on_epoch=True, sync_dist=True)
         return loss
 
     def test_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
         img, true = batch
         pred = self(img)
         loss = self.loss(pred, true)
-        self.log("test/loss", loss, prog_bar=True)
-        self.log("test/rmse", math.sqrt(loss), prog_bar=True)
+        self.log("test/loss", loss, prog_bar=True, sync_dist=True)
+        self.log("test/rmse", math.sqrt(loss), prog_bar=True, sync_dist=True)
         return loss
 
     def predict_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
@@ -1,91 +1,16 @@
-import pathlib
-import random
-from functools import cache
-
 import lightning as pl
-import pandas as pd
 import torch
-import torchvision.transforms
-from PIL import Image
 from lightning.pytorch.callbacks import ModelCheckpoint, EarlyStopping
 
-from torch.utils.data import Dataset, DataLoader
-
 from udacity_gym.extras.model.lane_keeping.dave.dave_model import Dave2
 from udacity_gym.extras.model.lane_keeping.epoch.epoch_model import Epoch
+from udacity_gym.extras.data.augmentation import BatchAugmentation, DrivingDataModule
 from utils.conf import ACCELERATOR, DEVICE, DEFAULT_DEVICE, CHECKPOINT_DIR, PROJECT_DIR
 
 pl.seed_everything(42)
 torch.set_float32_matmul_precision('high')
 
 
-def random_flip(x, y):
-    if random.random() > 0.5:
-        return torchvision.transforms.functional.hflip(x), -y
-    return x, y
-
-
-class DrivingDataset(Dataset):
-
-    def __init__(self, dataset_dir: str, split: str = "train", transform=None):
-        self.dataset_dir = pathlib.Path(dataset_dir)
-        self.metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
-        self.split = split
-        if self.split == "train":
-            self.metadata = self.metadata[10: int(len(self.metadata) * 0.9)]
-        else:
-            self.metadata = self.metadata[int(len(self.metadata) * 0.9):]
-        if transform == None:
-            self.transform = torchvision.transforms.Compose([
-                torchvision.transforms.AugMix(),
-                torchvision.transforms.ToTensor(),
-            ])
-        else:
-            self.transform = transform
-
-    def __len__(self):
-        return len(self.metadata)
-
-    @cache
-    def get_image(self, idx):
-        return Image.open(self.dataset_dir.joinpath("image", self.metadata['image_filename'].values[idx]))
-
-    def __getitem__(self, idx):
-        image = self.get_image(idx)
-        steering = self.metadata['predicted_steering_angle'].values[idx]
-        steering = torch.tensor([steering], dtype=torch.float32)
-        if self.split == "train":
-            image, steering = random_flip(image, steering)
-        return self.transform(image), steering
-
-class AugmentedDrivingDataset(Dataset):
-
-    def __init__(self, dataset_dir: str, transform=None):
-        self.dataset_dir = pathlib.Path(dataset_dir)
-        self.metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
-        if transform is None:
-            self.transform = torchvision.transforms.Compose([
-                torchvision.transforms.AugMix(),
-                torchvision.transforms.ToTensor(),
-            ])
-        else:
-            self.transform = transform
-
-    def __len__(self):
-        return len(self.metadata)
-
-    @cache
-    def get_image(self, idx):
-        return Image.open(self.dataset_dir.joinpath("image", self.metadata['image_filename'].values[idx]))
-
-    def __getitem__(self, idx):
-        image = self.get_image(idx)
-        steering = self.metadata['predicted_steering_angle'].values[idx]
-        steering = torch.tensor([steering], dtype=torch.float32)
-        image, steering = random_flip(image, steering)
-        return self.transform(image), steering
-
-
 if __name__ == '__main__':
 
     for approach in ['instruct', 'inpainting', 'refining']:
@@ -102,30 +27,14 @@ if __name__ == '__main__':
             'udacity_dataset_lake_12_8_1',
             'udacity_dataset_lake_12_12_1',
         ]
-        train_dataset = torch.utils.data.ConcatDataset([
-            DrivingDataset(dataset_dir=PROJECT_DIR.joinpath(dataset, "lake_sunny_day"), split="train")
-            for dataset in dataset_paths
-        ])
-
-        train_loader = DataLoader(
-            train_dataset,
+        # Workers only decode frames, flip and AugMix run on whole batches on the training device
+        data_module = DrivingDataModule(
+            dataset_dirs=[PROJECT_DIR.joinpath(dataset, "lake_sunny_day") for dataset in dataset_paths],
             batch_size=256,
-            shuffle=True,
-            prefetch_factor=4,
-            num_workers=16,
-        )
-
-        val_dataset = torch.utils.data.ConcatDataset([
-            DrivingDataset(dataset_dir=PROJECT_DIR.joinpath(dataset, "lake_sunny_day"), split="val",
-                           transform=torchvision.transforms.ToTensor())
-            for dataset in dataset_paths
-        ])
-        val_loader = DataLoader(
-            val_dataset,
-            batch_size=64,
-            shuffle=True,
-            prefetch_factor=2,
+            val_batch_size=64,
             num_workers=8,
+            augmentation=BatchAugmentation(brightness=0, contrast=0, saturation=0),
+            cache_images=True,
         )
 
         checkpoint_callback = ModelCheckpoint(
@@ -147,6 +56,5 @@ if __name__ == '__main__':
         driving_model = Epoch()
         trainer.fit(
             driving_model,
-            train_dataloaders=train_loader,
-            val_dataloaders=val_loader,
+            datamodule=data_module,
         )
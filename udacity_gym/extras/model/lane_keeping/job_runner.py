@@ -0,0 +1,196 @@
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import tqdm
+
+from udacity_gym.extras.data.frame_cache import build_frame_cache
+from udacity_gym.extras.model.lane_keeping.train import load_config
+from udacity_gym.logger import CustomLogger
+from utils.conf import PROJECT_DIR
+
+
+class TrainingJob:
+    """
+    One training of train.py, described by a configuration file and overrides of its keys.
+    """
+
+    def __init__(self, name: str, config_path=None, overrides: dict = None):
+        self.name = name
+        self.config_path = config_path
+        self.overrides = overrides or {}
+
+    def config(self) -> dict:
+        return load_config(self.config_path, self.overrides)
+
+
+def partition_cores(num_partitions: int, cores: list = None) -> list[list[int]]:
+    """
+    Split cores, by default the cores this process can run on, in num_partitions contiguous groups.
+    """
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_partitions = max(1, min(num_partitions, len(cores)))
+    size, remainder = divmod(len(cores), num_partitions)
+    partitions = []
+    start = 0
+    for i in range(num_partitions):
+        end = start + size + (1 if i < remainder else 0)
+        partitions.append(cores[start:end])
+        start = end
+    return partitions
+
+
+def _read_throughput(path: pathlib.Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+class TrainingJobRunner:
+    """
+    Train several jobs at once on one machine. Each running job is a train.py process pinned to its own
+    group of cores, with as many compute threads as cores. Jobs reading frame caches share them: the caches
+    are built once before the first job starts and every job maps the same read-only pages.
+    """
+
+    def __init__(self, jobs: list[TrainingJob], work_dir, max_concurrent: int = None, poll_interval: float = 5.0):
+        self.jobs = jobs
+        self.work_dir = pathlib.Path(work_dir)
+        self.max_concurrent = min(max_concurrent or len(jobs), len(jobs))
+        self.poll_interval = poll_interval
+        self.logger = CustomLogger(str(self.__class__))
+
+    def job_dir(self, job: TrainingJob) -> pathlib.Path:
+        return self.work_dir.joinpath(job.name)
+
+    def build_frame_caches(self):
+        dataset_dirs = []
+        for job in self.jobs:
+            config = job.config()
+            if config['frame_caches']:
+                dataset_dirs += [directory for directory in config['dataset_dirs'] if directory not in dataset_dirs]
+        for dataset_dir in dataset_dirs:
+            build_frame_cache(PROJECT_DIR.joinpath(dataset_dir))
+
+    def start(self, job: TrainingJob, cores: list[int]) -> subprocess.Popen:
+        job_dir = self.job_dir(job)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        job_dir.joinpath('throughput.jsonl').unlink(missing_ok=True)
+        job_dir.joinpath('result.json').unlink(missing_ok=True)
+        config = {
+            **job.config(),
+            'num_threads': len(cores),
+            'throughput_log': str(job_dir.joinpath('throughput.jsonl')),
+        }
+        job_dir.joinpath('config.json').write_text(json.dumps(config, indent=2, default=str))
+
+        environment = {
+            **os.environ,
+            'OMP_NUM_THREADS': str(len(cores)),
+            'PYTHONPATH': os.pathsep.join([str(PROJECT_DIR)] + os.environ.get('PYTHONPATH', '').split(os.pathsep)),
+        }
+        # Data loader workers are forked by the job and inherit its cores
+        pin = (lambda: os.sched_setaffinity(0, cores)) if hasattr(os, 'sched_setaffinity') else None
+        with open(job_dir.joinpath('train.log'), 'w') as log_file:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'udacity_gym.extras.model.lane_keeping.train',
+                 str(job_dir.joinpath('config.json')), '--result', str(job_dir.joinpath('result.json'))],
+                stdout=log_file, stderr=subprocess.STDOUT, env=environment, preexec_fn=pin,
+            )
+        self.logger.info(f"Started job {job.name} on cores {cores[0]}-{cores[-1]} (pid {process.pid})")
+        return process
+
+    def _samples(self, job: TrainingJob) -> int:
+        return sum(epoch['samples'] for epoch in _read_throughput(self.job_dir(job).joinpath('throughput.jsonl')))
+
+    def run(self) -> pd.DataFrame:
+        self.build_frame_caches()
+        pending = list(self.jobs)
+        free_cores = partition_cores(self.max_concurrent)
+        running = {}
+        finished = {}
+        start_time = time.perf_counter()
+
+        def start_next_jobs():
+            while len(pending) > 0 and len(free_cores) > 0:
+                job, cores = pending.pop(0), free_cores.pop(0)
+                running[job.name] = (job, cores, self.start(job, cores), time.perf_counter())
+
+        start_next_jobs()
+        with tqdm.tqdm(total=len(self.jobs), unit='job') as progress:
+            while len(running) > 0:
+                time.sleep(self.poll_interval)
+                for name, (job, cores, process, job_start_time) in list(running.items()):
+                    if process.poll() is None:
+                        continue
+                    del running[name]
+                    free_cores.append(cores)
+                    finished[name] = (process.returncode, time.perf_counter() - job_start_time, cores)
+                    if process.returncode != 0:
+                        self.logger.error(f"Job {name} failed with exit code {process.returncode}, "
+                                          f"see {self.job_dir(job).joinpath('train.log')}")
+                    progress.update(1)
+                start_next_jobs()
+                samples = sum(self._samples(job) for job in self.jobs)
+                progress.set_postfix(
+                    running=len(running),
+                    pending=len(pending),
+                    samples_per_sec=f"{samples / (time.perf_counter() - start_time):.1f}",
+                )
+
+        elapsed = time.perf_counter() - start_time
+        results = []
+        for job in self.jobs:
+            returncode, duration, cores = finished[job.name]
+            result_path = self.job_dir(job).joinpath('result.json')
+            result = json.loads(result_path.read_text()) if result_path.exists() else {}
+            epochs = result.get('throughput') or _read_throughput(self.job_dir(job).joinpath('throughput.jsonl'))
+            samples = sum(epoch['samples'] for epoch in epochs)
+            results.append({
+                'job': job.name,
+                'status': 'done' if returncode == 0 else 'failed',
+                'cores': len(cores),
+                'epochs': len(epochs),
+                'samples': samples,
+                'duration': duration,
+                'samples_per_sec': samples / duration if duration > 0 else 0.0,
+                'val_loss': result.get('val_loss'),
+                'checkpoint': result.get('checkpoint'),
+            })
+        results = pd.DataFrame(results)
+        self.logger.info(f"Trained {len(self.jobs)} jobs in {elapsed:.1f}s, aggregate throughput "
+                         f"{results['samples'].sum() / elapsed:.1f} samples/s")
+        return results
+
+
+if __name__ == '__main__':
+
+    from utils.conf import LOG_DIR
+
+    # The approaches of the training_augmented scripts, trained side by side
+    jobs = [
+        TrainingJob(
+            name=f"dave2_{approach}",
+            config_path=pathlib.Path(__file__).parent.joinpath('configs', 'dave2_instruct.json'),
+            overrides={
+                'dataset_dirs': [
+                    'udacity_dataset_lake/lake_sunny_day',
+                    f'udacity_dataset_lake/{approach}_lake_sunny_day/lake_sunny_day',
+                    'udacity_dataset_lake_8_8_1/lake_sunny_day',
+                    'udacity_dataset_lake_12_8_1/lake_sunny_day',
+                    'udacity_dataset_lake_12_12_1/lake_sunny_day',
+                ],
+                'checkpoint_name': f"dave2_{approach}",
+                'frame_caches': True,
+                'cache_images': False,
+                'num_workers': 2,
+            },
+        )
+        for approach in ['instruct', 'inpainting', 'refining']
+    ]
+    print(TrainingJobRunner(jobs, work_dir=LOG_DIR.joinpath('training_jobs')).run().to_string())
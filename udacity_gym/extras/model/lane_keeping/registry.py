@@ -0,0 +1,102 @@
+import pathlib
+import threading
+import time
+from typing import Optional, Type, Union
+
+import lightning as pl
+import torch
+
+from udacity_gym.extras.model.lane_keeping.chauffeur.chauffeur_model import Chauffeur
+from udacity_gym.extras.model.lane_keeping.dave.dave_model import Dave2
+from udacity_gym.extras.model.lane_keeping.epoch.epoch_model import Epoch
+from udacity_gym.extras.model.lane_keeping.student.student_model import StudentDriver
+from udacity_gym.extras.model.lane_keeping.vit.vit_model import ViT, RectangularViT
+from udacity_gym.logger import CustomLogger
+
+MODEL_REGISTRY: dict[str, Type[pl.LightningModule]] = {}
+
+# Loaded models are shared by every agent of the process, keyed by (model name, checkpoint path, mtime, device)
+_model_cache: dict[tuple, pl.LightningModule] = {}
+_model_cache_lock = threading.Lock()
+
+logger = CustomLogger(__name__)
+
+
+def register_model(name: str, model_class: Type[pl.LightningModule]) -> Type[pl.LightningModule]:
+    MODEL_REGISTRY[name] = model_class
+    return model_class
+
+
+def get_model_class(name: str) -> Type[pl.LightningModule]:
+    if name not in MODEL_REGISTRY:
+        raise ValueError(f"Unknown model '{name}'. Available models: {sorted(MODEL_REGISTRY.keys())}")
+    return MODEL_REGISTRY[name]
+
+
+def _default_map_location() -> torch.device:
+    return torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+
+def _load_checkpoint(model_class: Type[pl.LightningModule], checkpoint_path: pathlib.Path,
+                     map_location: torch.device, use_mmap: bool) -> tuple[pl.LightningModule, bool]:
+    if use_mmap:
+        try:
+            # Weights stay in the page cache, forked workers map the same physical pages
+            checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True, weights_only=False)
+        except (RuntimeError, TypeError) as e:
+            # Legacy (non zip) checkpoints and old torch versions cannot be memory-mapped
+            logger.warning(f"Cannot memory-map checkpoint {checkpoint_path}, falling back to a full load: {e}")
+        else:
+            model = model_class(**checkpoint.get('hyper_parameters', {}))
+            model.load_state_dict(checkpoint['state_dict'], assign=True)
+            return model.to(map_location), True
+    return model_class.load_from_checkpoint(checkpoint_path, map_location=map_location), False
+
+
+def load_model(model_name: str, checkpoint_path: Union[str, pathlib.Path],
+               map_location: Optional[Union[str, torch.device]] = None,
+               use_mmap: bool = True) -> pl.LightningModule:
+    """
+    Return the model stored in checkpoint_path, in eval mode and with frozen weights.
+    The model is loaded once per process and shared by all callers, a new load
+    happens only when the checkpoint file is modified.
+    """
+    model_class = get_model_class(model_name)
+    checkpoint_path = pathlib.Path(checkpoint_path).resolve()
+    map_location = torch.device(map_location) if map_location is not None else _default_map_location()
+    key = (model_name, str(checkpoint_path), checkpoint_path.stat().st_mtime_ns, str(map_location))
+
+    with _model_cache_lock:
+        if key in _model_cache:
+            logger.debug(f"Model {model_name} from {checkpoint_path} found in cache")
+            return _model_cache[key]
+
+        # Drop models loaded from an older version of the same checkpoint
+        for stale_key in [k for k in _model_cache.keys() if k[:2] == key[:2]]:
+            del _model_cache[stale_key]
+
+        start_time = time.perf_counter()
+        model, mmapped = _load_checkpoint(model_class, checkpoint_path, map_location, use_mmap)
+        model.eval()
+        model.requires_grad_(False)
+        if not mmapped and map_location.type == 'cpu':
+            # Move weights to shared memory so torch.multiprocessing workers do not copy them
+            model.share_memory()
+        load_time = time.perf_counter() - start_time
+        logger.info(f"Loaded {model_name} from {checkpoint_path} in {load_time:.3f}s (mmap={mmapped})")
+
+        _model_cache[key] = model
+        return model
+
+
+def clear_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
+
+
+register_model("dave2", Dave2)
+register_model("epoch", Epoch)
+register_model("chauffeur", Chauffeur)
+register_model("vit", ViT)
+register_model("vit_rect", RectangularViT)
+register_model("student", StudentDriver)
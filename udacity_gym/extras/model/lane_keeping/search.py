@@ -0,0 +1,194 @@
+import copy
+import itertools
+import json
+import math
+import pathlib
+import random
+import sqlite3
+import time
+
+import pandas as pd
+
+from udacity_gym.extras.model.lane_keeping.job_runner import TrainingJob, TrainingJobRunner
+from udacity_gym.extras.model.lane_keeping.train import load_config
+from udacity_gym.logger import CustomLogger
+
+TRIALS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    search TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    rung INTEGER NOT NULL,
+    max_epochs INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    val_loss REAL,
+    epochs INTEGER,
+    samples_per_sec REAL,
+    duration REAL,
+    checkpoint TEXT,
+    finished REAL,
+    PRIMARY KEY (search, trial, rung)
+)
+"""
+
+
+def apply_params(config: dict, params: dict) -> dict:
+    """
+    Return a copy of config with params set, nested keys are dotted, e.g. 'model_args.learning_rate'.
+    """
+    config = copy.deepcopy(config)
+    for key, value in params.items():
+        node = config
+        *parents, name = key.split('.')
+        for parent in parents:
+            if node.get(parent) is None:
+                node[parent] = {}
+            node = node[parent]
+        node[name] = value
+    return config
+
+
+def sample_params(space: dict, num_trials: int, seed: int = 42) -> list[dict]:
+    """
+    num_trials distinct combinations of the values in space, every combination when there are fewer.
+    """
+    combinations = [dict(zip(space.keys(), values)) for values in itertools.product(*space.values())]
+    if len(combinations) <= num_trials:
+        return combinations
+    return random.Random(seed).sample(combinations, num_trials)
+
+
+class HyperparameterSearch:
+    """
+    Successive halving over train.py configurations. All the trials train min_epochs epochs, concurrently,
+    then the best 1 / reduction_factor of them resume from their last checkpoint up to reduction_factor
+    times as many epochs, and so on until a single trial is left. Trials read the shared frame caches,
+    frames are decoded once for the whole search. Every rung of every trial is stored in the trials
+    table of database_path, a search interrupted between two rungs is resumed where it stopped.
+    """
+
+    def __init__(self, name: str, space: dict, work_dir, database_path, config_path=None, overrides: dict = None,
+                 num_trials: int = 9, min_epochs: int = 2, reduction_factor: int = 3, max_concurrent: int = None,
+                 seed: int = 42):
+        self.name = name
+        self.space = space
+        self.work_dir = pathlib.Path(work_dir)
+        self.database_path = pathlib.Path(database_path)
+        self.config_path = config_path
+        self.overrides = {'frame_caches': True, 'cache_images': False, **(overrides or {})}
+        self.num_trials = num_trials
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.max_concurrent = max_concurrent
+        self.seed = seed
+        self.logger = CustomLogger(str(self.__class__))
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(TRIALS_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.database_path)
+
+    def trial_dir(self, trial: int) -> pathlib.Path:
+        return self.work_dir.joinpath('trials', f"trial_{trial:03d}")
+
+    def budget(self, rung: int) -> int:
+        return self.min_epochs * self.reduction_factor ** rung
+
+    def _job(self, trial: int, params: dict, rung: int) -> TrainingJob:
+        last_checkpoint = self.trial_dir(trial).joinpath('last.ckpt')
+        config = apply_params(load_config(self.config_path, {
+            **self.overrides,
+            'max_epochs': self.budget(rung),
+            'checkpoint_dir': str(self.trial_dir(trial)),
+            'checkpoint_name': 'best',
+            'save_last': True,
+            'resume_checkpoint': str(last_checkpoint) if rung > 0 and last_checkpoint.exists() else None,
+        }), params)
+        return TrainingJob(name=f"trial_{trial:03d}", overrides=config)
+
+    def _store(self, trial: int, rung: int, params: dict, result: dict):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.name, trial, rung, self.budget(rung), json.dumps(params, sort_keys=True), result['status'],
+                 None if pd.isna(result['val_loss']) else float(result['val_loss']), int(result['epochs']),
+                 float(result['samples_per_sec']), float(result['duration']),
+                 result['checkpoint'] if isinstance(result['checkpoint'], str) else None, time.time()),
+            )
+
+    def _stored(self, rung: int) -> dict:
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT trial, status, val_loss FROM trials WHERE search = ? AND rung = ?", (self.name, rung),
+            ).fetchall()
+        return {trial: (status, val_loss) for trial, status, val_loss in rows}
+
+    def run_rung(self, rung: int, trials: dict) -> dict:
+        """
+        Train trials, a dict of trial number to params, up to the budget of rung and return their
+        validation losses. Trials already stored for this rung are not trained again.
+        """
+        stored = self._stored(rung)
+        pending = {trial: params for trial, params in trials.items() if stored.get(trial, ('',))[0] != 'done'}
+        if len(pending) > 0:
+            self.logger.info(f"Rung {rung}: training {len(pending)} trials for {self.budget(rung)} epochs")
+            jobs = [self._job(trial, params, rung) for trial, params in pending.items()]
+            runner = TrainingJobRunner(jobs, work_dir=self.work_dir.joinpath(f"rung_{rung}"),
+                                       max_concurrent=self.max_concurrent)
+            for trial, (_, result) in zip(pending.keys(), runner.run().iterrows()):
+                self._store(trial, rung, pending[trial], result)
+            stored = self._stored(rung)
+        return {trial: stored[trial][1] if stored[trial][0] == 'done' else None for trial in trials}
+
+    def run(self) -> pd.DataFrame:
+        trials = dict(enumerate(sample_params(self.space, self.num_trials, self.seed)))
+        rung = 0
+        while True:
+            losses = self.run_rung(rung, trials)
+            if len(trials) == 1:
+                break
+            # Failed trials are pruned first
+            ranking = sorted(trials, key=lambda trial: math.inf if losses[trial] is None else losses[trial])
+            survivors = ranking[:math.ceil(len(trials) / self.reduction_factor)]
+            self.logger.info(f"Rung {rung}: keeping trials {survivors} out of {len(trials)}")
+            trials = {trial: trials[trial] for trial in survivors}
+            rung += 1
+        best = self.results().iloc[0]
+        self.logger.info(f"Best trial {best['trial']}: val_loss {best['val_loss']}, params {best['params']}")
+        return self.results()
+
+    def results(self) -> pd.DataFrame:
+        """
+        The last rung reached by every trial of the search, best trials first. Other queries can be run on
+        the trials table, e.g. json_extract(params, '$."model_args.learning_rate"').
+        """
+        with self._connect() as connection:
+            return pd.read_sql_query(
+                "SELECT * FROM trials AS t WHERE search = ? AND rung = "
+                "(SELECT MAX(rung) FROM trials WHERE search = t.search AND trial = t.trial) "
+                "ORDER BY rung DESC, val_loss IS NULL, val_loss",
+                connection, params=(self.name,),
+            )
+
+
+if __name__ == '__main__':
+
+    from utils.conf import LOG_DIR
+
+    search = HyperparameterSearch(
+        name='dave2_instruct',
+        space={
+            'model_args.learning_rate': [1e-4, 2e-4, 5e-4, 1e-3],
+            'batch_size': [64, 128, 256],
+            'augmentation.augmix_probability': [0.0, 0.5, 1.0],
+        },
+        work_dir=LOG_DIR.joinpath('search', 'dave2_instruct'),
+        database_path=LOG_DIR.joinpath('search', 'search.sqlite'),
+        config_path=pathlib.Path(__file__).parent.joinpath('configs', 'dave2_instruct.json'),
+        overrides={'num_workers': 2},
+        num_trials=9,
+        min_epochs=5,
+        reduction_factor=3,
+    )
+    print(search.run().to_string())
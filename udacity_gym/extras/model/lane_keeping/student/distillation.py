@@ -0,0 +1,253 @@
+import itertools
+import json
+import math
+import pathlib
+import time
+
+import lightning as pl
+import numpy as np
+import torch
+from lightning.pytorch.callbacks import EarlyStopping
+
+from udacity_gym.extras.data.augmentation import BatchAugmentation, DrivingDataModule
+from udacity_gym.extras.model.lane_keeping.registry import get_model_class
+from udacity_gym.extras.model.lane_keeping.student.student_model import StudentDriver
+from udacity_gym.logger import CustomLogger
+
+INPUT_SHAPE = (3, 160, 320)
+
+
+def measure_latency(model: torch.nn.Module, input_shape: tuple = INPUT_SHAPE, runs: int = 50, warmup: int = 5,
+                    num_threads: int = 1) -> float:
+    """
+    Median seconds to predict the steering of one frame on CPU, as an agent does, with num_threads threads.
+    """
+    model = model.to('cpu').eval()
+    image = torch.rand(input_shape)
+    previous_threads = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        timings = []
+        with torch.no_grad():
+            for i in range(warmup + runs):
+                start_time = time.perf_counter()
+                model(image)
+                if i >= warmup:
+                    timings.append(time.perf_counter() - start_time)
+    finally:
+        torch.set_num_threads(previous_threads)
+    return float(np.median(timings))
+
+
+def select_architecture(latency_budget: float, widths: tuple = (8, 12, 16, 24, 32), depths: tuple = (3, 4, 5),
+                        num_threads: int = 1) -> dict:
+    """
+    Return the StudentDriver width and depth with the most parameters whose single-frame latency fits
+    latency_budget seconds, with its measured latency.
+    """
+    logger = CustomLogger('select_architecture')
+    candidates = []
+    for width, depth in itertools.product(widths, depths):
+        student = StudentDriver(input_shape=INPUT_SHAPE, width=width, depth=depth)
+        latency = measure_latency(student, num_threads=num_threads)
+        parameters = sum(parameter.numel() for parameter in student.parameters())
+        logger.info(f"width={width} depth={depth}: {parameters} parameters, {latency * 1000:.2f}ms")
+        if latency <= latency_budget:
+            candidates.append({'width': width, 'depth': depth, 'parameters': parameters, 'latency': latency})
+    if len(candidates) == 0:
+        raise ValueError(f"No student architecture fits a latency budget of {latency_budget * 1000:.2f}ms")
+    return max(candidates, key=lambda candidate: candidate['parameters'])
+
+
+def save_student(student: StudentDriver, checkpoint_path):
+    """
+    Save the student alone as a Lightning checkpoint, loadable with load_model('student', checkpoint_path).
+    """
+    checkpoint_path = pathlib.Path(checkpoint_path)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({
+        'state_dict': student.state_dict(),
+        'hyper_parameters': dict(student.hparams),
+        'pytorch-lightning_version': pl.__version__,
+    }, checkpoint_path)
+
+
+class DistillationModule(pl.LightningModule):
+    """
+    Train a student on the steering predicted by a frozen teacher for the same, possibly augmented, batch,
+    mixed with the recorded labels: alpha * mse(student, teacher) + (1 - alpha) * mse(student, label).
+    """
+
+    def __init__(self, student: StudentDriver, teacher: pl.LightningModule, alpha: float = 0.9):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher.requires_grad_(False)
+        self.alpha = alpha
+
+    def train(self, mode: bool = True):
+        # The teacher always predicts in eval mode, without dropout
+        super().train(mode)
+        self.teacher.eval()
+        return self
+
+    def forward(self, x: torch.Tensor):
+        return self.student(x)
+
+    def _losses(self, batch) -> dict:
+        img, true = batch
+        with torch.no_grad():
+            target = self.teacher(img)
+        pred = self.student(img)
+        teacher_loss = self.student.loss(pred, target)
+        label_loss = self.student.loss(pred, true)
+        return {
+            'loss': self.alpha * teacher_loss + (1 - self.alpha) * label_loss,
+            'teacher_mse': teacher_loss,
+            'label_mse': label_loss,
+        }
+
+    def training_step(self, batch, batch_idx: int = 0):
+        losses = self._losses(batch)
+        self.log_dict({f"train/{key}": value for key, value in losses.items()}, prog_bar=True, on_step=True)
+        return losses['loss']
+
+    def validation_step(self, batch, batch_idx: int, dataloader_idx: int = 0):
+        losses = self._losses(batch)
+        self.log_dict({f"val/{key}": value for key, value in losses.items()}, prog_bar=True, on_epoch=True,
+                      sync_dist=True)
+        return losses['loss']
+
+    def configure_optimizers(self):
+        return self.student.configure_optimizers()
+
+
+class StudentCheckpoint(pl.Callback):
+    """
+    Save the student, without the teacher, every time the monitored validation metric improves.
+    """
+
+    def __init__(self, checkpoint_path, monitor: str = "val/loss"):
+        super().__init__()
+        self.checkpoint_path = pathlib.Path(checkpoint_path)
+        self.monitor = monitor
+        self.best_score = math.inf
+
+    def on_validation_end(self, trainer: pl.Trainer, pl_module: DistillationModule):
+        score = trainer.callback_metrics.get(self.monitor)
+        if trainer.sanity_checking or score is None or score.item() >= self.best_score:
+            return
+        self.best_score = score.item()
+        if trainer.is_global_zero:
+            save_student(pl_module.student, self.checkpoint_path)
+
+
+def distillation_report(student: torch.nn.Module, teacher: torch.nn.Module, data_module: DrivingDataModule,
+                        num_threads: int = 1) -> dict:
+    """
+    Error of the student against the teacher and the labels on the validation frames, and single-frame
+    CPU latency of both.
+    """
+    student, teacher = student.to('cpu').eval(), teacher.to('cpu').eval()
+    data_module.setup("validate")
+    student_predictions, teacher_predictions, labels = [], [], []
+    with torch.no_grad():
+        for images, true in data_module.val_dataloader():
+            images = images.float().div_(255)
+            student_predictions.append(student(images))
+            teacher_predictions.append(teacher(images))
+            labels.append(true)
+    data_module.teardown("validate")
+    student_predictions, teacher_predictions = torch.cat(student_predictions), torch.cat(teacher_predictions)
+    labels = torch.cat(labels)
+
+    def rmse(x, y):
+        return torch.sqrt(torch.mean((x - y) ** 2)).item()
+
+    student_latency = measure_latency(student, num_threads=num_threads)
+    teacher_latency = measure_latency(teacher, num_threads=num_threads)
+    return {
+        'frames': len(labels),
+        'student_teacher_rmse': rmse(student_predictions, teacher_predictions),
+        'student_label_rmse': rmse(student_predictions, labels),
+        'teacher_label_rmse': rmse(teacher_predictions, labels),
+        'student_latency_ms': student_latency * 1000,
+        'teacher_latency_ms': teacher_latency * 1000,
+        'speedup': teacher_latency / student_latency,
+        'student_parameters': sum(parameter.numel() for parameter in student.parameters()),
+        'teacher_parameters': sum(parameter.numel() for parameter in teacher.parameters()),
+    }
+
+
+def distill(teacher_name: str, teacher_checkpoint, dataset_dirs: list, checkpoint_path, latency_budget: float = 0.002,
+            alpha: float = 0.9, max_epochs: int = 200, patience: int = 10, batch_size: int = 256, num_workers: int = 8,
+            augmentation: BatchAugmentation = None, accelerator: str = "auto", devices="auto",
+            num_threads: int = 1) -> dict:
+    """
+    Distill the teacher in a StudentDriver fitting latency_budget seconds per frame with num_threads threads.
+    The best student is saved in checkpoint_path, the report is returned and saved next to it.
+    """
+    logger = CustomLogger('distill')
+    architecture = select_architecture(latency_budget, num_threads=num_threads)
+    logger.info(f"Student width={architecture['width']} depth={architecture['depth']}, "
+                f"{architecture['latency'] * 1000:.2f}ms per frame")
+    # A private copy: load_model shares its models with every agent of the process, the Trainer moves the
+    # teacher to the accelerator
+    teacher = get_model_class(teacher_name).load_from_checkpoint(teacher_checkpoint, map_location='cpu').eval()
+    student = StudentDriver(input_shape=INPUT_SHAPE, width=architecture['width'], depth=architecture['depth'])
+    data_module = DrivingDataModule(
+        dataset_dirs=dataset_dirs,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        augmentation=augmentation,
+    )
+    checkpoint_path = pathlib.Path(checkpoint_path)
+    trainer = pl.Trainer(
+        accelerator=accelerator,
+        devices=devices,
+        max_epochs=max_epochs,
+        callbacks=[
+            StudentCheckpoint(checkpoint_path),
+            EarlyStopping(monitor="val/loss", mode="min", patience=patience),
+        ],
+        # StudentCheckpoint saves the student alone, full checkpoints would also hold the teacher
+        enable_checkpointing=False,
+        default_root_dir=pathlib.Path(checkpoint_path).parent,
+        use_distributed_sampler=False,
+    )
+    trainer.fit(DistillationModule(student, teacher, alpha=alpha), datamodule=data_module)
+
+    best_student = StudentDriver.load_from_checkpoint(checkpoint_path, map_location='cpu')
+    report = {
+        'teacher': teacher_name,
+        'teacher_checkpoint': str(teacher_checkpoint),
+        'latency_budget_ms': latency_budget * 1000,
+        'width': architecture['width'],
+        'depth': architecture['depth'],
+        **distillation_report(best_student, teacher, data_module, num_threads=num_threads),
+    }
+    checkpoint_path.with_suffix('.json').write_text(json.dumps(report, indent=2))
+    logger.info(f"Student {report['speedup']:.1f}x faster than {teacher_name}, "
+                f"RMSE to teacher {report['student_teacher_rmse']:.4f}")
+    return report
+
+
+if __name__ == '__main__':
+
+    from utils.conf import ACCELERATOR, DEVICE, CHECKPOINT_DIR, PROJECT_DIR
+
+    dataset_paths = [
+        'udacity_dataset_lake',
+        'udacity_dataset_lake_8_8_1',
+        'udacity_dataset_lake_12_8_1',
+        'udacity_dataset_lake_12_12_1',
+    ]
+    for teacher_name in ['vit', 'chauffeur']:
+        distill(
+            teacher_name=teacher_name,
+            teacher_checkpoint=CHECKPOINT_DIR.joinpath("lane_keeping", teacher_name, f"{teacher_name}.ckpt"),
+            dataset_dirs=[PROJECT_DIR.joinpath(dataset, "lake_sunny_day") for dataset in dataset_paths],
+            checkpoint_path=CHECKPOINT_DIR.joinpath("lane_keeping", "student", f"student_{teacher_name}.ckpt"),
+            latency_budget=0.002,
+            accelerator=ACCELERATOR,
+            devices=[DEVICE],
+        )
@@ -0,0 +1,80 @@
+import math
+from typing import Tuple
+import lightning as pl
+import torch
+from torch import Tensor
+
+
+class StudentDriver(pl.LightningModule):
+    """
+    Small steering CNN distilled from a larger driving model. Each of the depth blocks halves the
+    resolution, the first one has width channels and every block adds width channels. The last feature
+    map is pooled to 2 x 4, keeping where the road is in the frame.
+    """
+
+    def __init__(self,
+                 input_shape: Tuple[int, int, int] = (3, 160, 320),
+                 width: int = 16,
+                 depth: int = 4,
+                 learning_rate: float = 1e-3,
+                 ):
+        super().__init__()
+        self.save_hyperparameters()
+        self.learning_rate = learning_rate
+        self.input_shape = input_shape
+        self.example_input_array = torch.zeros(size=self.input_shape)
+        layers = []
+        in_channels = input_shape[0]
+        for i in range(depth):
+            kernel_size = 5 if i == 0 else 3
+            layers += [
+                torch.nn.Conv2d(in_channels=in_channels, out_channels=width * (i + 1), kernel_size=kernel_size,
+                                stride=(2, 2), padding=kernel_size // 2),
+                torch.nn.ReLU(),
+            ]
+            in_channels = width * (i + 1)
+        self.model = torch.nn.Sequential(
+            *layers,
+            torch.nn.AdaptiveAvgPool2d(output_size=(2, 4)),
+            torch.nn.Flatten(start_dim=-3, end_dim=-1),
+            torch.nn.Linear(in_features=in_channels * 8, out_features=50),
+            torch.nn.ReLU(),
+            torch.nn.Dropout(p=0.05),
+            torch.nn.Linear(in_features=50, out_features=1)
+        )
+        self.loss = torch.nn.MSELoss()
+
+    def forward(self, x: Tensor):
+        return self.model(x)
+
+    def training_step(self, batch: Tuple[Tensor, Tensor], batch_idx: int = 0):
+        img, true = batch
+        pred = self.forward(x=img)
+        loss = self.loss(pred, true)
+        self.log("train/loss", loss, prog_bar=True, on_step=True)
+        self.log("train/rmse", math.sqrt(loss), prog_bar=True, on_step=True)
+        return loss
+
+    def validation_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
+        img, true = batch
+        pred = self(img)
+        loss = self.loss(pred, true)
+        self.log("val/loss", loss, prog_bar=True, on_epoch=True, sync_dist=True)
+        self.log("val/rmse", math.sqrt(loss), prog_bar=True, on_epoch=True, sync_dist=True)
+        return loss
+
+    def test_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
+        img, true = batch
+        pred = self(img)
+        loss = self.loss(pred, true)
+        self.log("test/loss", loss, prog_bar=True, sync_dist=True)
+        self.log("test/rmse", math.sqrt(loss), prog_bar=True, sync_dist=True)
+        return loss
+
+    def predict_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
+        img, _ = batch
+        pred = self(img)
+        return pred
+
+    def configure_optimizers(self):
+        return [torch.optim.Adam(self.parameters(), lr=self.learning_rate)]
@@ -0,0 +1,65 @@
+import json
+import pathlib
+import time
+
+import lightning as pl
+import torch
+
+from udacity_gym.logger import CustomLogger
+
+
+class ThroughputMonitor(pl.Callback):
+    """
+    Per-epoch training throughput. Data wait is the time between two steps, spent fetching the batch,
+    moving it to the device and augmenting it; compute is the time of the steps themselves. On CUDA the
+    device is synchronized at the end of each step, otherwise compute would be counted as data wait.
+    With path, the metrics of every epoch are also appended to it as a JSON line. Under distributed
+    training samples are summed over the ranks, data wait and compute are averaged.
+    """
+
+    def __init__(self, synchronize: bool = True, path=None):
+        super().__init__()
+        self.synchronize = synchronize
+        self.path = pathlib.Path(path) if path is not None else None
+        self.history = []
+        self.logger = CustomLogger(str(self.__class__))
+        self._reset()
+
+    def _reset(self):
+        self.samples = 0
+        self.data_wait = 0.0
+        self.compute = 0.0
+        self.epoch_start = self.step_end = self.step_start = time.perf_counter()
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self._reset()
+
+    def on_train_batch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule, batch, batch_idx: int):
+        self.step_start = time.perf_counter()
+        self.data_wait += self.step_start - self.step_end
+
+    def on_train_batch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule, outputs, batch,
+                           batch_idx: int):
+        if self.synchronize and pl_module.device.type == 'cuda':
+            torch.cuda.synchronize(pl_module.device)
+        self.step_end = time.perf_counter()
+        self.compute += self.step_end - self.step_start
+        self.samples += len(batch[0])
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        elapsed = time.perf_counter() - self.epoch_start
+        samples = int(trainer.strategy.reduce(torch.tensor(float(self.samples)), reduce_op='sum').item())
+        metrics = {
+            'samples_per_sec': samples / elapsed if elapsed > 0 else 0.0,
+            'data_wait_sec': self.data_wait,
+            'compute_sec': self.compute,
+            'data_wait_fraction': self.data_wait / elapsed if elapsed > 0 else 0.0,
+        }
+        pl_module.log_dict({f"throughput/{key}": value for key, value in metrics.items()}, sync_dist=True)
+        self.history.append({'epoch': trainer.current_epoch, 'samples': samples, **metrics})
+        if self.path is not None and trainer.is_global_zero:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'time': time.time(), **self.history[-1]}) + '\n')
+        self.logger.info(f"Epoch {trainer.current_epoch}: {metrics['samples_per_sec']:.1f} samples/s, "
+                         f"data wait {self.data_wait:.1f}s, compute {self.compute:.1f}s")
@@ -0,0 +1,182 @@
+import argparse
+import json
+import pathlib
+import sys
+
+import lightning as pl
+import torch
+from lightning.pytorch.callbacks import ModelCheckpoint, EarlyStopping
+
+from udacity_gym.extras.data.augmentation import BatchAugmentation, DrivingDataModule
+from udacity_gym.extras.model.distributed import RankSeed, ddp_strategy
+from udacity_gym.extras.model.lane_keeping.registry import get_model_class
+from udacity_gym.extras.model.lane_keeping.throughput import ThroughputMonitor
+from udacity_gym.logger import CustomLogger
+from utils.conf import ACCELERATOR, DEVICE, CHECKPOINT_DIR, PROJECT_DIR
+
+# Every key a configuration file can set, relative dataset directories are resolved from PROJECT_DIR
+DEFAULT_CONFIG = {
+    'model': 'dave2',
+    'model_args': {},
+    'dataset_dirs': [
+        'udacity_dataset_lake/lake_sunny_day',
+        'udacity_dataset_lake_8_8_1/lake_sunny_day',
+        'udacity_dataset_lake_12_8_1/lake_sunny_day',
+        'udacity_dataset_lake_12_12_1/lake_sunny_day',
+    ],
+    'batch_size': 256,
+    'val_batch_size': 64,
+    'num_workers': 8,
+    'pin_memory': True,
+    'persistent_workers': True,
+    'cache_images': False,
+    'cache_size': 1 << 30,
+    # Read frames from the read-only caches of build_frame_cache
+    'frame_caches': False,
+    # BatchAugmentation arguments, null to only flip frames as the plain training scripts do
+    'augmentation': None,
+    'channels_last': False,
+    # Lightning precision, 'bf16-mixed' runs the steps under bf16 autocast, on CPU as well
+    'precision': '32-true',
+    'compile': False,
+    'matmul_precision': 'high',
+    'num_threads': None,
+    'max_epochs': 2000,
+    'patience': 20,
+    'accelerator': ACCELERATOR,
+    'devices': [DEVICE],
+    # 'ddp' trains one process per device on every node, with the gloo backend on CPU
+    'strategy': 'auto',
+    'num_nodes': 1,
+    'process_group_backend': None,
+    'seed': 42,
+    'checkpoint_dir': None,
+    'checkpoint_name': None,
+    # Also keep last.ckpt in checkpoint_dir, and resume a training from a checkpoint
+    'save_last': False,
+    'resume_checkpoint': None,
+    # JSON lines file receiving the throughput of every epoch
+    'throughput_log': None,
+}
+
+
+def load_config(path=None, overrides: dict = None) -> dict:
+    """
+    Return DEFAULT_CONFIG updated with the JSON or YAML file in path, then with overrides.
+    """
+    config = {}
+    if path is not None:
+        path = pathlib.Path(path)
+        if path.suffix in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML training configurations")
+            config = yaml.safe_load(path.read_text()) or {}
+        else:
+            config = json.loads(path.read_text())
+    config.update(overrides or {})
+    unknown = sorted(set(config) - set(DEFAULT_CONFIG))
+    if unknown:
+        raise ValueError(f"Unknown configuration keys {unknown}. Available keys: {sorted(DEFAULT_CONFIG)}")
+    return {**DEFAULT_CONFIG, **config}
+
+
+def build_data_module(config: dict) -> DrivingDataModule:
+    augmentation = BatchAugmentation(**config['augmentation']) if config['augmentation'] is not None else None
+    return DrivingDataModule(
+        dataset_dirs=[PROJECT_DIR.joinpath(dataset_dir) for dataset_dir in config['dataset_dirs']],
+        batch_size=config['batch_size'],
+        val_batch_size=config['val_batch_size'],
+        num_workers=config['num_workers'],
+        augmentation=augmentation,
+        cache_images=config['cache_images'],
+        cache_size=config['cache_size'],
+        pin_memory=config['pin_memory'],
+        persistent_workers=config['persistent_workers'],
+        memory_format=torch.channels_last if config['channels_last'] else torch.contiguous_format,
+        frame_caches=config['frame_caches'],
+    )
+
+
+def build_model(config: dict) -> pl.LightningModule:
+    model = get_model_class(config['model'])(**config['model_args'])
+    if config['channels_last']:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def train(config: dict, callbacks: list = None) -> dict:
+    """
+    Train the model described by config and return the best checkpoint, its validation loss and the
+    throughput of every epoch. Under distributed training every rank returns, only rank 0 has the checkpoint.
+    """
+    logger = CustomLogger('train')
+    pl.seed_everything(config['seed'])
+    torch.set_float32_matmul_precision(config['matmul_precision'])
+    if config['num_threads'] is not None:
+        torch.set_num_threads(config['num_threads'])
+
+    checkpoint_dir = config['checkpoint_dir'] or CHECKPOINT_DIR.joinpath("lane_keeping", config['model'])
+    checkpoint_callback = ModelCheckpoint(
+        dirpath=checkpoint_dir,
+        filename=config['checkpoint_name'] or config['model'],
+        monitor="val/loss",
+        save_top_k=1,
+        save_last=config['save_last'],
+        mode="min",
+        verbose=True,
+    )
+    earlystopping_callback = EarlyStopping(monitor="val/loss", mode="min", patience=config['patience'])
+    throughput_monitor = ThroughputMonitor(path=config['throughput_log'])
+    trainer = pl.Trainer(
+        accelerator=config['accelerator'],
+        devices=config['devices'],
+        num_nodes=config['num_nodes'],
+        strategy=ddp_strategy(config['process_group_backend']) if config['strategy'] == 'ddp' else config['strategy'],
+        # DrivingDataModule shards the datasets itself
+        use_distributed_sampler=False,
+        max_epochs=config['max_epochs'],
+        precision=config['precision'],
+        callbacks=[checkpoint_callback, earlystopping_callback, throughput_monitor, RankSeed(config['seed'])]
+        + (callbacks or []),
+    )
+
+    model = build_model(config)
+    if config['compile']:
+        model = torch.compile(model)
+    logger.info(f"Training {config['model']} on {len(config['dataset_dirs'])} datasets")
+    trainer.fit(model, datamodule=build_data_module(config), ckpt_path=config['resume_checkpoint'])
+    best_score = checkpoint_callback.best_model_score
+    return {
+        'checkpoint': checkpoint_callback.best_model_path,
+        'val_loss': best_score.item() if best_score is not None else None,
+        'throughput': throughput_monitor.history,
+        'global_rank': trainer.global_rank,
+        'world_size': trainer.world_size,
+    }
+
+
+def _parse_override(override: str) -> tuple:
+    key, _, value = override.partition('=')
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Train a lane-keeping model (dave2, epoch, chauffeur, vit)")
+    parser.add_argument('config', nargs='?', help="JSON or YAML configuration file")
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='KEY=VALUE',
+                        help="override a configuration key, values are parsed as JSON")
+    parser.add_argument('--result', help="write the result to this JSON file")
+    args = parser.parse_args()
+
+    result = train(load_config(args.config, dict(_parse_override(override) for override in args.overrides)))
+    if result['global_rank'] != 0:
+        sys.exit()
+    print(json.dumps(result, indent=2))
+    if args.result is not None:
+        pathlib.Path(args.result).write_text(json.dumps(result))
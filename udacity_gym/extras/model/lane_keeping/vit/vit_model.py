@@ -1,25 +1,102 @@
 import math
+import pathlib
 import torchvision.utils
-from typing import Tuple
+from typing import Tuple, Union
 import lightning as pl
 import torch
 from torch import Tensor
 from torchvision.models import VisionTransformer
 
+VIT_CONFIG = {
+    'num_classes': 1,
+    'num_layers': 2,
+    'num_heads': 2,
+    'hidden_dim': 512,
+    'mlp_dim': 128,
+}
+
+
+class RectangularVisionTransformer(VisionTransformer):
+    """
+    VisionTransformer working on (height, width) inputs with (height, width) patches,
+    the patch grid and the positional embeddings follow the input aspect ratio.
+    """
+
+    def __init__(self, image_size: Tuple[int, int], patch_size: Tuple[int, int], **kwargs):
+        height, width = image_size
+        patch_height, patch_width = patch_size
+        torch._assert(height % patch_height == 0 and width % patch_width == 0, "Input shape indivisible by patch size!")
+        super().__init__(image_size=height, patch_size=patch_height, **kwargs)
+        self.image_size = image_size
+        self.patch_size = patch_size
+        self.grid_size = (height // patch_height, width // patch_width)
+        self.seq_length = self.grid_size[0] * self.grid_size[1] + 1
+        self.conv_proj = torch.nn.Conv2d(in_channels=3, out_channels=self.hidden_dim, kernel_size=patch_size,
+                                         stride=patch_size)
+        fan_in = self.conv_proj.in_channels * patch_height * patch_width
+        torch.nn.init.trunc_normal_(self.conv_proj.weight, std=math.sqrt(1 / fan_in))
+        torch.nn.init.zeros_(self.conv_proj.bias)
+        self.encoder.pos_embedding = torch.nn.Parameter(
+            torch.empty(1, self.seq_length, self.hidden_dim).normal_(std=0.02)
+        )
+
+    def _process_input(self, x: Tensor) -> Tensor:
+        n, c, h, w = x.shape
+        torch._assert(h == self.image_size[0], f"Wrong image height! Expected {self.image_size[0]} but got {h}!")
+        torch._assert(w == self.image_size[1], f"Wrong image width! Expected {self.image_size[1]} but got {w}!")
+        # (n, c, h, w) -> (n, hidden_dim, n_h, n_w) -> (n, n_h * n_w, hidden_dim)
+        x = self.conv_proj(x)
+        return x.flatten(2).transpose(1, 2)
+
+
+def interpolate_pos_embedding(pos_embedding: Tensor, grid_size: Tuple[int, int],
+                              new_grid_size: Tuple[int, int]) -> Tensor:
+    """
+    Resample the patch positional embeddings of a ViT from grid_size to new_grid_size.
+    The class token embedding is kept as is.
+    """
+    if tuple(grid_size) == tuple(new_grid_size):
+        return pos_embedding
+    class_embedding, patch_embedding = pos_embedding[:, :1], pos_embedding[:, 1:]
+    hidden_dim = patch_embedding.shape[-1]
+    patch_embedding = patch_embedding.reshape(1, grid_size[0], grid_size[1], hidden_dim).permute(0, 3, 1, 2)
+    patch_embedding = torch.nn.functional.interpolate(patch_embedding, size=new_grid_size, mode='bicubic',
+                                                      align_corners=False)
+    patch_embedding = patch_embedding.permute(0, 2, 3, 1).reshape(1, new_grid_size[0] * new_grid_size[1], hidden_dim)
+    return torch.cat([class_embedding, patch_embedding], dim=1)
+
+
+def interpolate_patch_kernel(weight: Tensor, new_patch_size: Tuple[int, int]) -> Tensor:
+    """
+    Resample the patch embedding kernel of a ViT to new_patch_size. Weights are rescaled so that
+    a patch of the new size produces the same response as the resized patch did with the old kernel.
+    """
+    if tuple(weight.shape[-2:]) == tuple(new_patch_size):
+        return weight
+    area_ratio = (weight.shape[-2] * weight.shape[-1]) / (new_patch_size[0] * new_patch_size[1])
+    return torch.nn.functional.interpolate(weight, size=new_patch_size, mode='bilinear',
+                                           align_corners=False) * area_ratio
+
 
 class ViT(pl.LightningModule):
 
     def __init__(self,
                  input_shape: Tuple[int, int, int] = (3, 160, 320),
                  learning_rate: float = 2e-4,
+                 patch_size: int = 8,
                  ):
         super().__init__()
+        self.save_hyperparameters()
         self.learning_rate = learning_rate
         self.input_shape = input_shape
+        self.patch_size = patch_size
         # self.example_input_array = torch.zeros(size=self.input_shape)
-        self.model = VisionTransformer(image_size=160, patch_size=8, num_classes=1, num_layers=2, num_heads=2, hidden_dim=512, mlp_dim=128)
+        self.model = self.build_model()
         self.loss = torch.nn.MSELoss()
 
+    def build_model(self) -> torch.nn.Module:
+        return VisionTransformer(image_size=160, patch_size=self.patch_size, **VIT_CONFIG)
+
     def forward(self, x: Tensor):
         # if len(x.shape) == 4:
         #     x = x.unsqueeze(0)
@@ -40,16 +117,16 @@ class ViT(pl.LightningModule):
         img, true = batch
         pred = self(img)
         loss = self.loss(pred, true)
-        self.log("val/loss", loss, prog_bar=True, on_epoch=True)
-        self.log("val/rmse", math.sqrt(loss), prog_bar=True, on_epoch=True)
+        self.log("val/loss", loss, prog_bar=True, on_epoch=True, sync_dist=True)
+        self.log("val/rmse", math.sqrt(loss), prog_bar=True, on_epoch=True, sync_dist=True)
         return loss
 
     def test_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
         img, true = batch
         pred = self(img)
         loss = self.loss(pred, true)
-        self.log("test/loss", loss, prog_bar=True)
-        self.log("test/rmse", math.sqrt(loss), prog_bar=True)
+        self.log("test/loss", loss, prog_bar=True, sync_dist=True)
+        self.log("test/rmse", math.sqrt(loss), prog_bar=True, sync_dist=True)
         return loss
 
     def predict_step(self, batch: Tensor, batch_idx: int, dataloader_idx: int = 0):
@@ -59,3 +136,68 @@ class ViT(pl.LightningModule):
 
     def configure_optimizers(self):
         return [torch.optim.Adam(self.parameters(), lr=self.learning_rate)]
+
+
+class RectangularViT(ViT):
+    """
+    ViT taking the 160x320 camera frames as they are, without the square resize of ViT.
+    The default (8, 16) patches keep the 20x20 grid and the sequence length of ViT, 8x8
+    patches give a 20x40 grid, twice the tokens.
+    """
+
+    def __init__(self,
+                 input_shape: Tuple[int, int, int] = (3, 160, 320),
+                 learning_rate: float = 2e-4,
+                 patch_size: Tuple[int, int] = (8, 16),
+                 ):
+        super().__init__(input_shape=input_shape, learning_rate=learning_rate, patch_size=tuple(patch_size))
+        self.save_hyperparameters()
+
+    def build_model(self) -> torch.nn.Module:
+        return RectangularVisionTransformer(image_size=self.input_shape[1:], patch_size=self.patch_size, **VIT_CONFIG)
+
+    def forward(self, x: Tensor):
+        if x.dim() == 3:
+            return self.model(x.unsqueeze(0)).squeeze(0)
+        return self.model(x)
+
+    @classmethod
+    def from_square(cls, square_model: ViT, patch_size: Tuple[int, int] = (8, 16)) -> "RectangularViT":
+        """
+        Build a RectangularViT from the weights of a square ViT. The patch kernel and the positional
+        embeddings are resampled to the new patch size and patch grid, all the other weights are copied.
+        With (8, 16) patches each patch covers the same part of the frame as after the square resize; with
+        8x8 patches it covers half of that horizontal extent, and the converted model is a starting point
+        for fine-tuning rather than a drop-in replacement.
+        """
+        model = cls(input_shape=square_model.input_shape, learning_rate=square_model.learning_rate,
+                    patch_size=patch_size)
+        model.load_state_dict(model.convert_square_state_dict(square_model.state_dict()))
+        return model
+
+    def convert_square_state_dict(self, state_dict: dict, square_size: int = 160) -> dict:
+        state_dict = dict(state_dict)
+        weight = state_dict['model.conv_proj.weight']
+        square_patch_size = weight.shape[-1]
+        state_dict['model.conv_proj.weight'] = interpolate_patch_kernel(weight, self.model.patch_size)
+        state_dict['model.encoder.pos_embedding'] = interpolate_pos_embedding(
+            state_dict['model.encoder.pos_embedding'],
+            grid_size=(square_size // square_patch_size, square_size // square_patch_size),
+            new_grid_size=self.model.grid_size,
+        )
+        return state_dict
+
+
+def convert_square_checkpoint(checkpoint_path: Union[str, pathlib.Path], output_path: Union[str, pathlib.Path],
+                              patch_size: Tuple[int, int] = (8, 16)):
+    """
+    Convert a ViT checkpoint into a RectangularViT checkpoint loadable with load_from_checkpoint.
+    Optimizer and loop states are dropped since the converted weights change shape.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+    model = RectangularViT(patch_size=patch_size)
+    checkpoint['state_dict'] = model.convert_square_state_dict(checkpoint['state_dict'])
+    checkpoint['hyper_parameters'] = dict(model.hparams)
+    for key in ['optimizer_states', 'lr_schedulers', 'loops', 'callbacks']:
+        checkpoint.pop(key, None)
+    torch.save(checkpoint, output_path)
@@ -0,0 +1,193 @@
+import concurrent.futures
+import pathlib
+from typing import Callable, Optional
+
+import pandas as pd
+import torch
+import tqdm
+from torch.utils.data import ConcatDataset, DataLoader, Dataset
+
+from udacity_gym.extras.data.packed_masks import PackedMasks, PackedMaskWriter, mask_cache_path, \
+    packed_confusion_counts
+from udacity_gym.extras.model.segmentation.unet.unet_model import SegmentationUnet
+from udacity_gym.logger import CustomLogger
+
+
+def confusion_counts(pred: torch.Tensor, true: torch.Tensor, threshold: float = 0.5) -> torch.Tensor:
+    """
+    TP, FP, TN and FN pixel counts of every sample of a batch of binary masks, as a B x 4 int64 tensor.
+    """
+    pred = (pred >= threshold).flatten(1)
+    true = (true >= 0.5).flatten(1)
+    tp = (pred & true).sum(dim=1)
+    fp = pred.sum(dim=1) - tp
+    fn = true.sum(dim=1) - tp
+    tn = pred.shape[1] - tp - fp - fn
+    return torch.stack([tp, fp, tn, fn], dim=1)
+
+
+def confusion_metrics(confusion) -> dict:
+    """
+    IoU of the road class, precision, recall and accuracy of a TP, FP, TN, FN confusion matrix.
+    """
+    tp, fp, tn, fn = (int(value) for value in confusion)
+
+    def ratio(numerator: int, denominator: int) -> float:
+        return numerator / denominator if denominator > 0 else 0.0
+
+    return {
+        'miou': ratio(tp, tp + fp + fn),
+        'prc': ratio(tp, tp + fp),
+        'rec': ratio(tp, tp + fn),
+        'acc': ratio(tp + tn, tp + fp + tn + fn),
+        'TP': tp,
+        'FP': fp,
+        'TN': tn,
+        'FN': fn,
+    }
+
+
+class _ScenarioDataset(Dataset):
+    """
+    Samples of a scenario with the scenario number and the position of the sample in the scenario.
+    """
+
+    def __init__(self, dataset: Dataset, scenario: int):
+        self.dataset = dataset
+        self.scenario = scenario
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        image, segmentation = self.dataset[idx]
+        return image, segmentation, self.scenario, idx
+
+
+class SegmentationEvaluator:
+    """
+    Evaluate a SegmentationUnet checkpoint, loaded once, on scenarios. Pixels are accumulated in one
+    confusion matrix per scenario over all its frames, metrics are derived from it at the end instead of
+    averaging per-batch values. prediction_writer, if given, receives (scenario name, sample positions,
+    predicted masks) for every batch.
+    """
+
+    def __init__(self, checkpoint_path, map_location=None, batch_size: int = 16, num_workers: int = 4,
+                 threshold: float = 0.5, prediction_writer: Optional[Callable] = None):
+        self.map_location = torch.device(map_location) if map_location is not None else torch.device(
+            'cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = SegmentationUnet.load_from_checkpoint(checkpoint_path, map_location=self.map_location)
+        self.model.eval()
+        self.model.requires_grad_(False)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.threshold = threshold
+        self.prediction_writer = prediction_writer
+        self.logger = CustomLogger(str(self.__class__))
+
+    def _loader(self, dataset: Dataset) -> DataLoader:
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            prefetch_factor=2 if self.num_workers > 0 else None,
+            pin_memory=self.map_location.type == 'cuda',
+        )
+
+    def _accumulate(self, datasets: list[Dataset], names: list[str], show_progress: bool = True) -> torch.Tensor:
+        confusion = torch.zeros(len(datasets), 4, dtype=torch.int64, device=self.map_location)
+        stream = ConcatDataset([_ScenarioDataset(dataset, scenario) for scenario, dataset in enumerate(datasets)])
+        with torch.no_grad():
+            for image, true, scenario, index in tqdm.tqdm(self._loader(stream), disable=not show_progress):
+                image = image.to(self.map_location, non_blocking=True)
+                true = true.to(self.map_location, non_blocking=True)
+                pred = self.model(image)
+                scenario = scenario.to(self.map_location)
+                confusion.index_add_(0, scenario, confusion_counts(pred, true, self.threshold))
+                if self.prediction_writer is not None:
+                    # A batch can span two scenarios
+                    for s in scenario.unique().tolist():
+                        selected = scenario == s
+                        self.prediction_writer(names[s], index[selected.cpu()], pred[selected])
+        return confusion.cpu()
+
+    def evaluate(self, dataset: Dataset, name: str = 'dataset') -> dict:
+        return confusion_metrics(self._accumulate([dataset], [name])[0])
+
+    def evaluate_scenarios(self, datasets: dict, parallel: int = 1) -> pd.DataFrame:
+        """
+        Metrics of every scenario of datasets, a dict of scenario name to dataset. Scenarios are read
+        back-to-back as a single stream, or with parallel > 1 by that many concurrent loaders sharing the
+        model.
+        """
+        names = list(datasets.keys())
+        if parallel <= 1:
+            confusion = self._accumulate([datasets[name] for name in names], names)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = [executor.submit(self._accumulate, [datasets[name]], [name], False) for name in names]
+                confusion = torch.cat([future.result() for future in futures])
+        results = pd.DataFrame([{'scenario': name, **confusion_metrics(row)} for name, row in zip(names, confusion)])
+        for _, row in results.iterrows():
+            self.logger.info(f"{row['scenario']}: mIoU {row['miou']:.4f}, acc {row['acc']:.4f}, "
+                             f"rec {row['rec']:.4f}, prc {row['prc']:.4f}")
+        return results
+
+
+class PNGPredictionWriter:
+    """
+    Write predicted masks as PNG images in <dataset_dir>/computed_segmentation, with the file names of
+    the ground truth segmentations.
+    """
+
+    def __init__(self, datasets: dict):
+        self.datasets = datasets
+        for dataset in datasets.values():
+            dataset.dataset_dir.joinpath("computed_segmentation").mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, name: str, indexes: torch.Tensor, masks: torch.Tensor):
+        import torchvision.utils
+        dataset = self.datasets[name]
+        filenames = dataset.metadata['segmentation_filename'].values
+        for index, mask in zip(indexes.tolist(), masks):
+            torchvision.utils.save_image(mask, pathlib.Path(dataset.dataset_dir, "computed_segmentation",
+                                                            filenames[index]))
+
+
+class PackedPredictionWriter:
+    """
+    Write predicted masks, thresholded, in a packed mask file per dataset, dataset_dir/cache/name.npy, at
+    the positions of the samples in log.csv. The files are complete once closed and can be compared to the
+    ground truth with evaluate_stored.
+    """
+
+    def __init__(self, datasets: dict, name: str = 'computed_segmentation', threshold: float = 0.5):
+        self.datasets = datasets
+        self.threshold = threshold
+        self.writers = {}
+        for scenario, dataset in datasets.items():
+            num_masks = len(pd.read_csv(dataset.dataset_dir.joinpath('log.csv'), usecols=['segmentation_filename']))
+            self.writers[scenario] = PackedMaskWriter(mask_cache_path(dataset.dataset_dir, name), num_masks)
+
+    def __call__(self, name: str, indexes: torch.Tensor, masks: torch.Tensor):
+        positions = self.datasets[name].metadata.index.values[indexes.numpy()]
+        self.writers[name].write(positions, (masks >= self.threshold).squeeze(1).cpu().numpy())
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def evaluate_stored(datasets: dict, name: str = 'computed_segmentation') -> pd.DataFrame:
+    """
+    Metrics of the predictions stored by PackedPredictionWriter, or converted with build_mask_cache, for
+    datasets built with packed ground truth masks, without running the model again.
+    """
+    results = []
+    for scenario, dataset in datasets.items():
+        if dataset.masks is None:
+            raise ValueError(f"Dataset {scenario} has no packed masks, build it with masks_path")
+        predictions = PackedMasks(mask_cache_path(dataset.dataset_dir, name))
+        confusion = packed_confusion_counts(predictions, dataset.masks, dataset.metadata.index.values)
+        results.append({'scenario': scenario, **confusion_metrics(confusion)})
+    return pd.DataFrame(results)
@@ -11,8 +11,10 @@ from lightning.pytorch.callbacks import ModelCheckpoint, EarlyStopping
 import itertools
 from torch.utils.data import Dataset, DataLoader
 
-from model.lane_keeping.dave.dave_model import Dave2
-from model.segmentation.unet.unet_model import SegmentationUnet
+from udacity_gym.extras.data.packed_masks import PackedMasks
+from udacity_gym.extras.data.sharding import shard_indexes
+from udacity_gym.extras.model.distributed import RankSeed, ShardedDataModule
+from udacity_gym.extras.model.segmentation.unet.unet_model import SegmentationUnet
 from utils.conf import ACCELERATOR, DEVICE, DEFAULT_DEVICE, CHECKPOINT_DIR, PROJECT_DIR
 
 def random_flip(x, y):
@@ -22,9 +24,14 @@ def random_flip(x, y):
         return x, y
 
 class SegmentationDataset(Dataset):
+    """
+    Images and road masks of a recorded dataset. Masks are decoded from the segmentation PNGs, or read from
+    masks_path, a packed mask file built by packed_masks.build_mask_cache.
+    """
 
-    def __init__(self, dataset_dir: str, split: str = "train"):
+    def __init__(self, dataset_dir: str, split: str = "train", masks_path=None):
         self.dataset_dir = pathlib.Path(dataset_dir)
+        self.masks = PackedMasks(masks_path) if masks_path is not None else None
         self.metadata = pd.read_csv(self.dataset_dir.joinpath('log.csv'))
         self.split = split
         if self.split == "train":
@@ -44,15 +51,24 @@ class SegmentationDataset(Dataset):
     def __len__(self):
         return len(self.metadata)
 
+    def shard(self, rank: int, world_size: int) -> 'SegmentationDataset':
+        self.metadata = self.metadata.iloc[shard_indexes(len(self.metadata), rank, world_size)]
+        return self
+
     def __getitem__(self, idx):
         image = Image.open(self.dataset_dir.joinpath("image", self.metadata['image_filename'].values[idx]))
-        segmentation = Image.open(self.dataset_dir.joinpath("segmentation", self.metadata['segmentation_filename'].values[idx]))
-        segmentation = np.array(segmentation)
-        segmentation = segmentation[:,:,2:] == 255
+        if self.masks is not None:
+            # Masks are stored in the order of log.csv, the index of metadata is the position in log.csv
+            segmentation = self.masks.get_tensor(self.metadata.index.values[idx])
+        else:
+            segmentation = Image.open(self.dataset_dir.joinpath("segmentation", self.metadata['segmentation_filename'].values[idx]))
+            segmentation = np.array(segmentation)
+            segmentation = segmentation[:,:,2:] == 255
+            segmentation = self.y_transform(segmentation).to(torch.float)
         if self.split == "train":
-            return random_flip(self.x_transform(image), self.y_transform(segmentation).to(torch.float))
+            return random_flip(self.x_transform(image), segmentation)
         else:
-            return self.x_transform(image), self.y_transform(segmentation).to(torch.float)
+            return self.x_transform(image), segmentation
 
 
 if __name__ == '__main__':
@@ -66,8 +82,8 @@ if __name__ == '__main__':
     accelerator = ACCELERATOR
     devices = [DEVICE]
 
-    # train_dataset = []
-    # val_dataset = []
+    train_dataset = []
+    val_dataset = []
     # for track, daytime, weather in itertools.product(
     #         ["lake", "jungle", "mountain"],
     #         ["day", "daynight"],
@@ -95,17 +111,12 @@ if __name__ == '__main__':
             SegmentationDataset(dataset_dir=PROJECT_DIR.joinpath(f"udacity_dataset/inpainting_{track}_{weather}_{daytime}"), split="val")
         )
 
-    train_loader = DataLoader(
-        torch.utils.data.ConcatDataset(train_dataset),
+    # Each rank trains on its shard of every dataset
+    data_module = ShardedDataModule(
+        train_dataset=torch.utils.data.ConcatDataset(train_dataset),
+        val_dataset=torch.utils.data.ConcatDataset(val_dataset),
         batch_size=32,
-        shuffle=True,
-        prefetch_factor=2,
-        num_workers=8,
-    )
-    val_loader = DataLoader(
-        torch.utils.data.ConcatDataset(val_dataset),
-        batch_size=16,
-        prefetch_factor=2,
+        val_batch_size=16,
         num_workers=8,
     )
 
@@ -121,8 +132,9 @@ if __name__ == '__main__':
     trainer = pl.Trainer(
         accelerator=accelerator,
         max_epochs=max_epochs,
-        callbacks=[checkpoint_callback, earlystopping_callback],
+        callbacks=[checkpoint_callback, earlystopping_callback, RankSeed(42)],
         devices=devices,
+        use_distributed_sampler=False,
     )
     model_params = {
         'hidden_dims': [64, 128, 256],
@@ -136,7 +148,6 @@ if __name__ == '__main__':
     seg_model = SegmentationUnet(**model_params)
     trainer.fit(
         seg_model,
-        train_dataloaders=train_loader,
-        val_dataloaders=val_loader,
+        datamodule=data_module,
         # ckpt_path=CHECKPOINT_DIR.joinpath("segmentation", "unet", "segmentation_unet_epoch=92_step=94023_val_mIoU=0.9812600612640381_val_loss=0.019919371232390404.ckpt"),
     )
@@ -66,7 +66,8 @@ class SegmentationUnet(pl.LightningModule):
             loss_dict,
             prog_bar=True,
             on_step=self.training,
-            on_epoch=not self.training
+            on_epoch=not self.training,
+            sync_dist=not self.training,
         )
         return loss
 
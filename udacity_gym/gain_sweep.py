@@ -0,0 +1,129 @@
+import collections
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+import tqdm
+
+from .agent import BatchPIDController
+from .logger import CustomLogger
+from .simulator_pool import SimulatorPool
+
+
+def gain_grid(kp_values, kd_values, ki_values) -> list[tuple[float, float, float]]:
+    return list(itertools.product(kp_values, kd_values, ki_values))
+
+
+class GainSweepRunner:
+    """
+    Evaluate PID gain sets on a SimulatorPool. Each simulator drives the car with one gain set at a time,
+    all the simulators are stepped together by a BatchPIDController. A run ends after max_steps steps, or
+    as soon as |cte| stays above max_abs_cte for patience consecutive steps, then the simulator is reset
+    and moves on to the next gain set of the grid.
+    """
+
+    def __init__(self, pool: SimulatorPool, gains: list[tuple[float, float, float]], max_steps: int = 2000,
+                 max_abs_cte: float = 3.0, patience: int = 10, throttle: float = 1.0,
+                 track: str = 'lake', weather: str = 'sunny', daytime: str = 'day'):
+        self.pool = pool
+        self.gains = gains
+        self.max_steps = max_steps
+        self.max_abs_cte = max_abs_cte
+        self.patience = patience
+        self.throttle = throttle
+        self.track = track
+        self.weather = weather
+        self.daytime = daytime
+        self.logger = CustomLogger(str(self.__class__))
+
+    def run(self) -> pd.DataFrame:
+        """
+        Run every gain set and return one row per gain set, best first.
+        Diverged runs are ranked after the completed ones.
+        """
+        num_slots = len(self.pool)
+        pending = collections.deque(enumerate(self.gains))
+        controller = BatchPIDController(0.0, 0.0, 0.0, batch_size=num_slots)
+
+        gain_index = np.full(num_slots, -1)
+        resetting = np.zeros(num_slots, dtype=bool)
+        stepping = np.zeros(num_slots, dtype=bool)
+        cte = np.zeros(num_slots)
+        next_cte = np.zeros(num_slots)
+        sector = np.zeros(num_slots, dtype=np.int64)
+        steps = np.zeros(num_slots, dtype=np.int64)
+        sum_abs_cte = np.zeros(num_slots)
+        sum_squared_cte = np.zeros(num_slots)
+        max_abs_cte = np.zeros(num_slots)
+        steps_off_track = np.zeros(num_slots, dtype=np.int64)
+        results = []
+
+        def start_next_run(slot: int):
+            stepping[slot] = False
+            if len(pending) == 0:
+                return
+            gain_index[slot], (kp, kd, ki) = pending.popleft()
+            controller.set_gains(slot, kp, kd, ki)
+            for statistic in [steps, sum_abs_cte, sum_squared_cte, max_abs_cte, steps_off_track]:
+                statistic[slot] = 0
+            self.pool.submit_reset(slot, self.track, self.weather, self.daytime)
+            resetting[slot] = True
+
+        def update_observation(slot: int, metrics: dict):
+            cte[slot], next_cte[slot], sector[slot] = metrics['cte'], metrics['next_cte'], metrics['sector']
+
+        for slot in range(num_slots):
+            start_next_run(slot)
+
+        start_time = time.perf_counter()
+        with tqdm.tqdm(total=len(self.gains)) as progress:
+            while resetting.any() or stepping.any():
+                # Simulators that completed their reset join the next step
+                for slot in np.flatnonzero(resetting):
+                    if self.pool.ready(slot):
+                        update_observation(slot, self.pool.result(slot))
+                        resetting[slot] = False
+                        stepping[slot] = True
+                if not stepping.any():
+                    time.sleep(0.01)
+                    continue
+
+                active = stepping.copy()
+                steering_angles = controller.step(cte, next_cte, sector, mask=active)
+                for slot in np.flatnonzero(active):
+                    self.pool.submit_step(slot, steering_angles[slot], self.throttle)
+                for slot in np.flatnonzero(active):
+                    update_observation(slot, self.pool.result(slot))
+
+                abs_cte = np.abs(cte)
+                steps[active] += 1
+                sum_abs_cte[active] += abs_cte[active]
+                sum_squared_cte[active] += abs_cte[active] ** 2
+                max_abs_cte[active] = np.maximum(max_abs_cte[active], abs_cte[active])
+                off_track = abs_cte > self.max_abs_cte
+                steps_off_track[active & off_track] += 1
+                steps_off_track[active & ~off_track] = 0
+
+                diverged = active & (steps_off_track >= self.patience)
+                completed = active & (steps >= self.max_steps)
+                for slot in np.flatnonzero(diverged | completed):
+                    kp, kd, ki = self.gains[gain_index[slot]]
+                    results.append({
+                        'kp': kp,
+                        'kd': kd,
+                        'ki': ki,
+                        'steps': int(steps[slot]),
+                        'diverged': bool(diverged[slot]),
+                        'mean_abs_cte': sum_abs_cte[slot] / steps[slot],
+                        'rmse_cte': np.sqrt(sum_squared_cte[slot] / steps[slot]),
+                        'max_abs_cte': max_abs_cte[slot],
+                        'port': self.pool.ports[slot],
+                    })
+                    progress.update(1)
+                    start_next_run(slot)
+
+        self.logger.info(f"Evaluated {len(results)} gain sets in {time.perf_counter() - start_time:.1f}s")
+        return pd.DataFrame(results).sort_values(
+            by=['diverged', 'mean_abs_cte'], ascending=[True, True]
+        ).reset_index(drop=True)
@@ -0,0 +1,171 @@
+import collections
+import os
+import pathlib
+import time
+from typing import Union
+
+from PIL import Image
+
+from .logger import CustomLogger
+from .native_threading import threading
+from .workers import ProcessWorker
+
+
+def write_image(image: Union[Image.Image, bytes], path: pathlib.Path, fsync: bool = False) -> float:
+    """
+    Write a PIL image, or already encoded image bytes, to path and return the CPU time it took.
+    """
+    start_time = time.thread_time()
+    # Write to a temporary file first, a crash never leaves a truncated image under the final name
+    temporary_path = path.with_name(path.name + '.tmp')
+    with open(temporary_path, 'wb') as f:
+        if isinstance(image, bytes):
+            f.write(image)
+        else:
+            image.save(f, format=Image.registered_extensions()[path.suffix.lower()])
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    return time.thread_time() - start_time
+
+
+class WriteStatistics:
+    """
+    Number of frames and CPU time spent writing them, split between encoded and passthrough frames.
+    """
+
+    def __init__(self):
+        self.frames = {'encoded': 0, 'passthrough': 0}
+        self.cpu_time = {'encoded': 0.0, 'passthrough': 0.0}
+
+    def update(self, image: Union[Image.Image, bytes], cpu_time: float):
+        kind = 'passthrough' if isinstance(image, bytes) else 'encoded'
+        self.frames[kind] += 1
+        self.cpu_time[kind] += cpu_time
+
+    def to_dict(self):
+        statistics = {}
+        for kind in self.frames.keys():
+            statistics[f'{kind}_frames'] = self.frames[kind]
+            statistics[f'{kind}_cpu_ms_per_frame'] = (
+                1000 * self.cpu_time[kind] / self.frames[kind] if self.frames[kind] > 0 else 0.0
+            )
+        return statistics
+
+
+class AsyncImageWriter:
+    """
+    Encode and write images in background processes. Images wait in a bounded queue, when the queue
+    is full submit() either blocks (overflow_policy='block') or drops the image (overflow_policy='drop').
+    Images submitted as bytes are written as they are. After flush() every submitted image that was
+    not dropped is on disk.
+    """
+
+    def __init__(self, num_workers: int = 2, max_queue_size: int = 64, overflow_policy: str = 'block',
+                 fsync: bool = True):
+        if overflow_policy not in ['block', 'drop']:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', choose between 'block' and 'drop'")
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.fsync = fsync
+        self.logger = CustomLogger(str(self.__class__))
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.running = 0
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.directories = set()
+        self.write_statistics = WriteStatistics()
+        self.closed = False
+
+        # Each thread feeds its own encoder process, encoding happens outside the GIL of the control loop
+        self.process_workers = [ProcessWorker() for _ in range(num_workers)]
+        self.workers = [threading.Thread(target=self._worker, args=(process_worker,), daemon=True)
+                        for process_worker in self.process_workers]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, image: Union[Image.Image, bytes], path) -> bool:
+        """
+        Queue image to be written at path, return False if the image has been dropped.
+        """
+        if self.closed:
+            raise RuntimeError("AsyncImageWriter is closed")
+        path = pathlib.Path(path)
+        with self.condition:
+            self.submitted += 1
+            if len(self.queue) >= self.max_queue_size:
+                if self.overflow_policy == 'drop':
+                    self.dropped += 1
+                    return False
+                self.condition.wait_for(lambda: len(self.queue) < self.max_queue_size)
+            self.directories.add(path.parent)
+            self.queue.append((image, path))
+            self.condition.notify_all()
+        return True
+
+    def _worker(self, process_worker: ProcessWorker):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) > 0 or self.closed)
+                if len(self.queue) == 0:
+                    return
+                image, path = self.queue.popleft()
+                self.running += 1
+                self.condition.notify_all()
+            try:
+                cpu_time = process_worker.call(write_image, image, path, self.fsync)
+                failed = False
+            except Exception as e:
+                self.logger.error(f"Cannot write image {path}: {e}")
+                failed = True
+            with self.condition:
+                if not failed:
+                    self.write_statistics.update(image, cpu_time)
+                self.running -= 1
+                self.written += int(not failed)
+                self.failed += int(failed)
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'submitted': self.submitted,
+                'written': self.written,
+                'queued': len(self.queue) + self.running,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                **self.write_statistics.to_dict(),
+            }
+
+    def flush(self):
+        """
+        Wait until every queued image is written, then make the new directory entries durable.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.queue) == 0 and self.running == 0)
+            directories, self.directories = self.directories, set()
+        if self.fsync:
+            for directory in directories:
+                directory_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(directory_fd)
+                finally:
+                    os.close(directory_fd)
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        for process_worker in self.process_workers:
+            process_worker.close()
+        stats = self.stats()
+        self.logger.info(f"Image writer closed: {stats['written']} written, {stats['dropped']} dropped, "
+                         f"{stats['failed']} failed")
@@ -0,0 +1,156 @@
+import io
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .logger import CustomLogger
+
+# Shared memory layout: header of uint64 [sequence, stop, frame kind, frame size],
+# telemetry of float64 [steering angle, throttle, speed, cte], then the frame data
+HEADER_SIZE = 4
+TELEMETRY = ['steering', 'throttle', 'speed', 'cte']
+DATA_OFFSET = 8 * (HEADER_SIZE + len(TELEMETRY))
+RAW_FRAME = 0
+JPEG_FRAME = 1
+
+
+class FrameSlot:
+    """
+    Latest frame and telemetry in shared memory, guarded by a sequence lock: the writer makes the
+    sequence odd while it writes, readers retry when the sequence was odd or changed during their copy.
+    The writer never waits for readers.
+    """
+
+    def __init__(self, width: int, height: int, name: str = None):
+        self.width = width
+        self.height = height
+        self.capacity = width * height * 3
+        if name is None:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=DATA_OFFSET + self.capacity)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.uint64, buffer=self.shared_memory.buf)
+        self.telemetry = np.ndarray((len(TELEMETRY),), dtype=np.float64, buffer=self.shared_memory.buf,
+                                    offset=8 * HEADER_SIZE)
+        self.data = np.ndarray((self.capacity,), dtype=np.uint8, buffer=self.shared_memory.buf, offset=DATA_OFFSET)
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    @property
+    def sequence(self) -> int:
+        return int(self.header[0])
+
+    @property
+    def stopped(self) -> bool:
+        return bool(self.header[1])
+
+    def stop(self):
+        self.header[1] = 1
+
+    def write(self, frame, telemetry: list[float]):
+        """
+        Publish frame, either encoded JPEG bytes or a height x width x 3 uint8 array.
+        """
+        if isinstance(frame, bytes):
+            kind, frame = JPEG_FRAME, np.frombuffer(frame, dtype=np.uint8)
+        else:
+            kind, frame = RAW_FRAME, np.asarray(frame, dtype=np.uint8).reshape(-1)
+        if len(frame) > self.capacity:
+            return
+        self.header[0] += 1
+        self.header[2] = kind
+        self.header[3] = len(frame)
+        self.telemetry[:] = telemetry
+        self.data[:len(frame)] = frame
+        self.header[0] += 1
+
+    def read(self, last_sequence: int = -1):
+        """
+        Return (sequence, frame kind, frame bytes, telemetry), None when no frame newer than last_sequence.
+        """
+        while True:
+            sequence = self.sequence
+            if sequence == last_sequence or sequence == 0:
+                return None
+            if sequence % 2 == 1:
+                continue
+            kind, size = int(self.header[2]), int(self.header[3])
+            frame = self.data[:size].tobytes()
+            telemetry = self.telemetry.tolist()
+            if self.sequence == sequence:
+                return sequence, kind, frame, telemetry
+
+    def close(self, unlink: bool = False):
+        del self.header, self.telemetry, self.data
+        self.shared_memory.close()
+        if unlink:
+            self.shared_memory.unlink()
+
+
+def _viewer_loop(name: str, width: int, height: int, max_fps: float, overlay: bool):
+    import pygame
+    from PIL import Image
+
+    frame_slot = FrameSlot(width, height, name=name)
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("Udacity Gym")
+    font = pygame.font.SysFont('monospace', 12)
+    clock = pygame.time.Clock()
+    sequence = -1
+    while not frame_slot.stopped:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                frame_slot.stop()
+        latest = frame_slot.read(sequence)
+        if latest is not None:
+            sequence, kind, frame, telemetry = latest
+            if kind == JPEG_FRAME:
+                pixels = np.asarray(Image.open(io.BytesIO(frame)).convert('RGB'))
+            else:
+                pixels = np.frombuffer(frame, dtype=np.uint8).reshape(height, width, 3)
+            screen.blit(pygame.surfarray.make_surface(np.swapaxes(pixels, 0, 1)), (0, 0))
+            if overlay:
+                for i, (key, value) in enumerate(zip(TELEMETRY, telemetry)):
+                    screen.blit(font.render(f"{key}: {value:+.3f}", True, (255, 255, 0)), (4, 4 + 14 * i))
+            pygame.display.flip()
+        clock.tick(max_fps)
+    pygame.quit()
+    frame_slot.close()
+
+
+class LiveViewer:
+    """
+    Display the latest published frame in a separate process, refreshed at most max_fps times per second.
+    publish() only copies the frame to shared memory, decoding and drawing happen in the viewer process.
+    """
+
+    def __init__(self, width: int = 320, height: int = 160, max_fps: float = 30.0, overlay: bool = True):
+        self.logger = CustomLogger(str(self.__class__))
+        self.frame_slot = FrameSlot(width, height)
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=_viewer_loop, daemon=True,
+                                       args=(self.frame_slot.name, width, height, max_fps, overlay))
+        self.process.start()
+        self.published = 0
+        self.publish_time = 0.0
+
+    def publish(self, frame, steering: float = 0.0, throttle: float = 0.0, speed: float = 0.0, cte: float = 0.0):
+        start_time = time.perf_counter()
+        self.frame_slot.write(frame, [steering, throttle, speed, cte])
+        self.publish_time += time.perf_counter() - start_time
+        self.published += 1
+
+    def close(self):
+        self.frame_slot.stop()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.published > 0:
+            self.logger.info(f"Published {self.published} frames, "
+                             f"{1000 * self.publish_time / self.published:.3f} ms per frame")
+        self.frame_slot.close(unlink=True)
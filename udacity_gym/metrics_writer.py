@@ -0,0 +1,238 @@
+import csv
+import json
+import os
+import pathlib
+import time
+from typing import Callable, Optional
+
+from .logger import CustomLogger
+
+METRICS_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+# Columns that always hold integers, the other numeric columns are written as float64
+INTEGER_COLUMNS = ['time', 'lap', 'sector', 'frame']
+
+
+class MetricsWriter:
+    """
+    Write metrics rows while the episode runs. Rows are buffered and written every flush_every rows
+    or flush_interval seconds, so memory does not grow with the episode length. The columns are fixed
+    by the first flush, index_column first, keys appearing later are ignored. close() writes a
+    <file>.index.json summary next to the metrics file.
+    """
+    format = None
+
+    def __init__(self, path, flush_every: int = 100, flush_interval: float = 5.0, index_column: str = 'time',
+                 fsync: bool = True, before_flush: Optional[Callable] = None):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.index.json')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.index_column = index_column
+        self.fsync = fsync
+        # Called before rows reach the disk, e.g. to make sure the files referenced by the rows exist
+        self.before_flush = before_flush
+        self.logger = CustomLogger(str(self.__class__))
+
+        self.buffer = []
+        self.columns = None
+        self.ignored_columns = set()
+        self.rows = 0
+        self.first_index = None
+        self.last_index = None
+        self.chunks = []
+        self.last_flush_time = time.monotonic()
+        self.closed = False
+
+    def append(self, row: dict):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def _set_columns(self, rows: list[dict]):
+        columns = [self.index_column] if self.index_column in rows[0] else []
+        for row in rows:
+            columns += [key for key in row.keys() if key not in columns]
+        self.columns = columns
+
+    def _select_columns(self, rows: list[dict]) -> list[dict]:
+        for row in rows:
+            for key in row.keys():
+                if key not in self.columns and key not in self.ignored_columns:
+                    self.logger.warning(f"Column {key} is not part of {self.path}, its values are ignored")
+                    self.ignored_columns.add(key)
+        return [{column: row.get(column, None) for column in self.columns} for row in rows]
+
+    def flush(self):
+        self.last_flush_time = time.monotonic()
+        if len(self.buffer) == 0:
+            return
+        rows, self.buffer = self.buffer, []
+        if self.columns is None:
+            self._set_columns(rows)
+        rows = self._select_columns(rows)
+        if self.before_flush is not None:
+            self.before_flush()
+        chunk = self._write_rows(rows)
+        if self.index_column in self.columns:
+            if self.first_index is None:
+                self.first_index = rows[0][self.index_column]
+            self.last_index = rows[-1][self.index_column]
+            chunk['first_index'] = rows[0][self.index_column]
+        chunk['rows'] = len(rows)
+        self.chunks.append(chunk)
+        self.rows += len(rows)
+
+    def _write_rows(self, rows: list[dict]) -> dict:
+        raise NotImplementedError('MetricsWriter does not implement _write_rows')
+
+    def _close_file(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self._close_file()
+        self.closed = True
+        index = {
+            'file': self.path.name,
+            'format': self.format,
+            'rows': self.rows,
+            'columns': self.columns,
+            'index_column': self.index_column,
+            'first_index': self.first_index,
+            'last_index': self.last_index,
+            'chunks': self.chunks,
+            'complete': True,
+        }
+        with open(self.index_path, 'w') as f:
+            json.dump(index, f)
+
+
+class CsvMetricsWriter(MetricsWriter):
+    """
+    Every flush appends complete lines to the file, the rows written before a crash stay readable.
+    With append=True an existing file is extended, keeping its header.
+    """
+    format = 'csv'
+
+    def __init__(self, path, append: bool = False, **kwargs):
+        super().__init__(path, **kwargs)
+        if append and self.path.exists() and self.path.stat().st_size > 0:
+            with open(self.path, 'r', newline='') as f:
+                reader = csv.reader(f)
+                self.columns = next(reader)
+                self.rows = sum(1 for _ in reader)
+            self.file = open(self.path, 'a', newline='')
+        else:
+            self.file = open(self.path, 'w', newline='')
+        self.writer = None
+
+    def _write_rows(self, rows: list[dict]) -> dict:
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.columns)
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+        chunk = {'offset': self.file.tell()}
+        self.writer.writerows(rows)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        return chunk
+
+    def _close_file(self):
+        self.file.close()
+
+
+class ParquetMetricsWriter(MetricsWriter):
+    """
+    Every flush writes a row group, the footer is written by close(). The schema is declared by the
+    first flush and cannot change afterwards, so it does not depend on the values that chunk happens to
+    hold: file name columns, *_filename, and string columns are nullable strings, boolean columns are booleans,
+    INTEGER_COLUMNS are int64 and every other column is float64, including columns that are still
+    empty. column_types, a dict of column name to pyarrow type name, overrides these types.
+    """
+    format = 'parquet'
+
+    def __init__(self, path, column_types: dict = None, **kwargs):
+        super().__init__(path, **kwargs)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required to write metrics in parquet or arrow format")
+        self.pyarrow = pyarrow
+        self.column_types = {
+            **{column: 'int64' for column in INTEGER_COLUMNS},
+            **(column_types or {}),
+        }
+        self.schema = None
+        self.writer = None
+
+    def _column_type(self, column: str, values: list):
+        if column in self.column_types:
+            return self.pyarrow.type_for_alias(self.column_types[column])
+        if column.endswith('_filename'):
+            return self.pyarrow.string()
+        values = [value for value in values if value is not None]
+        if len(values) > 0 and all(isinstance(value, str) for value in values):
+            return self.pyarrow.string()
+        if len(values) > 0 and all(isinstance(value, bool) for value in values):
+            return self.pyarrow.bool_()
+        return self.pyarrow.float64()
+
+    def _to_table(self, rows: list[dict]):
+        if self.schema is None:
+            self.schema = self.pyarrow.schema([
+                (column, self._column_type(column, [row[column] for row in rows])) for column in self.columns
+            ])
+        columns = {}
+        for field in self.schema:
+            values = [row[field.name] for row in rows]
+            # pyarrow truncates floats written to integer columns without any error
+            if self.pyarrow.types.is_integer(field.type):
+                for value in values:
+                    if value is not None and not float(value).is_integer():
+                        raise ValueError(f"Column {field.name} of {self.path} holds integers, got {value}")
+            columns[field.name] = values
+        return self.pyarrow.Table.from_pydict(columns, schema=self.schema)
+
+    def _open_writer(self):
+        return self.pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+    def _write_rows(self, rows: list[dict]) -> dict:
+        table = self._to_table(rows)
+        if self.writer is None:
+            self.writer = self._open_writer()
+        self.writer.write_table(table)
+        return {'batch': len(self.chunks)}
+
+    def _close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ArrowMetricsWriter(ParquetMetricsWriter):
+    """
+    Every flush writes a record batch to an Arrow IPC file, the footer is written by close().
+    """
+    format = 'arrow'
+
+    def _open_writer(self):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(str(self.path), self.schema)
+
+
+def create_metrics_writer(path, format: str = 'csv', **kwargs) -> MetricsWriter:
+    if format == 'csv':
+        return CsvMetricsWriter(path, **kwargs)
+    if format == 'parquet':
+        return ParquetMetricsWriter(path, **kwargs)
+    if format == 'arrow':
+        return ArrowMetricsWriter(path, **kwargs)
+    raise ValueError(f"Unknown metrics format '{format}', choose among {list(METRICS_FORMATS.keys())}")
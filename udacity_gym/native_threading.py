@@ -0,0 +1,9 @@
+# UdacityExecutor monkey patches the standard library with eventlet, turning threading.Thread
+# into green threads that only run when the control loop yields. Background workers that must
+# run alongside the control loop use the original, unpatched threading module exported here.
+try:
+    from eventlet.patcher import original
+
+    threading = original('threading')
+except ImportError:
+    import threading
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Optional, Union
 
 from PIL import Image
 import numpy as np
@@ -18,8 +18,10 @@ class UdacityObservation:
                  lap: int,
                  sector: int,
                  time: int,
+                 input_image_bytes: Optional[bytes] = None,
                  ):
         self.input_image = input_image
+        self._input_image_bytes = input_image_bytes
         self.semantic_segmentation = semantic_segmentation
         self.position = position
         self.steering_angle = steering_angle
@@ -31,6 +33,23 @@ class UdacityObservation:
         self.sector = sector
         self.time = time
 
+    @property
+    def input_image(self) -> Image.Image:
+        return self._input_image
+
+    @input_image.setter
+    def input_image(self, input_image: Image.Image):
+        self._input_image = input_image
+        # The encoded image received from the simulator does not match a replaced image anymore
+        self._input_image_bytes = None
+
+    @property
+    def input_image_bytes(self) -> Optional[bytes]:
+        """
+        JPEG bytes of input_image as sent by the simulator, None if input_image has been replaced.
+        """
+        return self._input_image_bytes
+
     def is_ready(self):
         # return self.input_image is not None and self.semantic_segmentation is not None
         return self.input_image is not None
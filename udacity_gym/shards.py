@@ -0,0 +1,183 @@
+import io
+import os
+import pathlib
+import tarfile
+from typing import Iterator, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from .logger import CustomLogger
+
+# One record per frame in index.bin, offsets point at the member data inside the tar shard.
+# A size of 0 means the frame has no segmentation.
+INDEX_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('shard', '<u4'),
+    ('image_offset', '<u8'),
+    ('image_size', '<u4'),
+    ('segmentation_offset', '<u8'),
+    ('segmentation_size', '<u4'),
+])
+
+
+def encode_image(image: Union[Image.Image, bytes], format: str) -> bytes:
+    if isinstance(image, bytes):
+        return image
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class ShardWriter:
+    """
+    Append frames to tar shards named shard_00000.tar, shard_00001.tar, ... A new shard is started once
+    the current one exceeds max_shard_size bytes. The offset of every frame is appended to index.bin,
+    after the frame data has been flushed, so the index never points past the end of a shard.
+    """
+
+    def __init__(self, path, max_shard_size: int = 1 << 30, fsync: bool = True):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path.joinpath('index.bin')
+        self.max_shard_size = max_shard_size
+        self.fsync = fsync
+        self.logger = CustomLogger(str(self.__class__))
+
+        self.shard = -1
+        self.tar = None
+        self.index_file = open(self.index_path, 'wb')
+        self.records = []
+        self.frames = 0
+        self.closed = False
+        self._next_shard()
+
+    def _shard_path(self, shard: int) -> pathlib.Path:
+        return self.path.joinpath(f"shard_{shard:05d}.tar")
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.flush()
+            self.tar.close()
+        self.shard += 1
+        self.tar = tarfile.open(self._shard_path(self.shard), 'w', format=tarfile.USTAR_FORMAT)
+
+    def _add_member(self, name: str, data: bytes, mtime: float) -> int:
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = len(data)
+        tar_info.mtime = mtime
+        self.tar.addfile(tar_info, io.BytesIO(data))
+        # Member data is padded to a multiple of the tar block size
+        padded_size = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        return self.tar.offset - padded_size
+
+    def write(self, time: int, image: Union[Image.Image, bytes],
+              segmentation: Optional[Union[Image.Image, bytes]] = None) -> int:
+        """
+        Append a frame, image is stored as JPEG and segmentation as PNG. Encoded bytes are stored as they are.
+        Return the frame index.
+        """
+        if self.closed:
+            raise RuntimeError("ShardWriter is closed")
+        if self.tar.offset >= self.max_shard_size:
+            self._next_shard()
+        record = np.zeros((), dtype=INDEX_DTYPE)
+        record['time'] = time
+        record['shard'] = self.shard
+        image_bytes = encode_image(image, 'JPEG')
+        record['image_offset'] = self._add_member(f"image_{time:020d}.jpg", image_bytes, time / 1000)
+        record['image_size'] = len(image_bytes)
+        if segmentation is not None:
+            segmentation_bytes = encode_image(segmentation, 'PNG')
+            record['segmentation_offset'] = self._add_member(
+                f"segmentation_{time:020d}.png", segmentation_bytes, time / 1000
+            )
+            record['segmentation_size'] = len(segmentation_bytes)
+        self.records.append(record)
+        self.frames += 1
+        return self.frames - 1
+
+    def flush(self):
+        """
+        Make the frames written so far durable, then append their index records.
+        """
+        self.tar.fileobj.flush()
+        if self.fsync:
+            os.fsync(self.tar.fileobj.fileno())
+        if len(self.records) > 0:
+            self.index_file.write(np.stack(self.records).tobytes())
+            self.records = []
+        self.index_file.flush()
+        if self.fsync:
+            os.fsync(self.index_file.fileno())
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.tar.close()
+        self.index_file.close()
+        self.closed = True
+        self.logger.info(f"Wrote {self.frames} frames in {self.shard + 1} shards to {self.path}")
+
+
+class ShardReader:
+    """
+    Read frames written by ShardWriter, either by frame index or streaming them in recording order.
+    Shards are read with pread, a reader can be shared among threads and DataLoader workers.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.index = np.fromfile(self.path.joinpath('index.bin'), dtype=INDEX_DTYPE)
+        self.file_descriptors = {}
+        self.pid = os.getpid()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _file_descriptor(self, shard: int) -> int:
+        # Descriptors opened before a fork share their state with the parent, open new ones
+        if self.pid != os.getpid():
+            self.file_descriptors = {}
+            self.pid = os.getpid()
+        if shard not in self.file_descriptors:
+            self.file_descriptors[shard] = os.open(self.path.joinpath(f"shard_{shard:05d}.tar"), os.O_RDONLY)
+        return self.file_descriptors[shard]
+
+    def _read(self, shard: int, offset: int, size: int) -> bytes:
+        return os.pread(self._file_descriptor(int(shard)), int(size), int(offset))
+
+    def read_image_bytes(self, index: int) -> bytes:
+        record = self.index[index]
+        return self._read(record['shard'], record['image_offset'], record['image_size'])
+
+    def read_segmentation_bytes(self, index: int) -> Optional[bytes]:
+        record = self.index[index]
+        if record['segmentation_size'] == 0:
+            return None
+        return self._read(record['shard'], record['segmentation_offset'], record['segmentation_size'])
+
+    def read_image(self, index: int) -> Image.Image:
+        return Image.open(io.BytesIO(self.read_image_bytes(index)))
+
+    def read_segmentation(self, index: int) -> Optional[Image.Image]:
+        segmentation_bytes = self.read_segmentation_bytes(index)
+        if segmentation_bytes is None:
+            return None
+        return Image.open(io.BytesIO(segmentation_bytes))
+
+    def __getitem__(self, index: int) -> tuple[Image.Image, Optional[Image.Image]]:
+        return self.read_image(index), self.read_segmentation(index)
+
+    def stream(self, start: int = 0, stop: Optional[int] = None) -> Iterator[tuple[int, bytes, Optional[bytes]]]:
+        """
+        Yield (time, image bytes, segmentation bytes) in recording order, reading each shard front to back.
+        """
+        for index in range(start, len(self) if stop is None else stop):
+            yield int(self.index[index]['time']), self.read_image_bytes(index), self.read_segmentation_bytes(index)
+
+    def close(self):
+        for file_descriptor in self.file_descriptors.values():
+            os.close(file_descriptor)
+        self.file_descriptors = {}
@@ -0,0 +1,138 @@
+import os
+import signal
+import time
+
+from .action import UdacityAction
+from .workers import ProcessWorker
+
+# Environment owned by a simulator worker process
+_environment = None
+
+
+def _start_environment(sim_exe_path: str, host: str, port: int):
+    global _environment
+    from .gym import UdacityGym
+    from .simulator import UdacitySimulator
+    simulator = UdacitySimulator(sim_exe_path=sim_exe_path, host=host, port=port)
+    _environment = UdacityGym(simulator=simulator)
+    simulator.start()
+    # The Unity process outlives a worker process that crashes, the pool kills it before a restart
+    return simulator.sim_process.process.pid if simulator.sim_process.process is not None else None
+
+
+def wait_for_next_observation(environment, observation, last_observation, timeout: float = 10.0,
+                              poll_interval: float = 0.0025):
+    """
+    Poll environment until it returns a frame newer than last_observation. A simulator that stalled or
+    disconnected never sends one, TimeoutError is raised after timeout seconds instead of waiting forever.
+    """
+    deadline = time.monotonic() + timeout
+    while observation.time == last_observation.time:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No new observation from the simulator in {timeout}s")
+        time.sleep(poll_interval)
+        observation = environment.observe()
+    return observation
+
+
+def _reset_environment(track: str, weather: str, daytime: str, timeout: float = 60.0, poll_interval: float = 0.1):
+    observation, _ = _environment.reset(track=track, weather=weather, daytime=daytime)
+    deadline = time.monotonic() + timeout
+    while not observation or not observation.is_ready():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The simulator sent no observation in {timeout}s after the reset")
+        time.sleep(poll_interval)
+        observation = _environment.observe()
+    return observation.get_metrics()
+
+
+def _step_environment(steering_angle: float, throttle: float, timeout: float = 10.0):
+    last_observation = _environment.observe()
+    observation, reward, terminated, truncated, info = _environment.step(
+        UdacityAction(steering_angle=steering_angle, throttle=throttle)
+    )
+    # Wait for the simulator to answer with a new frame
+    return wait_for_next_observation(_environment, observation, last_observation, timeout=timeout).get_metrics()
+
+
+def _call_with_environment(function, *args, **kwargs):
+    return function(_environment, *args, **kwargs)
+
+
+def _close_environment():
+    _environment.close()
+
+
+class SimulatorPool:
+    """
+    Pool of simulators, each one driven by its own worker process and listening on its own port.
+    Every process has its own simulator state, so environments do not interfere with each other.
+    Steps return observation metrics only, frames stay in the worker processes. A step without a new
+    frame within step_timeout seconds, or a reset without an observation within reset_timeout seconds,
+    fails with the TimeoutError raised in the worker.
+    """
+
+    def __init__(self, sim_exe_path: str, num_simulators: int, host: str = "127.0.0.1", base_port: int = 4567,
+                 step_timeout: float = 10.0, reset_timeout: float = 60.0):
+        self.sim_exe_path = sim_exe_path
+        self.host = host
+        self.step_timeout = step_timeout
+        self.reset_timeout = reset_timeout
+        self.ports = [base_port + i for i in range(num_simulators)]
+        self.workers = [ProcessWorker(daemon=False) for _ in self.ports]
+        for worker, port in zip(self.workers, self.ports):
+            worker.submit(_start_environment, sim_exe_path, host, port)
+        self.simulator_pids = [worker.result() for worker in self.workers]
+
+    def __len__(self):
+        return len(self.workers)
+
+    def submit_reset(self, index: int, track: str = 'lake', weather: str = 'sunny', daytime: str = 'day'):
+        self.workers[index].submit(_reset_environment, track, weather, daytime, self.reset_timeout)
+
+    def submit_step(self, index: int, steering_angle: float, throttle: float):
+        self.workers[index].submit(_step_environment, float(steering_angle), float(throttle), self.step_timeout)
+
+    def submit_call(self, index: int, function, *args, **kwargs):
+        """
+        Run function(environment, *args, **kwargs) in the worker process of simulator index.
+        function must be importable by the worker process.
+        """
+        self.workers[index].submit(_call_with_environment, function, *args, **kwargs)
+
+    def ready(self, index: int) -> bool:
+        return self.workers[index].ready()
+
+    def result(self, index: int) -> dict:
+        return self.workers[index].result()
+
+    def restart(self, index: int):
+        """
+        Replace the worker process of simulator index, e.g. after it died, and start a new simulator on its port.
+        """
+        self.workers[index].close()
+        if self.simulator_pids[index] is not None:
+            try:
+                os.kill(self.simulator_pids[index], signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.workers[index] = ProcessWorker(daemon=False)
+        self.simulator_pids[index] = self.workers[index].call(_start_environment, self.sim_exe_path, self.host,
+                                                              self.ports[index])
+
+    def reset(self, track: str = 'lake', weather: str = 'sunny', daytime: str = 'day') -> list[dict]:
+        for index in range(len(self)):
+            self.submit_reset(index, track, weather, daytime)
+        return [self.result(index) for index in range(len(self))]
+
+    def step(self, steering_angles, throttles) -> list[dict]:
+        for index, (steering_angle, throttle) in enumerate(zip(steering_angles, throttles)):
+            self.submit_step(index, steering_angle, throttle)
+        return [self.result(index) for index in range(len(self))]
+
+    def close(self):
+        for worker in self.workers:
+            worker.submit(_close_environment)
+        for worker in self.workers:
+            worker.result()
+            worker.close()
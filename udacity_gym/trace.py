@@ -0,0 +1,167 @@
+import collections
+import concurrent.futures
+import io
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from .agent_callback import AgentCallback
+from .logger import CustomLogger
+from .metrics_writer import create_metrics_writer
+from .observation import UdacityObservation
+from .shards import ShardReader, ShardWriter
+
+
+class TraceRecorder:
+    """
+    Record the observations received by an agent and the actions it emits. Add before_action_callback to
+    the before action callbacks and after_action_callback to the after action callbacks of the agent.
+    Frames are stored as received in tar shards, observation and action values in trace.csv.
+    """
+
+    def __init__(self, path, max_shard_size: int = 1 << 30):
+        self.path = pathlib.Path(path)
+        self.shard_writer = ShardWriter(self.path, max_shard_size=max_shard_size)
+        self.metrics_writer = create_metrics_writer(self.path.joinpath('trace.csv'), index_column='frame',
+                                                    before_flush=self.shard_writer.flush)
+        self.row = None
+        self.start_time = None
+        self.before_action_callback = _TraceCallback('trace_observation', self.record_observation)
+        self.after_action_callback = _TraceCallback('trace_action', self.record_action)
+
+    def record_observation(self, observation: UdacityObservation, *args, **kwargs):
+        image = observation.input_image_bytes if observation.input_image_bytes is not None else \
+            observation.input_image
+        frame = self.shard_writer.write(observation.time, image, observation.semantic_segmentation)
+        self.row = {'frame': frame, **observation.get_metrics(), 'throttle': observation.throttle}
+        self.start_time = time.perf_counter()
+
+    def record_action(self, observation: UdacityObservation, *args, **kwargs):
+        action = kwargs['action']
+        self.row['action_latency'] = time.perf_counter() - self.start_time
+        self.row['predicted_steering_angle'] = action.steering_angle
+        self.row['predicted_throttle'] = action.throttle
+        self.metrics_writer.append(self.row)
+        self.row = None
+
+    def close(self):
+        self.metrics_writer.close()
+        self.shard_writer.close()
+
+
+class _TraceCallback(AgentCallback):
+
+    def __init__(self, name: str, record):
+        super().__init__(name)
+        self.record = record
+
+    def __call__(self, observation: UdacityObservation, *args, **kwargs):
+        super().__call__(observation, *args, **kwargs)
+        self.record(observation, *args, **kwargs)
+
+
+class TraceReplayer:
+    """
+    Feed the observations of a trace recorded by TraceRecorder to an agent, as fast as it can process them.
+    Observations are decoded by a background thread a bounded number of frames ahead of the agent, and
+    only the agent calls are timed, so the replay measures the agent without holding the whole trace
+    in memory.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.trace = pd.read_csv(self.path.joinpath('trace.csv'))
+        self.shard_reader = ShardReader(self.path)
+        self.logger = CustomLogger(str(self.__class__))
+
+    def __len__(self):
+        return len(self.trace)
+
+    def observation(self, index: int) -> UdacityObservation:
+        row = self.trace.iloc[index]
+        frame = int(row['frame'])
+        image_bytes = self.shard_reader.read_image_bytes(frame)
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+        segmentation = self.shard_reader.read_segmentation(frame)
+        if segmentation is not None:
+            segmentation.load()
+        return UdacityObservation(
+            input_image=image,
+            semantic_segmentation=segmentation,
+            position=(row['pos_x'], row['pos_y'], row['pos_z']),
+            steering_angle=row['steering_angle'],
+            throttle=row['throttle'],
+            speed=row['speed'],
+            cte=row['cte'],
+            next_cte=row['next_cte'],
+            lap=int(row['lap']),
+            sector=int(row['sector']),
+            time=int(row['time']),
+            input_image_bytes=image_bytes if image.format == 'JPEG' else None,
+        )
+
+    def observations(self, prefetch: int = 64):
+        """
+        Yield the recorded observations in order, decoded at most prefetch frames ahead.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            pending = collections.deque()
+            try:
+                for index in range(len(self)):
+                    pending.append(executor.submit(self.observation, index))
+                    if len(pending) > prefetch:
+                        yield pending.popleft().result()
+                while len(pending) > 0:
+                    yield pending.popleft().result()
+            finally:
+                # Frames not decoded yet when the consumer stops are never decoded
+                for future in pending:
+                    future.cancel()
+
+    def replay(self, agent, prefetch: int = 64) -> pd.DataFrame:
+        """
+        Run agent on every recorded observation, in order, and return the recorded and replayed actions.
+        """
+        steering_angles = np.zeros(len(self))
+        throttles = np.zeros(len(self))
+        latencies = np.zeros(len(self))
+        for index, observation in enumerate(self.observations(prefetch)):
+            step_time = time.perf_counter()
+            action = agent(observation)
+            latencies[index] = time.perf_counter() - step_time
+            steering_angles[index], throttles[index] = action.steering_angle, action.throttle
+        agent_time = latencies.sum()
+        self.logger.info(f"Replayed {len(self)} frames in {agent_time:.2f}s of agent time, "
+                         f"{len(self) / agent_time if agent_time > 0 else 0.0:.1f} frames/s")
+        return pd.DataFrame({
+            'frame': self.trace['frame'],
+            'recorded_steering_angle': self.trace['predicted_steering_angle'],
+            'recorded_throttle': self.trace['predicted_throttle'],
+            'replayed_steering_angle': steering_angles,
+            'replayed_throttle': throttles,
+            'recorded_latency': self.trace['action_latency'],
+            'replayed_latency': latencies,
+        })
+
+    def compare(self, agent, tolerance: float = 1e-6) -> dict:
+        """
+        Replay the trace and summarize how far the replayed actions are from the recorded ones.
+        """
+        replay = self.replay(agent)
+        steering_error = (replay['replayed_steering_angle'] - replay['recorded_steering_angle']).abs()
+        throttle_error = (replay['replayed_throttle'] - replay['recorded_throttle']).abs()
+        return {
+            'frames': len(replay),
+            'max_steering_error': float(steering_error.max()),
+            'max_throttle_error': float(throttle_error.max()),
+            'mismatched_frames': int(((steering_error > tolerance) | (throttle_error > tolerance)).sum()),
+            'recorded_frames_per_second': float(1 / replay['recorded_latency'].mean()),
+            'replayed_frames_per_second': float(1 / replay['replayed_latency'].mean()),
+        }
+
+    def close(self):
+        self.shard_reader.close()
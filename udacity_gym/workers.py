@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import traceback
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs the process may run on, fewer than os.cpu_count() when it is pinned to a subset of cores.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def _process_worker_loop(connection):
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        function, args, kwargs = job
+        try:
+            connection.send((True, function(*args, **kwargs)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+class ProcessWorker:
+    """
+    Child process executing the functions it receives, one call at a time.
+    It talks over a plain pipe: the helper threads of multiprocessing queues and pools are
+    turned into green threads by the eventlet monkey patching of UdacityExecutor and stall
+    whenever the control loop does not yield.
+    """
+
+    def __init__(self, start_method: str = 'spawn', daemon: bool = True):
+        context = multiprocessing.get_context(start_method)
+        self.connection, child_connection = context.Pipe()
+        # Under eventlet monkey patching the pipe is built from green, non-blocking sockets
+        for connection in [self.connection, child_connection]:
+            os.set_blocking(connection.fileno(), True)
+        # Daemon processes cannot start children, as the simulator executor and state manager do
+        self.process = context.Process(target=_process_worker_loop, args=(child_connection,), daemon=daemon)
+        self.process.start()
+        child_connection.close()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Start a call without waiting for it, its value is returned by the next result().
+        """
+        self.connection.send((function, args, kwargs))
+
+    def ready(self) -> bool:
+        return self.connection.poll()
+
+    def result(self):
+        success, result = self.connection.recv()
+        if not success:
+            raise RuntimeError(f"Call failed in worker process:\n{result}")
+        return result
+
+    def call(self, function, *args, **kwargs):
+        self.submit(function, *args, **kwargs)
+        return self.result()
+
+    def close(self, timeout: float = 10.0):
+        """
+        Stop the process, terminating it if it does not exit within timeout seconds. Closing never raises
+        for a process that already died: it is called in finally blocks, where an error would replace the
+        one that is being handled.
+        """
+        try:
+            self.connection.send(None)
+        except OSError:
+            # The process is gone and the other end of the pipe with it
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()